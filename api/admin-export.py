@@ -0,0 +1,53 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from . import responses
+from .export import CONTENT_TYPES, export_filename, export_users
+from .logs import get_logger
+from .shared import users_db, reject_unless_admin, metrics
+
+logger = get_logger("auth.export")
+
+def parse_bool(value):
+    if value is None:
+        return None
+    if value.lower() in ("true", "1", "yes"):
+        return True
+    if value.lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"expected true or false, got {value}")
+
+@metrics.instrument_handler("/api/admin/export")
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            if reject_unless_admin(self):
+                return
+            query = {k: v[-1] for k, v in parse_qs(urlsplit(self.path).query).items()}
+            fmt = query.get("format", "ndjson")
+            try:
+                if fmt not in CONTENT_TYPES:
+                    raise ValueError(f"format must be one of {', '.join(CONTENT_TYPES)}")
+                compress = bool(parse_bool(query.get("gzip")))
+                hashes = bool(parse_bool(query.get("hashes")))
+                is_verified = parse_bool(query.get("is_verified"))
+            except ValueError as e:
+                responses.send_error(self, 400, str(e))
+                return
+            
+            logger.info("export.started", format=fmt, gzip=compress, hashes=hashes)
+            responses.start_stream(
+                self, 200, "application/gzip" if compress else CONTENT_TYPES[fmt],
+                (("Content-Disposition", f'attachment; filename="{export_filename(fmt, compress)}"'),),
+            )
+            try:
+                for chunk in export_users(users_db, fmt, hashes, compress, is_verified):
+                    self.wfile.write(chunk)
+            except Exception:
+                # Headers are already out; the truncated body is all the client gets.
+                logger.exception("export.failed")
+            
+        except Exception as e:
+            responses.send_error(self, 500, str(e))
+    
+    def do_OPTIONS(self):
+        responses.send(self, responses.PREFLIGHT_GET)
@@ -0,0 +1,76 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import io
+import os
+import tempfile
+from . import responses
+from .logs import get_logger
+from .shared import (users_db, user_ids, password_hasher, generate_verification_code, queue_verification_emails,
+                     reject_unless_admin, metrics)
+
+logger = get_logger("auth.import")
+
+SPOOL_BYTES = 8 * 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+def parse_flag(value):
+    return (value or "").lower() in ("true", "1", "yes")
+
+@metrics.instrument_handler("/api/admin/import")
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            if reject_unless_admin(self):
+                return
+            # bulk_import pulls in email_validator; import it only once an
+            # admin is actually importing, not on every cold start.
+            from .bulk_import import BulkImporter, FORMATS, read_records
+            query = {k: v[-1] for k, v in parse_qs(urlsplit(self.path).query).items()}
+            fmt = query.get("format") or ("csv" if "csv" in self.headers.get("Content-Type", "") else "ndjson")
+            if fmt not in FORMATS:
+                responses.send_error(self, 400, f"format must be one of {', '.join(FORMATS)}")
+                return
+            send_emails = parse_flag(query.get("send_emails"))
+            workers = os.getenv("IMPORT_HASH_WORKERS")
+            importer = BulkImporter(
+                users_db,
+                rounds=password_hasher.rounds,
+                workers=int(workers) if workers else None,
+                chunk_size=int(os.getenv("IMPORT_CHUNK_SIZE", "500")),
+                mark_verified=parse_flag(query.get("verified")),
+                issue_code=generate_verification_code if send_emails else None,
+                on_imported=queue_verification_emails if send_emails else None,
+                ids=user_ids,
+                hasher=password_hasher,
+            )
+            
+            # Large uploads spill to disk instead of being held in memory.
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+                remaining = int(self.headers.get('Content-Length', 0))
+                while remaining > 0:
+                    data = self.rfile.read(min(READ_CHUNK, remaining))
+                    if not data:
+                        break
+                    spool.write(data)
+                    remaining -= len(data)
+                spool.seek(0)
+                records = read_records(io.TextIOWrapper(spool, encoding="utf-8", newline=""), fmt)
+                
+                responses.start_stream(self, 200, 'application/x-ndjson')
+                progress = None
+                try:
+                    for progress in importer.iter_import(records):
+                        self.wfile.write(responses.dumps(progress.as_dict()) + b"\n")
+                except Exception as e:
+                    # Headers are already out; report the failure in-band.
+                    logger.exception("import.failed")
+                    self.wfile.write(responses.dumps({"error": str(e)}) + b"\n")
+                    return
+            if progress is not None:
+                logger.info("import.finished", **{k: v for k, v in progress.as_dict().items() if k != "errors"})
+            
+        except Exception as e:
+            responses.send_error(self, 500, str(e))
+    
+    def do_OPTIONS(self):
+        responses.send(self, responses.PREFLIGHT_POST)
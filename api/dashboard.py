@@ -1,48 +1,42 @@
 from http.server import BaseHTTPRequestHandler
-from .shared import users_db, get_current_user_from_token
+from . import responses
+from .shared import get_token_claims, user_from_claims, send_conditional, versions, metrics, AuthError
+from .storage import normalize_email
 
+@metrics.instrument_handler("/api/dashboard")
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
-        import json
-        
         try:
             auth_header = self.headers.get('authorization') or self.headers.get('Authorization')
             
             if not auth_header or not auth_header.startswith('Bearer '):
-                self.send_response(401)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Could not validate credentials"}).encode())
+                responses.send(self, responses.NOT_AUTHENTICATED)
                 return
             
             token = auth_header.split(' ')[1]
-            current_user = get_current_user_from_token(token)
+            payload = get_token_claims(token)
+            email = normalize_email(payload["sub"])
             
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
-                "message": f"Welcome to your dashboard, {current_user['email']}!",
-                "user": {
-                    "id": current_user["id"],
-                    "email": current_user["email"],
-                    "is_verified": current_user["is_verified"],
-                    "created_at": current_user["created_at"].isoformat()
+            def build():
+                current_user = user_from_claims(payload)
+                return {
+                    "message": f"Welcome to your dashboard, {current_user['email']}!",
+                    "user": {
+                        "id": current_user["id"],
+                        "email": current_user["email"],
+                        "is_verified": current_user["is_verified"],
+                        "created_at": current_user["created_at"].isoformat()
+                    }
                 }
-            }).encode())
+            
+            # Read the version before the record, so a body never outlives its tag.
+            send_conditional(self, ("dashboard", email), versions.user(email), build)
+            
+        except AuthError as e:
+            responses.send_error(self, e.status_code, e.detail, (("WWW-Authenticate", "Bearer"),))
             
         except Exception as e:
-            self.send_response(401)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": "Could not validate credentials"}).encode())
+            responses.send_error(self, 500, str(e))
     
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+        responses.send(self, responses.PREFLIGHT_GET)
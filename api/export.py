@@ -0,0 +1,132 @@
+"""Streaming user export to NDJSON or CSV, optionally gzipped.
+
+Users come from ``UserStore.iter_snapshot``, a point-in-time view that
+does not hold up concurrent signups, and are encoded a few thousand rows
+at a time into byte chunks. Memory use is flat however many users there
+are. With ``include_hashes`` the bcrypt hash is exported as ``password``,
+which ``app.bulk_import`` reads back as-is.
+
+From ``auth-backend/``, against the store selected by ``USER_STORE``:
+
+    python -m app.export --format csv --gzip -o users.csv.gz
+
+The journal store can only be opened by one process, so stop the server
+first; the sqlite store can be exported while it runs.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import zlib
+from typing import Iterable, Iterator, List, Optional
+
+from .storage import UserRecord, UserStore, create_user_store
+
+FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+BASE_FIELDS = ("id", "email", "is_verified", "created_at")
+ROWS_PER_CHUNK = 2000
+
+
+def export_fields(include_hashes: bool = False) -> List[str]:
+    return list(BASE_FIELDS) + (["password"] if include_hashes else [])
+
+
+def _row(user: UserRecord, include_hashes: bool) -> list:
+    row = [user.id, user.email, user.is_verified, user.created_at.isoformat()]
+    if include_hashes:
+        row.append(user.password)
+    return row
+
+
+def encode_ndjson(users: Iterable[UserRecord], include_hashes: bool = False) -> Iterator[bytes]:
+    fields = export_fields(include_hashes)
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    batch: List[str] = []
+    for user in users:
+        batch.append(dumps(dict(zip(fields, _row(user, include_hashes)))))
+        if len(batch) >= ROWS_PER_CHUNK:
+            yield ("\n".join(batch) + "\n").encode()
+            batch = []
+    if batch:
+        yield ("\n".join(batch) + "\n").encode()
+
+
+def encode_csv(users: Iterable[UserRecord], include_hashes: bool = False) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(export_fields(include_hashes))
+    rows = 0
+    for user in users:
+        row = _row(user, include_hashes)
+        row[2] = "true" if row[2] else "false"
+        writer.writerow(row)
+        rows += 1
+        if rows >= ROWS_PER_CHUNK:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a stream of byte chunks into one gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_users(
+    store: UserStore,
+    fmt: str = "ndjson",
+    include_hashes: bool = False,
+    compress: bool = False,
+    is_verified: Optional[bool] = None,
+) -> Iterator[bytes]:
+    """Byte chunks of the whole store, encoded as ``fmt``."""
+    if fmt == "ndjson":
+        chunks = encode_ndjson(store.iter_snapshot(is_verified), include_hashes)
+    elif fmt == "csv":
+        chunks = encode_csv(store.iter_snapshot(is_verified), include_hashes)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(fmt: str, compress: bool) -> str:
+    return f"users.{fmt}" + (".gz" if compress else "")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export the user store as NDJSON or CSV")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--hashes", action="store_true", help="include password hashes")
+    parser.add_argument("--verified", choices=("true", "false"), help="only verified or unverified users")
+    parser.add_argument("-o", "--output", default="-", help="output file, or - for stdout")
+    args = parser.parse_args()
+
+    if os.getenv("USER_STORE", "memory").lower() == "memory":
+        parser.error("USER_STORE=memory keeps users inside the server process; "
+                     "use the sqlite or journal store, or GET /api/admin/export")
+    store = create_user_store(".")
+    is_verified = None if args.verified is None else args.verified == "true"
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in export_users(store, args.format, args.hashes, args.gzip, is_verified):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
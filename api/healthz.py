@@ -1,18 +1,11 @@
 from http.server import BaseHTTPRequestHandler
+from . import responses
+
+HEALTHY = responses.static_json(200, {"status": "ok"})
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
-        import json
-        
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "ok"}).encode())
+        responses.send(self, HEALTHY)
     
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+        responses.send(self, responses.PREFLIGHT_GET)
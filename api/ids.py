@@ -0,0 +1,200 @@
+"""Time-ordered user ids that never repeat.
+
+``IdGenerator`` hands out Snowflake-style integers that fit in 63 bits,
+so they survive a signed 64-bit column: 41 bits of milliseconds since
+``EPOCH_MS`` (enough until 2093), then the worker id, the generating
+thread's slot and a per-millisecond sequence. Every thread keeps its own clock and sequence,
+so issuing an id takes no lock and ids from one thread always increase;
+ids from different threads and workers sort by the millisecond they
+were made in.
+
+Thread slots are handed back when a thread exits and reused by later
+threads, so the slot field only has to cover the threads alive at once.
+
+Workers that share a user store need distinct worker ids. Given the
+store's ``worker_id_dir()``, the generator claims a free id there with
+``claim_worker_id`` and holds it until the process exits; a forked child
+claims its own on first use. ``ID_WORKER`` then asks for one particular
+id and fails if another process holds it. A store only this process
+writes to gets ``ID_WORKER``, or a random id.
+"""
+import fcntl
+import itertools
+import os
+import secrets
+import threading
+import time
+import weakref
+from collections import deque
+from typing import IO, Dict, Optional, Tuple
+
+# 2024-01-01T00:00:00Z
+EPOCH_MS = 1704067200000
+
+TIME_BITS = 41
+WORKER_BITS = 10
+# Up to 256 threads issuing ids at once, each up to 16 per millisecond.
+SLOT_BITS = 8
+SEQUENCE_BITS = 4
+assert TIME_BITS + WORKER_BITS + SLOT_BITS + SEQUENCE_BITS == 63, "ids must fit in a signed 64-bit integer"
+
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SLOT = (1 << SLOT_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+_SLOT_SHIFT = SEQUENCE_BITS
+_WORKER_SHIFT = SLOT_BITS + SEQUENCE_BITS
+_TIME_SHIFT = WORKER_BITS + SLOT_BITS + SEQUENCE_BITS
+
+
+class _ThreadState:
+    __slots__ = ("slot", "last_ms", "sequence")
+
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.last_ms = -1
+        self.sequence = 0
+
+
+class _Lease:
+    __slots__ = ("__weakref__",)
+
+
+def claim_worker_id(directory: str, worker: Optional[int] = None) -> Tuple[int, IO[bytes]]:
+    """Lock a worker id that no other live process using ``directory`` holds.
+
+    Every id is a file in ``directory`` held with ``flock``. The lock lasts
+    as long as the returned file stays open in any process, so the ids of
+    processes that died are free again. With ``worker``, only that id is
+    tried. Raises ``RuntimeError`` if no id could be claimed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for candidate in range(MAX_WORKER + 1) if worker is None else (worker,):
+        handle = open(os.path.join(directory, str(candidate)), "a+b")
+        try:
+            # flock, unlike lockf, also conflicts between two claims made by
+            # one process, and a forked child does not get to keep its own.
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        return candidate, handle
+    if worker is None:
+        raise RuntimeError(f"all {MAX_WORKER + 1} worker ids in {directory} are in use")
+    raise RuntimeError(f"worker id {worker} in {directory} is already in use")
+
+
+class IdGenerator:
+    def __init__(self, worker_id: Optional[int] = None, claim_dir: Optional[str] = None):
+        if worker_id is not None and not 0 <= worker_id <= MAX_WORKER:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER}")
+        self._fixed_worker = worker_id
+        self._claim_dir = claim_dir
+        self._claim: Optional[IO[bytes]] = None
+        self._reset()
+        if claim_dir is not None:
+            # Claim now so a clash with ID_WORKER fails at startup.
+            self._claim_worker()
+        if hasattr(os, "register_at_fork"):
+            # A forked child would otherwise repeat the parent's ids.
+            os.register_at_fork(after_in_child=self._reset)
+
+    @classmethod
+    def from_env(cls, store=None) -> "IdGenerator":
+        """Build from ``ID_WORKER``, claiming the worker id through ``store``
+        if it is shared between processes."""
+        worker = os.getenv("ID_WORKER")
+        claim_dir = store.worker_id_dir() if store is not None else None
+        return cls(int(worker) if worker else None, claim_dir)
+
+    def _reset(self) -> None:
+        if self._claim_dir is not None:
+            if self._claim is not None:
+                # Only this process's descriptor; the parent keeps its id.
+                self._claim.close()
+                self._claim = None
+            # Claimed by the first thread that issues an id.
+            self.worker_id: Optional[int] = None
+            self._worker_bits = 0
+            self._claim_lock = threading.Lock()
+        else:
+            worker = self._fixed_worker
+            self.worker_id = secrets.randbelow(MAX_WORKER + 1) if worker is None else worker
+            self._worker_bits = self.worker_id << _WORKER_SHIFT
+        self._local = threading.local()
+        # deque.append/pop and next() on a count are atomic, so handing out
+        # slots needs no lock either.
+        self._slots = itertools.count()
+        self._free: "deque[_ThreadState]" = deque()
+        self.thread_slots = 0
+
+    def _claim_worker(self) -> None:
+        with self._claim_lock:
+            if self.worker_id is None:
+                worker, self._claim = claim_worker_id(self._claim_dir, self._fixed_worker)
+                self._worker_bits = worker << _WORKER_SHIFT
+                self.worker_id = worker
+
+    def _thread_state(self) -> _ThreadState:
+        if self.worker_id is None:
+            self._claim_worker()
+        try:
+            # A reused slot keeps its clock and sequence, so the new thread
+            # carries on after the last id the old one issued.
+            state = self._free.pop()
+        except IndexError:
+            slot = next(self._slots)
+            if slot > MAX_SLOT:
+                raise RuntimeError(f"more than {MAX_SLOT + 1} threads are issuing ids")
+            # Only for stats; a lost update under a race is harmless.
+            self.thread_slots = max(self.thread_slots, slot + 1)
+            state = _ThreadState(slot)
+        # The thread-local is dropped when its thread exits, and with it the
+        # lease, which hands the slot back.
+        lease = _Lease()
+        weakref.finalize(lease, self._free.append, state)
+        self._local.lease = lease
+        self._local.state = state
+        return state
+
+    def next_id(self) -> int:
+        try:
+            state = self._local.state
+        except AttributeError:
+            state = self._thread_state()
+        now = time.time_ns() // 1000000 - EPOCH_MS
+        if now > state.last_ms:
+            state.last_ms = now
+            state.sequence = 0
+        elif state.sequence < MAX_SEQUENCE:
+            # Same millisecond, or the clock stepped back: keep counting
+            # from the last millisecond used so ids never repeat or decrease.
+            state.sequence += 1
+        else:
+            # Sequence exhausted. With only 16 ids per millisecond, borrowing
+            # ahead would soon run far past the clock, so wait the
+            # millisecond out; only a clock that stepped back is borrowed from.
+            while now == state.last_ms:
+                time.sleep(0)
+                now = time.time_ns() // 1000000 - EPOCH_MS
+            state.last_ms = max(now, state.last_ms + 1)
+            state.sequence = 0
+        return (state.last_ms << _TIME_SHIFT) | self._worker_bits | (state.slot << _SLOT_SHIFT) | state.sequence
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "worker_id": self.worker_id,
+            "claimed": self._claim is not None,
+            "thread_slots": self.thread_slots,
+            "free_thread_slots": len(self._free),
+        }
+
+
+def split_id(value: int) -> Tuple[int, int, int, int]:
+    """Return ``(unix_ms, worker_id, slot, sequence)`` for an id from ``IdGenerator``."""
+    return (
+        (value >> _TIME_SHIFT) + EPOCH_MS,
+        (value >> _WORKER_SHIFT) & MAX_WORKER,
+        (value >> _SLOT_SHIFT) & MAX_SLOT,
+        value & MAX_SEQUENCE,
+    )
@@ -0,0 +1,71 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+import importlib
+from . import responses
+
+# Route modules are imported on first use, so a cold start only pays for
+# the route being served; /healthz never touches the shared state.
+ROUTES = {
+    "/api/signup": "signup",
+    "/api/verify-email": "verify-email",
+    "/api/login": "login",
+    "/api/dashboard": "dashboard",
+    "/api/logout": "logout",
+    "/api/logout-all": "logout-all",
+    "/api/users": "users",
+    "/api/status": "status",
+    "/api/admin/import": "admin-import",
+    "/api/admin/export": "admin-export",
+    "/metrics": "metrics",
+    "/healthz": "healthz",
+}
+
+_route_handlers = {}
+_served_as = {}
+
+def load_route(name):
+    route_handler = _route_handlers.get(name)
+    if route_handler is None:
+        route_handler = importlib.import_module("." + name, __package__).handler
+        _route_handlers[name] = route_handler
+    return route_handler
+
+def served_as(route_handler, base):
+    """The class a ``base`` instance takes on while serving ``route_handler``.
+
+    Subclasses of ``handler`` (like the standalone server's) keep their own
+    settings, such as protocol_version, for the duration of the request.
+    """
+    if base is handler:
+        return route_handler
+    cls = _served_as.get((route_handler, base))
+    if cls is None:
+        cls = _served_as[(route_handler, base)] = type(route_handler.__name__, (route_handler, base), {})
+    return cls
+
+class handler(BaseHTTPRequestHandler):
+    def dispatch(self):
+        name = ROUTES.get(urlsplit(self.path).path.rstrip("/") or "/")
+        if name is None:
+            responses.send(self, responses.NOT_FOUND)
+            return
+        route_handler = load_route(name)
+        method = "do_" + self.command
+        if not hasattr(route_handler, method):
+            responses.send(self, responses.METHOD_NOT_ALLOWED)
+            return
+        # Route handlers are plain BaseHTTPRequestHandler subclasses with no
+        # state of their own, so this request can be served as one of them.
+        base = self.__class__
+        self.__class__ = served_as(route_handler, base)
+        try:
+            getattr(self, method)()
+        finally:
+            self.__class__ = base
+
+    do_GET = dispatch
+    do_POST = dispatch
+    do_OPTIONS = dispatch
+    do_PUT = dispatch
+    do_PATCH = dispatch
+    do_DELETE = dispatch
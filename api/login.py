@@ -1,7 +1,9 @@
 from http.server import BaseHTTPRequestHandler
+from . import responses
 from pydantic import BaseModel, EmailStr
 from datetime import datetime, timedelta
-from .shared import users_db, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from .hashing import HashingUnavailable
+from .shared import users_db, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, password_hasher, client_ip, reject_if_rate_limited, metrics
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -13,40 +15,42 @@ class User(BaseModel):
     is_verified: bool
     created_at: datetime
 
+@metrics.instrument_handler("/api/login")
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         import json
         
         try:
+            if reject_if_rate_limited(self, "login_ip", client_ip(self)):
+                return
+            
             content_length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(content_length).decode('utf-8')
             user_data = UserLogin(**json.loads(body))
             
-            user = users_db.get(user_data.email)
+            if reject_if_rate_limited(self, "login_email", user_data.email):
+                return
+            
+            with metrics.stage("store_lookup"):
+                user = users_db.get(user_data.email)
             if not user:
-                self.send_response(401)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Invalid email or password"}).encode())
+                responses.send(self, responses.INVALID_CREDENTIALS)
                 return
             
             if not user["is_verified"]:
-                self.send_response(400)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Please verify your email before logging in"}).encode())
+                responses.send(self, responses.NOT_VERIFIED)
                 return
             
             if not verify_password(user_data.password, user["password"]):
-                self.send_response(401)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Invalid email or password"}).encode())
+                responses.send(self, responses.INVALID_CREDENTIALS)
                 return
             
+            if password_hasher.needs_rehash(user["password"]):
+                email = user["email"]
+                password_hasher.rehash_later(
+                    user_data.password, lambda new_hash: users_db.update(email, password=new_hash)
+                )
+            
             access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
             access_token = create_access_token(
                 data={"sub": user["email"]}, expires_delta=access_token_expires
@@ -59,26 +63,17 @@ class handler(BaseHTTPRequestHandler):
                 "created_at": user["created_at"].isoformat()
             }
             
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            responses.send_json(self, 200, {
                 "access_token": access_token,
                 "token_type": "bearer",
                 "user": user_response
-            }).encode())
+            })
+            
+        except HashingUnavailable:
+            responses.send(self, responses.SERVER_BUSY)
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": str(e)}).encode())
+            responses.send_error(self, 500, str(e))
     
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+        responses.send(self, responses.PREFLIGHT_POST)
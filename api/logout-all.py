@@ -0,0 +1,30 @@
+from http.server import BaseHTTPRequestHandler
+from . import responses
+from .logs import get_logger
+from .shared import get_token_claims, revoked_tokens, metrics, AuthError
+
+logger = get_logger("auth.session")
+
+@metrics.instrument_handler("/api/logout-all")
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            auth_header = self.headers.get('authorization') or self.headers.get('Authorization')
+            
+            if not auth_header or not auth_header.startswith('Bearer '):
+                responses.send(self, responses.NOT_AUTHENTICATED)
+                return
+            
+            payload = get_token_claims(auth_header.split(' ')[1])
+            revoked_tokens.revoke_subject(payload["sub"])
+            logger.info("session.logout_all", email=payload["sub"])
+            responses.send_json(self, 200, {"message": "Logged out of all sessions"})
+            
+        except AuthError as e:
+            responses.send_error(self, e.status_code, e.detail, (("WWW-Authenticate", "Bearer"),))
+            
+        except Exception as e:
+            responses.send_error(self, 500, str(e))
+    
+    def do_OPTIONS(self):
+        responses.send(self, responses.PREFLIGHT_POST)
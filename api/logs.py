@@ -0,0 +1,206 @@
+"""Structured, non-blocking logging.
+
+Events are logged as a short name plus keyword fields::
+
+    logger = get_logger("auth.email")
+    logger.info("email.sent", email=email, message_id=message_id)
+
+Records go onto a bounded in-memory queue and are formatted and written
+by a ``QueueListener`` thread, so a request never waits on stderr. When
+the queue is full, records are dropped and counted rather than blocking.
+Formatting redacts sensitive fields and known secret values. High-volume
+events can be sampled per event name; warnings and errors are always
+kept.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Iterable, Optional
+
+ROOT_LOGGER = "auth"
+REDACTED = "[REDACTED]"
+SENSITIVE_FIELDS = frozenset({
+    "password", "api_key", "api-key", "token", "access_token", "authorization",
+    "secret", "secret_key", "verification_code",
+})
+
+_plain_formatter = logging.Formatter()
+
+
+class EventLogger:
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level: int, event: str, fields: Dict[str, object], exc_info: bool = False) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, event: str, **fields) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name: str) -> EventLogger:
+    return EventLogger(name)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records for the configured event names."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.msg)
+        return rate is None or random.random() < rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() folds the traceback into the message; keep the
+        # event name clean and carry the traceback separately instead.
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = _plain_formatter.formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, json_output: bool = True, secrets: Iterable[str] = ()):
+        super().__init__()
+        self.json_output = json_output
+        # Short values would redact unrelated text.
+        self.secrets = [s for s in secrets if s and len(s) >= 8]
+
+    def _scrub(self, text: str) -> str:
+        for secret in self.secrets:
+            if secret in text:
+                text = text.replace(secret, REDACTED)
+        return text
+
+    def _clean(self, key: str, value: object) -> object:
+        if key.lower() in SENSITIVE_FIELDS:
+            return REDACTED
+        if isinstance(value, str):
+            return self._scrub(value)
+        return value
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": self._scrub(record.getMessage()),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            entry[key] = self._clean(key, value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = self._scrub(record.exc_text)
+        if self.json_output:
+            return json.dumps(entry, default=str)
+        head = f"{entry.pop('ts')} {entry.pop('level').upper():<7} {entry.pop('logger')} {entry.pop('event')}"
+        exc = entry.pop("exc", None)
+        line = " ".join([head] + [f"{key}={value}" for key, value in entry.items()])
+        return f"{line}\n{exc}" if exc else line
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse ``"email.sent=0.1,outbox.retry=0.5"``."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[DroppingQueueHandler] = None
+
+
+def configure_logging(
+    level: str = "INFO",
+    json_output: bool = True,
+    sample_rates: Optional[Dict[str, float]] = None,
+    secrets: Iterable[str] = (),
+    max_queue: int = 10000,
+) -> None:
+    """Install the queue handler on the ``auth`` logger. Safe to call twice."""
+    global _listener, _handler
+    if _listener is not None:
+        return
+    log_queue: queue.Queue = queue.Queue(max_queue)
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter(json_output, secrets))
+    _handler = DroppingQueueHandler(log_queue)
+    _handler.addFilter(SamplingFilter(sample_rates or {}))
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level.upper())
+    root.addHandler(_handler)
+    root.propagate = False
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def configure_from_env(secrets: Iterable[str] = ()) -> None:
+    configure_logging(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        json_output=os.getenv("LOG_FORMAT", "json").lower() == "json",
+        sample_rates=parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")),
+        secrets=secrets,
+        max_queue=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    )
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener, _handler
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+    _listener = None
+    _handler = None
+
+
+def stats() -> Dict[str, object]:
+    return {
+        "enabled": _handler is not None,
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+    }
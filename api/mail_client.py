@@ -0,0 +1,230 @@
+"""Pooled keep-alive client for the Brevo transactional email API.
+
+Connections to the API host are kept open and reused (HTTP/1.1
+keep-alive) instead of paying a new TCP+TLS handshake per email. A
+circuit breaker stops hammering Brevo while it is failing. The base URL
+is configurable, so a plain-HTTP stub server can stand in for Brevo.
+
+A send is retried here only when it provably never reached Brevo: a
+pooled connection that fails while the request is being written. Once
+the request is out, a lost response is raised, not retried, and the
+outbox's retry policy decides what happens next; retrying the POST here
+could send the email twice.
+"""
+import http.client
+import json
+import os
+import select
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+DEFAULT_BASE_URL = "https://api.brevo.com"
+# Brevo accepts at most this many ``messageVersions`` in one send.
+MAX_MESSAGE_VERSIONS = 1000
+
+# Errors from writing to a pooled connection the server closed while it sat
+# idle. The request never got out whole, so the server cannot have acted on it.
+_UNSENT_ERRORS = (
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class MailApiError(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"Mail API returned {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the mail API while the breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half-open: let exactly one probe request through.
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class BrevoClient:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = DEFAULT_BASE_URL,
+        pool_size: int = 4,
+        connect_timeout: float = 3.0,
+        read_timeout: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        parts = urlsplit(base_url)
+        self.api_key = api_key
+        self.scheme = parts.scheme or "https"
+        self.host = parts.hostname or "api.brevo.com"
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._idle: Deque[http.client.HTTPConnection] = deque()
+        self._lock = threading.Lock()
+        self._connections_opened = 0
+        self._requests = 0
+
+    @classmethod
+    def from_env(cls, api_key: Optional[str] = None) -> "BrevoClient":
+        return cls(
+            api_key=api_key,
+            base_url=os.getenv("BREVO_API_URL", DEFAULT_BASE_URL),
+            pool_size=int(os.getenv("BREVO_POOL_SIZE", "4")),
+            connect_timeout=float(os.getenv("BREVO_CONNECT_TIMEOUT", "3")),
+            read_timeout=float(os.getenv("BREVO_READ_TIMEOUT", "10")),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("BREVO_BREAKER_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("BREVO_BREAKER_RESET", "30")),
+            ),
+        )
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        # The connect timeout only covers the handshake; reads get their own budget.
+        conn.sock.settimeout(self.read_timeout)
+        with self._lock:
+            self._connections_opened += 1
+        return conn
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            # An idle connection has nothing to read unless the server closed
+            # it; catching that here keeps the request off a dead socket.
+            if conn.sock is not None and not select.select([conn.sock], [], [], 0)[0]:
+                return conn, True
+            conn.close()
+        return self._connect(), False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _send(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        conn, reused = self._acquire()
+        try:
+            try:
+                conn.request(method, self.base_path + path, body=body, headers=headers)
+            except _UNSENT_ERRORS:
+                if not reused:
+                    raise
+                # The server dropped the pooled connection before the request
+                # got out; resend once on a fresh one.
+                conn.close()
+                conn = self._connect()
+                conn.request(method, self.base_path + path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return response.status, data
+
+    def request(self, method: str, path: str, payload: dict, api_key: Optional[str] = None) -> dict:
+        if not self.breaker.allow():
+            raise CircuitOpenError("Mail API circuit breaker is open")
+        body = json.dumps(payload, separators=(",", ":")).encode('utf-8')
+        headers = {
+            "Content-Type": "application/json",
+            "accept": "application/json",
+            "api-key": api_key or self.api_key or "",
+            "User-Agent": "Mozilla/5.0 (compatible; EmailAuthTutorial/1.0)",
+            "Connection": "keep-alive",
+        }
+        with self._lock:
+            self._requests += 1
+        try:
+            status, data = self._send(method, path, body, headers)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if status >= 500 or status == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        text = data.decode('utf-8', errors='replace')
+        if status >= 300:
+            raise MailApiError(status, text)
+        return json.loads(text) if text else {}
+
+    def send_email(self, payload: dict, api_key: Optional[str] = None) -> dict:
+        return self.request("POST", "/v3/smtp/email", payload, api_key=api_key)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "base_url": f"{self.scheme}://{self.host}" + (f":{self.port}" if self.port else ""),
+                "idle_connections": len(self._idle),
+                "connections_opened": self._connections_opened,
+                "requests": self._requests,
+                "circuit": self.breaker.state,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
@@ -0,0 +1,12 @@
+from http.server import BaseHTTPRequestHandler
+from . import responses
+from .shared import metrics
+from .instrumentation import CONTENT_TYPE
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not metrics.enabled:
+            responses.send_error(self, 404, "Metrics are disabled")
+            return
+        
+        responses.send(self, responses.Response(200, metrics.render().encode(), CONTENT_TYPE))
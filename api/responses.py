@@ -0,0 +1,145 @@
+"""Response writer for the BaseHTTPRequestHandler endpoints.
+
+The status line, headers and body of a response are assembled as a few
+byte strings and handed to the socket in one ``sendmsg`` call, instead of
+one write for the header block and another for the body. Fixed
+responses (common errors, CORS preflights) are encoded once at import.
+Other JSON goes through ``dumps``, which is orjson when it is installed
+and can be swapped with ``set_json_encoder``.
+"""
+import json
+import time
+from http import HTTPStatus
+
+JSON = "application/json"
+
+_CORS = b"Access-Control-Allow-Origin: *\r\n"
+_std_encoder = json.JSONEncoder(separators=(",", ":"))
+
+def _std_dumps(obj) -> bytes:
+    return _std_encoder.encode(obj).encode()
+
+encoder_name = None
+
+def set_json_encoder(encoder, name="custom") -> None:
+    """Use ``encoder(obj) -> bytes`` for every JSON body from now on."""
+    global dumps, encoder_name
+    dumps = encoder
+    encoder_name = name
+
+def dumps(obj) -> bytes:
+    # orjson is picked on first use rather than at import, so routes that
+    # only send the fixed responses below (like /healthz) never load it.
+    try:
+        import orjson
+        set_json_encoder(orjson.dumps, "orjson")
+    except ImportError:
+        set_json_encoder(_std_dumps, "json")
+    return dumps(obj)
+
+def _header_block(headers) -> bytes:
+    return b"".join(f"{name}: {value}\r\n".encode('latin-1') for name, value in headers)
+
+class Response:
+    """A response whose headers (and usually body) are already encoded."""
+    __slots__ = ("status", "head", "body")
+
+    def __init__(self, status, body=b"", content_type=JSON, headers=()):
+        self.status = status
+        self.body = body
+        fields = list(headers)
+        if content_type:
+            fields.append(("Content-Type", content_type))
+        if status != 304:
+            fields.append(("Content-Length", len(body)))
+        self.head = _CORS + _header_block(fields)
+
+def json_response(status, payload, headers=()) -> Response:
+    return Response(status, dumps(payload), JSON, headers)
+
+def error_response(status, detail, headers=()) -> Response:
+    return json_response(status, {"detail": detail}, headers)
+
+def static_json(status, payload, headers=()) -> Response:
+    """Encode a fixed response once, at import time."""
+    return Response(status, _std_dumps(payload), JSON, headers)
+
+def preflight(methods) -> Response:
+    return Response(200, b"", None, (
+        ("Access-Control-Allow-Methods", methods),
+        ("Access-Control-Allow-Headers", "Content-Type, Authorization, If-None-Match"),
+    ))
+
+INVALID_CREDENTIALS = static_json(401, {"detail": "Invalid email or password"})
+NOT_AUTHENTICATED = static_json(401, {"detail": "Could not validate credentials"}, (("WWW-Authenticate", "Bearer"),))
+NOT_VERIFIED = static_json(400, {"detail": "Please verify your email before logging in"})
+USER_EXISTS = static_json(400, {"detail": "User with this email already exists"})
+SERVER_BUSY = static_json(503, {"detail": "Server is busy, please try again shortly"}, (("Retry-After", "1"),))
+NOT_FOUND = static_json(404, {"detail": "Not Found"})
+METHOD_NOT_ALLOWED = static_json(405, {"detail": "Method Not Allowed"})
+PREFLIGHT_GET = preflight("GET, OPTIONS")
+PREFLIGHT_POST = preflight("POST, OPTIONS")
+
+_status_lines = {}
+_date = [0, b""]
+
+def _status_line(protocol, status) -> bytes:
+    line = _status_lines.get((protocol, status))
+    if line is None:
+        phrase = HTTPStatus(status).phrase
+        line = _status_lines[(protocol, status)] = f"{protocol} {status} {phrase}\r\n".encode('latin-1')
+    return line
+
+def _date_header(handler) -> bytes:
+    now = int(time.time())
+    if _date[0] != now:
+        _date[1] = f"Date: {handler.date_time_string(now)}\r\n".encode('latin-1')
+        _date[0] = now
+    return _date[1]
+
+def _write(handler, chunks) -> None:
+    sendmsg = getattr(handler.connection, "sendmsg", None)
+    if handler.wbufsize != 0 or sendmsg is None:
+        handler.wfile.write(b"".join(chunks))
+        return
+    # Gather write straight from the pieces; loop only on a partial send.
+    sent = sendmsg(chunks)
+    total = sum(len(chunk) for chunk in chunks)
+    if sent < total:
+        handler.connection.sendall(b"".join(chunks)[sent:])
+
+_CLOSE = b"Connection: close\r\n"
+
+def _prelude(handler, status) -> list:
+    handler.log_request(status)
+    chunks = [
+        _status_line(handler.protocol_version, status),
+        f"Server: {handler.version_string()}\r\n".encode('latin-1'),
+        _date_header(handler),
+    ]
+    # HTTP/1.1 connections stay open unless told otherwise.
+    if handler.close_connection and handler.protocol_version != "HTTP/1.0":
+        chunks.append(_CLOSE)
+    return chunks
+
+def send(handler, response: Response) -> None:
+    chunks = _prelude(handler, response.status)
+    chunks.append(response.head)
+    chunks.append(b"\r\n")
+    if response.body and handler.command != "HEAD":
+        chunks.append(response.body)
+    _write(handler, chunks)
+
+def send_json(handler, status, payload, headers=()) -> None:
+    send(handler, json_response(status, payload, headers))
+
+def send_error(handler, status, detail, headers=()) -> None:
+    send(handler, error_response(status, detail, headers))
+
+def start_stream(handler, status, content_type, headers=()) -> None:
+    """Send headers for a body of unknown length; the connection closes after it."""
+    handler.close_connection = True
+    chunks = _prelude(handler, status)
+    chunks.append(_CORS + _header_block((*headers, ("Content-Type", content_type))))
+    chunks.append(b"\r\n")
+    _write(handler, chunks)
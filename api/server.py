@@ -0,0 +1,271 @@
+"""Standalone HTTP/1.1 server for the api/ handlers.
+
+Serves every route in ``index.ROUTES`` from one long-running process, for
+self-hosting and load testing outside Vercel:
+
+    python -m api.server --port 8000 --workers 32
+
+Connections are kept alive and may pipeline requests. Each connection is
+served by one thread of a fixed worker pool; connections beyond the pool
+wait in a bounded queue, and past that they are answered with a 503
+straight from the accept loop. SIGTERM or SIGINT stops accepting, lets
+in-flight requests finish (closing their connections afterwards) and
+exits once they are done or the grace period runs out.
+
+Request bodies are read into memory up to ``MAX_BODY_BYTES``. Routes in
+``STREAMED_ROUTES`` (the bulk import) have no size cap: they read the body
+straight off the connection, and whatever they leave unread is skipped
+before the next pipelined request is parsed.
+"""
+import argparse
+import io
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+from urllib.parse import urlsplit
+from . import index, responses
+
+MAX_BODY_BYTES = 1024 * 1024
+STREAMED_ROUTES = {"admin-import"}
+DISCARD_CHUNK = 64 * 1024
+
+LENGTH_REQUIRED = responses.static_json(411, {"detail": "Length Required"})
+BODY_TOO_LARGE = responses.static_json(413, {"detail": "Request body too large"})
+BAD_LENGTH = responses.static_json(400, {"detail": "Invalid Content-Length"})
+
+_OVERLOADED = responses.SERVER_BUSY
+OVERLOADED = (
+    b"HTTP/1.1 503 Service Unavailable\r\n" + b"Connection: close\r\n"
+    + _OVERLOADED.head + b"\r\n" + _OVERLOADED.body
+)
+
+class BodyReader:
+    """The request body as a stream that ends after Content-Length bytes."""
+
+    def __init__(self, rfile, length):
+        self._rfile = rfile
+        self.remaining = length
+
+    def _take(self, data):
+        # An empty read means the client hung up mid-body.
+        self.remaining = self.remaining - len(data) if data else 0
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        return self._take(self._rfile.read(size)) if size else b""
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        return self._take(self._rfile.readline(size)) if size else b""
+
+    def discard(self):
+        while self.remaining and self.read(DISCARD_CHUNK):
+            pass
+
+class KeepAliveHandler(index.handler):
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are dropped after this many seconds.
+    timeout = 5
+    access_log = False
+
+    def dispatch(self):
+        if self.server.draining:
+            self.close_connection = True
+        if self.headers.get("Transfer-Encoding"):
+            self.close_connection = True
+            responses.send(self, LENGTH_REQUIRED)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            responses.send(self, BAD_LENGTH)
+            return
+        if index.ROUTES.get(urlsplit(self.path).path.rstrip("/")) in STREAMED_ROUTES:
+            self._dispatch_streamed(length)
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            responses.send(self, BODY_TOO_LARGE)
+            return
+        # The whole body is read up front, so a handler that answers without
+        # reading it cannot leave bytes behind to be parsed as the next
+        # pipelined request.
+        rfile = self.rfile
+        self.rfile = io.BytesIO(rfile.read(length) if length else b"")
+        try:
+            super().dispatch()
+        finally:
+            self.rfile = rfile
+
+    def _dispatch_streamed(self, length):
+        rfile = self.rfile
+        body = self.rfile = BodyReader(rfile, length)
+        try:
+            super().dispatch()
+        finally:
+            self.rfile = rfile
+            # Skip what the handler left unread so the next request parses
+            # cleanly; a large remainder (say, an upload refused with a 401)
+            # is cheaper to drop with the connection.
+            if body.remaining > MAX_BODY_BYTES:
+                self.close_connection = True
+            else:
+                body.discard()
+
+    do_GET = dispatch
+    do_POST = dispatch
+    do_OPTIONS = dispatch
+    do_PUT = dispatch
+    do_PATCH = dispatch
+    do_DELETE = dispatch
+
+    def log_message(self, format, *args):
+        if self.access_log:
+            super().log_message(format, *args)
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer handing each connection to a fixed pool of threads."""
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class=KeepAliveHandler, workers=32, max_queued=256):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.draining = False
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="api-worker")
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+        self._connections = set()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def process_request(self, request, client_address):
+        if self.draining or not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            try:
+                request.sendall(OVERLOADED)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self._lock:
+            self._connections.add(request)
+        self._executor.submit(self._serve_connection, request, client_address)
+
+    def _serve_connection(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._lock:
+                self._connections.discard(request)
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def active_connections(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+    def drain(self, grace: float = 10.0) -> None:
+        """Stop accepting, finish in-flight requests, then close everything.
+
+        Must be called from a thread other than the one in serve_forever.
+        """
+        self.draining = True
+        self.shutdown()
+        # Idle keep-alive connections are blocked reading the next request;
+        # closing the read side wakes them with EOF. Responses being written
+        # are unaffected.
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        deadline = time.monotonic() + grace
+        while self.active_connections() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._executor.shutdown(wait=True)
+        self.server_close()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "active_connections": self.active_connections(),
+            "rejected": self.rejected,
+            "draining": self.draining,
+        }
+
+def close_shared_state():
+    """Stop the background workers of api/shared.py, if a route loaded it."""
+    shared = sys.modules.get(__package__ + ".shared")
+    if shared is None:
+        return
+    shared.email_outbox.stop()
+    shared.mail_client.close()
+    shared.password_hasher.shutdown(wait=False)
+    shared.users_db.close()
+    shared.revoked_tokens.close()
+    shared.logs.stop_logging()
+
+def serve(host="127.0.0.1", port=8000, workers=32, max_queued=256, idle_timeout=5.0,
+          grace=10.0, access_log=False):
+    handler_class = type("handler", (KeepAliveHandler,), {
+        "timeout": idle_timeout,
+        "access_log": access_log,
+    })
+    server = PooledHTTPServer((host, port), handler_class, workers, max_queued)
+    drainer = threading.Thread(target=server.drain, args=(grace,), name="api-drain")
+
+    def stop(signum, frame):
+        if not server.draining:
+            drainer.start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving api/ on http://{host}:{server.server_port} "
+          f"({workers} workers, {max_queued} queued connections)", flush=True)
+    server.serve_forever()
+    if drainer.is_alive():
+        drainer.join()
+    close_shared_state()
+    print("Server stopped", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the api/ handlers over HTTP/1.1")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=32,
+                        help="threads serving connections")
+    parser.add_argument("--max-queued", type=int, default=256,
+                        help="connections waiting for a worker before new ones get a 503")
+    parser.add_argument("--idle-timeout", type=float, default=5.0,
+                        help="seconds an idle keep-alive connection is held open")
+    parser.add_argument("--grace", type=float, default=10.0,
+                        help="seconds to let in-flight requests finish on shutdown")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.max_queued, args.idle_timeout,
+          args.grace, args.access_log)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,93 @@
+import math
 import os
-from typing import Dict, Optional
+import time
+from typing import List, Optional, Tuple
 from datetime import datetime, timedelta
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi import HTTPException, status
-from jose import JWTError, jwt
-import bcrypt
 import secrets
+import hmac
+from .ratelimit import RateLimiter
+from .instrumentation import Metrics
+from . import logs
+from . import responses
+from .hashing import PasswordHasher
+from .outbox import EmailOutbox
+from .mail_client import BrevoClient, MailApiError, MAX_MESSAGE_VERSIONS
+from .storage import create_user_store
+from .ids import IdGenerator
+from .codes import create_code_store
+from .claims_cache import ClaimsCache
+from .revocation import RevocationList
+from .validators import VersionCounters, ResponseCache, etag_matches
+from .token_codec import HS256Codec, TokenError
+
+metrics = Metrics.from_env()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "fallback-secret-key-for-development-only")
+BREVO_API_KEY = os.getenv("BREVO_API_KEY") or os.getenv("brevo_api_key")
+
+logs.configure_from_env(secrets=[SECRET_KEY, BREVO_API_KEY or ""])
+email_logger = logs.get_logger("auth.email")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
-users_db: Dict[str, dict] = {}
-verification_codes: Dict[str, str] = {}
+token_codec = HS256Codec(SECRET_KEY)
+
+users_db = create_user_store("/tmp")
+user_ids = IdGenerator.from_env(users_db)
+# With a store shared between workers, codes, rate limits and revocations
+# default to their shared backends too.
+verification_codes = create_code_store("/tmp", shared=users_db.shared)
+claims_cache = ClaimsCache.from_env()
+revoked_tokens = RevocationList.from_env("/tmp", max_ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60, shared=users_db.shared)
+
+versions = VersionCounters(users_db)
+response_cache = ResponseCache.from_env()
+
+# Cached claims must not outlive a change to the account they belong to.
+users_db.add_listener(claims_cache.invalidate_subject)
+users_db.add_listener(versions.bump)
+
+rate_limiter = RateLimiter.from_env("/tmp", shared=users_db.shared)
+
+# How many proxies in front of the handlers append to X-Forwarded-For.
+# Vercel's edge overwrites the header with the client address, so one hop
+# is trusted there; anywhere else (api/server.py) the header is whatever the
+# client sent and is ignored unless this is set.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1" if os.getenv("VERCEL") else "0"))
+
+def client_ip(handler) -> str:
+    if TRUSTED_PROXY_HOPS:
+        forwarded = handler.headers.get('X-Forwarded-For')
+        if forwarded:
+            hops = forwarded.split(',')
+            # Each trusted proxy appended the address it saw; entries to the
+            # left of those came from the client and can be anything.
+            if len(hops) >= TRUSTED_PROXY_HOPS:
+                return hops[-TRUSTED_PROXY_HOPS].strip()
+    return handler.client_address[0]
+
+def reject_if_rate_limited(handler, scope: str, key: str) -> bool:
+    """Send a 429 and return True if ``key`` is over its limit for ``scope``."""
+    retry_after = rate_limiter.check(scope, key)
+    if not retry_after:
+        return False
+    responses.send_error(
+        handler, 429, "Too many requests, please try again later",
+        (("Retry-After", RateLimiter.retry_after_header(retry_after)),),
+    )
+    return True
 
-security = HTTPBearer()
+password_hasher = PasswordHasher.from_env()
+if password_hasher.budget_ms:
+    password_hasher.calibrate()
 
 def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    with metrics.stage("bcrypt_hash"):
+        return password_hasher.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    with metrics.stage("bcrypt_verify"):
+        return password_hasher.verify(password, hashed)
 
 def generate_verification_code() -> str:
     return str(secrets.randbelow(90000) + 10000)
@@ -32,25 +98,178 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # ``jti`` lets a single token be revoked. ``iat`` keeps millisecond
+    # precision so a logout-everywhere rarely catches a token issued right
+    # after it, and is truncated, never rounded up past a cutoff, so it
+    # always catches one issued before it.
+    to_encode.update({"exp": expire, "iat": math.floor(time.time() * 1000) / 1000, "jti": secrets.token_urlsafe(12)})
+    with metrics.stage("token_encode"):
+        encoded_jwt = token_codec.encode(to_encode)
     return encoded_jwt
 
-def get_current_user_from_token(token: str):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+mail_client = BrevoClient.from_env(api_key=BREVO_API_KEY)
+
+def send_verification_email(email: str, verification_code: str) -> bool:
+    """Send verification email via Brevo (formerly SendInBlue)"""
+    if not BREVO_API_KEY:
+        email_logger.error("email.not_configured", email=email)
+        return False
+    
+    email_payload = {
+        "sender": {
+            "email": "noreply@email-auth-tutorial.com",
+            "name": "Email Auth Tutorial"
+        },
+        "to": [
+            {
+                "email": email,
+                "name": "User"
+            }
+        ],
+        "subject": "Email Verification Code",
+        "htmlContent": f"<html><body><p>Your verification code is: <strong>{verification_code}</strong></p><p>Please enter this code to verify your email address.</p></body></html>"
+    }
+    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.stage("email_dispatch"):
+            response_data = mail_client.send_email(email_payload)
+    except Exception:
+        email_logger.exception("email.send_failed", email=email)
+        return False
+    email_logger.info("email.sent", email=email, message_id=response_data.get("messageId"))
+    return True
+
+def send_verification_emails(messages: List[Tuple[str, str]]) -> List[Optional[str]]:
+    """Send several verification emails in one Brevo request, one ``messageVersions`` entry each.
+
+    Returns an error string, or None once Brevo accepted it, per message.
+    """
+    if not BREVO_API_KEY:
+        return [None if send_verification_email(email, code) else "delivery rejected" for email, code in messages]
+    
+    email_payload = {
+        "sender": {
+            "email": "noreply@email-auth-tutorial.com",
+            "name": "Email Auth Tutorial"
+        },
+        "subject": "Email Verification Code",
+        "htmlContent": "<html><body><p>Your verification code is: <strong>{{ params.code }}</strong></p><p>Please enter this code to verify your email address.</p></body></html>",
+        "messageVersions": [
+            {"to": [{"email": email, "name": "User"}], "params": {"code": code}}
+            for email, code in messages
+        ]
+    }
+    
+    rejected = None
+    try:
+        with metrics.stage("email_dispatch"):
+            response_data = mail_client.send_email(email_payload)
+    except MailApiError as e:
+        if e.status != 400:
+            email_logger.exception("email.batch_failed", count=len(messages))
+            return [str(e)] * len(messages)
+        rejected = e
+    except Exception as e:
+        email_logger.exception("email.batch_failed", count=len(messages))
+        return [str(e) or type(e).__name__] * len(messages)
+    if rejected is not None:
+        if len(messages) == 1:
+            email_logger.error("email.send_failed", email=messages[0][0], status=rejected.status, error=rejected.body)
+            return [str(rejected)]
+        # Brevo refuses the whole batch over one bad recipient; halve it until
+        # the bad ones are isolated and the rest go through.
+        half = len(messages) // 2
+        return send_verification_emails(messages[:half]) + send_verification_emails(messages[half:])
+    message_ids = response_data.get("messageIds") or []
+    results: List[Optional[str]] = []
+    for (email, _), message_id in zip(messages, message_ids):
+        email_logger.info("email.sent", email=email, message_id=message_id)
+        results.append(None)
+    # The outbox retries any message Brevo returned no id for.
+    return results
+
+email_outbox = EmailOutbox(
+    os.getenv("OUTBOX_PATH", "/tmp/outbox.db"),
+    send_verification_email,
+    workers=int(os.getenv("OUTBOX_WORKERS", "1")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6")),
+    lease_seconds=float(os.getenv("OUTBOX_LEASE_SECONDS", "120")),
+    deliver_batch=send_verification_emails,
+    batch_size=min(int(os.getenv("OUTBOX_BATCH_SIZE", "50")), MAX_MESSAGE_VERSIONS),
+    batch_window=int(os.getenv("OUTBOX_BATCH_WINDOW_MS", "200")) / 1000,
+    # A Vercel function is frozen after it responds, so background workers
+    # would strand queued mail; deliver before the response instead.
+    inline=os.getenv("OUTBOX_INLINE", "1" if os.getenv("VERCEL") else "0") == "1",
+)
+
+def queue_verification_emails(users) -> None:
+    pending = [user for user in users if user["verification_code"]]
+    for user in pending:
+        verification_codes.issue(user["email"], user["verification_code"])
+    email_outbox.enqueue_many((user["email"], user["verification_code"]) for user in pending)
+
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+
+INVALID_ADMIN_KEY = responses.static_json(401, {"detail": "Invalid admin key"})
+
+def admin_key_ok(handler) -> bool:
+    supplied = handler.headers.get("X-Admin-Key", "")
+    return bool(ADMIN_API_KEY) and hmac.compare_digest(supplied.encode(), ADMIN_API_KEY.encode())
+
+def reject_unless_admin(handler) -> bool:
+    """Send a 404 (no admin key configured) or 401 and return True unless the request has the admin key."""
+    if not ADMIN_API_KEY:
+        responses.send(handler, responses.NOT_FOUND)
+        return True
+    if not admin_key_ok(handler):
+        responses.send(handler, INVALID_ADMIN_KEY)
+        return True
+    return False
+
+class AuthError(Exception):
+    """Request could not be authenticated; handlers answer with ``status_code``."""
+
+    def __init__(self, detail: str, status_code: int = 401):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+def get_token_claims(token: str) -> dict:
+    credentials_exception = AuthError("Could not validate credentials")
+    payload = claims_cache.get(token)
+    try:
+        if payload is None:
+            with metrics.stage("token_decode"):
+                payload = token_codec.decode(token)
+            claims_cache.put(token, payload)
         email = payload.get("sub")
         if not isinstance(email, str) or email is None:
             raise credentials_exception
-    except JWTError:
+    except TokenError:
         raise credentials_exception
-    
-    user = users_db.get(email)
-    if user is None:
+    if revoked_tokens.is_revoked(payload):
         raise credentials_exception
+    return payload
+
+def user_from_claims(payload: dict):
+    with metrics.stage("store_lookup"):
+        user = users_db.get(payload["sub"])
+    if user is None:
+        raise AuthError("Could not validate credentials")
     return user
+
+def get_current_user_from_token(token: str):
+    return user_from_claims(get_token_claims(token))
+
+def send_conditional(handler, key: tuple, version: int, build) -> None:
+    """Send a 304 if the client holds ``version``, else the cached or freshly built JSON."""
+    etag = versions.etag(key, version)
+    headers = (("ETag", etag), ("Cache-Control", "private, no-cache"), ("Access-Control-Expose-Headers", "ETag"))
+    if etag_matches(handler.headers.get("If-None-Match"), etag):
+        responses.send(handler, responses.Response(304, b"", None, headers))
+        return
+    response = response_cache.get(key, version)
+    if response is None:
+        response = responses.json_response(200, build(), headers)
+        response_cache.put(key, version, response)
+    responses.send(handler, response)
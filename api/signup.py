@@ -1,198 +1,88 @@
 from http.server import BaseHTTPRequestHandler
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
-import os
 import json
-import urllib.request
-import urllib.parse
-from .shared import users_db, verification_codes, hash_password, generate_verification_code
+from .hashing import HashingUnavailable
+from .logs import get_logger
+from . import responses
+from .shared import users_db, user_ids, verification_codes, hash_password, generate_verification_code, email_outbox, client_ip, reject_if_rate_limited, metrics
 
 class UserSignup(BaseModel):
     email: EmailStr
     password: str
 
+logger = get_logger("auth.signup")
+
+PASSWORD_TOO_SHORT = responses.static_json(400, {"detail": "Password must be at least 6 characters long"})
+
+@metrics.instrument_handler("/api/signup")
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         import json
         
         try:
+            if reject_if_rate_limited(self, "signup_ip", client_ip(self)):
+                return
+            
             content_length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(content_length).decode('utf-8')
             user_data = UserSignup(**json.loads(body))
             
-            if user_data.email in users_db:
-                existing_user = users_db[user_data.email]
+            if reject_if_rate_limited(self, "signup_email", user_data.email):
+                return
+            
+            with metrics.stage("store_lookup"):
+                existing_user = users_db.get(user_data.email)
+            if existing_user is not None:
                 if existing_user["is_verified"]:
-                    self.send_response(400)
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"detail": "User with this email already exists"}).encode())
+                    responses.send(self, responses.USER_EXISTS)
                     return
                 else:
-                    print(f"DEBUG: User {user_data.email} exists but not verified, allowing resend")
+                    logger.debug("signup.resend", email=user_data.email)
                     verification_code = generate_verification_code()
-                    users_db[user_data.email]["verification_code"] = verification_code
-                    verification_codes[user_data.email] = verification_code
+                    verification_codes.issue(user_data.email, verification_code)
                     
-                    email_sent = self.send_verification_email(user_data.email, verification_code)
+                    email_outbox.enqueue(user_data.email, verification_code)
                     
-                    if email_sent:
-                        self.send_response(200)
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            "message": "Verification email resent! Please check your email for the new verification code.",
-                            "user_id": existing_user["id"]
-                        }).encode())
-                    else:
-                        self.send_response(500)
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            "detail": "Failed to resend verification email. Please contact support."
-                        }).encode())
+                    responses.send_json(self, 200, {
+                        "message": "Verification email resent! Please check your email for the new verification code.",
+                        "user_id": existing_user["id"]
+                    })
                     return
             
             if len(user_data.password) < 6:
-                self.send_response(400)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Password must be at least 6 characters long"}).encode())
+                responses.send(self, PASSWORD_TOO_SHORT)
                 return
             
             hashed_password = hash_password(user_data.password)
             verification_code = generate_verification_code()
             
-            user_id = f"user_{int(datetime.utcnow().timestamp() * 1000000)}"
-            users_db[user_data.email] = {
+            user_id = f"user_{user_ids.next_id()}"
+            created = users_db.add({
                 "id": user_id,
                 "email": user_data.email,
                 "password": hashed_password,
                 "is_verified": False,
-                "created_at": datetime.utcnow(),
-                "verification_code": verification_code
-            }
-            
-            verification_codes[user_data.email] = verification_code
-            
-            email_sent = self.send_verification_email(user_data.email, verification_code)
-            
-            if email_sent:
-                self.send_response(200)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    "message": "Account created successfully! Please check your email for the verification code.",
-                    "user_id": user_id
-                }).encode())
-            else:
-                print("ERROR: Email sending failed - check Brevo configuration")
-                self.send_response(500)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    "detail": "Account created but email verification failed. Please check your Brevo configuration or contact support."
-                }).encode())
-            
-        except Exception as e:
-            self.send_response(500)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": str(e)}).encode())
-    
-    def send_verification_email(self, email, verification_code):
-        """Send verification email via Brevo (formerly SendInBlue)"""
-        try:
-            brevo_api_key = None
-            
-            brevo_api_key = (
-                os.getenv('BREVO_API_KEY') or 
-                os.environ.get('BREVO_API_KEY') or
-                os.getenv('brevo_api_key') or
-                os.environ.get('brevo_api_key')
-            )
-            print(f"DEBUG: Method 1 - BREVO_API_KEY = {brevo_api_key}")
-            
-            if not brevo_api_key:
-                for key_name in ['BREVO_API_KEY', 'brevo_api_key', 'Brevo_Api_Key']:
-                    brevo_api_key = os.environ.get(key_name)
-                    if brevo_api_key:
-                        print(f"DEBUG: Method 2 - Found {key_name} = {brevo_api_key}")
-                        break
-            
-            if not brevo_api_key:
-                try:
-                    import subprocess
-                    result = subprocess.run(['printenv', 'BREVO_API_KEY'], capture_output=True, text=True)
-                    if result.returncode == 0 and result.stdout.strip():
-                        brevo_api_key = result.stdout.strip()
-                        print(f"DEBUG: Method 3 - Found BREVO_API_KEY via printenv: {brevo_api_key}")
-                except Exception as e:
-                    print(f"DEBUG: Method 3 - printenv attempt failed: {e}")
-            
-            if not brevo_api_key:
-                print("ERROR: BREVO_API_KEY not found in environment variables")
-                print(f"DEBUG: Available env vars: {list(os.environ.keys())}")
-                return False
-            
-            brevo_endpoint = 'https://api.brevo.com/v3/smtp/email'
+                "created_at": datetime.utcnow()
+            })
+            if not created:
+                responses.send(self, responses.USER_EXISTS)
+                return
             
-            email_payload = {
-                "sender": {
-                    "email": "noreply@email-auth-tutorial.com",
-                    "name": "Email Auth Tutorial"
-                },
-                "to": [
-                    {
-                        "email": email,
-                        "name": "User"
-                    }
-                ],
-                "subject": "Email Verification Code",
-                "htmlContent": f"<html><body><p>Your verification code is: <strong>{verification_code}</strong></p><p>Please enter this code to verify your email address.</p></body></html>"
-            }
+            verification_codes.issue(user_data.email, verification_code)
             
-            print(f"DEBUG: Brevo endpoint = {brevo_endpoint}")
-            print(f"DEBUG: Email payload = {email_payload}")
+            email_outbox.enqueue(user_data.email, verification_code)
             
-            import json
-            data = json.dumps(email_payload).encode('utf-8')
-            req = urllib.request.Request(brevo_endpoint, data=data, method='POST')
-            req.add_header('Content-Type', 'application/json')
-            req.add_header('api-key', brevo_api_key)
-            req.add_header('accept', 'application/json')
-            req.add_header('User-Agent', 'Mozilla/5.0 (compatible; EmailAuthTutorial/1.0)')
+            responses.send_json(self, 200, {
+                "message": "Account created successfully! Please check your email for the verification code.",
+                "user_id": user_id
+            })
             
-            print(f"DEBUG: Request headers = {dict(req.headers)}")
+        except HashingUnavailable:
+            responses.send(self, responses.SERVER_BUSY)
             
-            with urllib.request.urlopen(req) as response:
-                response_data = response.read().decode('utf-8')
-                print(f"DEBUG: Response status = {response.status}")
-                print(f"DEBUG: Response data = {response_data}")
-                if response.status == 201:  # Brevo returns 201 for successful email sending
-                    print(f"Verification email sent successfully to {email}")
-                    return True
-                else:
-                    print(f"Failed to send email. Status: {response.status}, Response: {response_data}")
-                    return False
-                    
         except Exception as e:
-            print(f"Error sending verification email: {str(e)}")
-            print(f"DEBUG: Exception type = {type(e)}")
-            import traceback
-            print(f"DEBUG: Traceback = {traceback.format_exc()}")
-            return False
+            responses.send_error(self, 500, str(e))
     
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+        responses.send(self, responses.PREFLIGHT_POST)
@@ -0,0 +1,26 @@
+from http.server import BaseHTTPRequestHandler
+from . import responses
+from . import logs
+from .shared import password_hasher, email_outbox, mail_client, verification_codes, claims_cache, revoked_tokens, user_ids, versions, response_cache, rate_limiter, reject_unless_admin, metrics
+
+@metrics.instrument_handler("/api/status")
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if reject_unless_admin(self):
+            return
+        responses.send_json(self, 200, {
+            "hashing": password_hasher.stats(),
+            "outbox": email_outbox.stats(),
+            "mail_api": mail_client.stats(),
+            "verification_codes": verification_codes.stats(),
+            "token_cache": claims_cache.stats(),
+            "revocations": revoked_tokens.stats(),
+            "user_ids": user_ids.stats(),
+            "versions": versions.stats(),
+            "response_cache": response_cache.stats(),
+            "rate_limit": rate_limiter.stats(),
+            "logging": logs.stats(),
+        })
+    
+    def do_OPTIONS(self):
+        responses.send(self, responses.PREFLIGHT_GET)
@@ -0,0 +1,618 @@
+"""User storage engines.
+
+Routes talk to a ``UserStore`` instead of a bare dict so the backing
+engine can change without touching them. ``MemoryUserStore`` keeps users
+in process memory, sharded so concurrent signups lock only their own
+shard; ``SQLiteUserStore`` persists users in a WAL-mode SQLite database
+that several processes can share.
+
+Emails are case-normalized before they are used as keys, and stored
+records are never mutated in place: ``update`` swaps in a new record.
+Records are compact ``UserRecord`` objects that read like the dicts they
+replaced (``user["email"]``, ``user.get(...)``).
+"""
+import base64
+import os
+import queue
+import sqlite3
+import threading
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+UPDATABLE_FIELDS = {"password", "is_verified", "created_at"}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def encode_cursor(position: int) -> str:
+    return base64.urlsafe_b64encode(f"v1:{position}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Inverse of ``encode_cursor``. Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except Exception:
+        raise ValueError("Invalid cursor")
+    version, _, position = raw.partition(":")
+    if version != "v1" or not position.isdigit():
+        raise ValueError("Invalid cursor")
+    return int(position)
+
+
+def _to_epoch_us(value: datetime) -> int:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+class UserRecord:
+    """One stored user, about half the size of the dict it replaces.
+
+    The bcrypt hash is kept as bytes and ``created_at`` as epoch
+    microseconds (naive UTC), both converted back on access. Pending
+    verification codes live only in ``VerificationCodeStore``.
+    """
+
+    __slots__ = ("id", "email", "password_hash", "is_verified", "created_us")
+
+    FIELDS = ("id", "email", "password", "is_verified", "created_at")
+
+    def __init__(self, id: str, email: str, password_hash: bytes, is_verified: bool, created_us: int):
+        self.id = id
+        self.email = email
+        self.password_hash = password_hash
+        self.is_verified = is_verified
+        self.created_us = created_us
+
+    @classmethod
+    def from_dict(cls, user: Union[dict, "UserRecord"], email: Optional[str] = None) -> "UserRecord":
+        """Build a record from a user dict; ``email`` may pass an equal, already-held string."""
+        if isinstance(user, UserRecord):
+            return user
+        password = user["password"]
+        return cls(
+            user["id"],
+            email if email is not None and email == user["email"] else user["email"],
+            password.encode() if isinstance(password, str) else password,
+            bool(user.get("is_verified", False)),
+            _to_epoch_us(user["created_at"]),
+        )
+
+    @property
+    def password(self) -> str:
+        return self.password_hash.decode()
+
+    @property
+    def created_at(self) -> datetime:
+        return _EPOCH + timedelta(microseconds=self.created_us)
+
+    def replace(self, **fields) -> "UserRecord":
+        unknown = set(fields) - UPDATABLE_FIELDS
+        if unknown:
+            raise ValueError(f"Cannot update fields: {sorted(unknown)}")
+        password = fields.get("password")
+        created_at = fields.get("created_at")
+        return UserRecord(
+            self.id,
+            self.email,
+            self.password_hash if password is None else password.encode(),
+            bool(fields.get("is_verified", self.is_verified)),
+            self.created_us if created_at is None else _to_epoch_us(created_at),
+        )
+
+    def __getitem__(self, name: str):
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name) if name in self.FIELDS else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.FIELDS
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __repr__(self) -> str:
+        return f"UserRecord(id={self.id!r}, email={self.email!r}, is_verified={self.is_verified})"
+
+
+class UserStore:
+    _listeners: Tuple[Callable[[str], None], ...] = ()
+    # True if every worker process on the host sees the same users, so
+    # state kept alongside them (codes, rate limits, revocations) must be
+    # shared too.
+    shared = False
+
+    def add_listener(self, callback: Callable[[str], None]) -> None:
+        """Call ``callback(email)`` after a user is added or changed."""
+        self._listeners = self._listeners + (callback,)
+
+    def _notify(self, email: str) -> None:
+        for callback in self._listeners:
+            callback(email)
+
+    def data_version(self) -> Optional[int]:
+        """A number that changes when another process writes to the store.
+
+        None for stores that only this process can write to.
+        """
+        return None
+
+    def worker_id_dir(self) -> Optional[str]:
+        """Where processes sharing the store claim distinct id worker numbers.
+
+        None for stores only this process can write to.
+        """
+        return None
+
+    def get(self, email: str) -> Optional[UserRecord]:
+        raise NotImplementedError
+
+    def add(self, user: dict) -> bool:
+        """Insert ``user`` unless the email is taken. Returns True if inserted."""
+        raise NotImplementedError
+
+    def add_many(self, users: Iterable[dict]) -> int:
+        return sum(1 for user in users if self.add(user))
+
+    def update(self, email: str, **fields) -> bool:
+        raise NotImplementedError
+
+    def values(self) -> Iterator[UserRecord]:
+        return self.iter_users()
+
+    def iter_users(self, is_verified: Optional[bool] = None) -> Iterator[UserRecord]:
+        """Yield users in signup order without materializing the whole list."""
+        raise NotImplementedError
+
+    def iter_snapshot(self, is_verified: Optional[bool] = None) -> Iterator[UserRecord]:
+        """Like ``iter_users``, but every user is seen as of the first ``next()``.
+
+        Signups and updates made while the iteration runs are not blocked and
+        do not show up in it.
+        """
+        return self.iter_users(is_verified)
+
+    def page(
+        self, cursor: Optional[str] = None, limit: int = 100, is_verified: Optional[bool] = None
+    ) -> Tuple[List[UserRecord], Optional[str]]:
+        """Return up to ``limit`` users after ``cursor`` and the cursor for the next page."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, email: str) -> bool:
+        return self.get(email) is not None
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryUserStore(UserStore):
+    """Users in process memory, split across ``shards`` dicts by email hash.
+
+    Each shard has its own lock, so writes to different emails don't wait
+    for each other, and ``add`` checks and inserts under the one lock that
+    guards its email. Reads take no lock.
+    """
+
+    def __init__(self, shards: int = 16):
+        if shards < 1 or shards & (shards - 1):
+            raise ValueError("shards must be a power of two")
+        self._mask = shards - 1
+        self._shards: List[Dict[str, UserRecord]] = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        # Keys in signup order. Users are never deleted, so a position in this
+        # list is a stable pagination cursor. A key is appended only after its
+        # record is in its shard, so every key here can be looked up.
+        self._order: List[str] = []
+        # Serializes opening and closing snapshot views; held with every shard lock.
+        self._lock = threading.Lock()
+        # Open iter_snapshot views, each holding the records replaced since it began.
+        self._views: Dict[int, Dict[str, UserRecord]] = {}
+
+    def _lookup(self, key: str) -> Optional[UserRecord]:
+        return self._shards[hash(key) & self._mask].get(key)
+
+    def _insert(self, key: str, user: UserRecord) -> None:
+        self._shards[hash(key) & self._mask][key] = user
+        self._order.append(key)
+
+    def _replace(self, key: str, user: UserRecord) -> None:
+        """Swap in a new record for ``key``; the caller holds its shard's lock."""
+        shard = self._shards[hash(key) & self._mask]
+        if self._views:
+            current = shard[key]
+            for replaced in self._views.values():
+                replaced.setdefault(key, current)
+        shard[key] = user
+
+    def _lock_all(self) -> None:
+        self._lock.acquire()
+        for lock in self._locks:
+            lock.acquire()
+
+    def _unlock_all(self) -> None:
+        for lock in reversed(self._locks):
+            lock.release()
+        self._lock.release()
+
+    def get(self, email: str) -> Optional[UserRecord]:
+        return self._lookup(normalize_email(email))
+
+    def add(self, user: dict) -> bool:
+        key = normalize_email(user["email"])
+        index = hash(key) & self._mask
+        with self._locks[index]:
+            if key in self._shards[index]:
+                return False
+            # Most emails are already lowercase; share one string with the key.
+            self._insert(key, UserRecord.from_dict(user, email=key))
+        self._notify(user["email"])
+        return True
+
+    def update(self, email: str, **fields) -> bool:
+        key = normalize_email(email)
+        index = hash(key) & self._mask
+        with self._locks[index]:
+            current = self._shards[index].get(key)
+            if current is None:
+                return False
+            self._replace(key, current.replace(**fields))
+        self._notify(email)
+        return True
+
+    def iter_users(self, is_verified: Optional[bool] = None) -> Iterator[UserRecord]:
+        shards, mask, order = self._shards, self._mask, self._order
+        # Stop at the size seen on entry so concurrent signups don't extend the scan.
+        for position in range(len(order)):
+            key = order[position]
+            user = shards[hash(key) & mask][key]
+            if is_verified is None or user.is_verified == is_verified:
+                yield user
+
+    def iter_snapshot(self, is_verified: Optional[bool] = None) -> Iterator[UserRecord]:
+        # Copy-on-write: rather than copying the store up front, updates save
+        # the record they replace into every open view (see _replace), so a
+        # view costs memory only for what changes while it is being read.
+        replaced: Dict[str, UserRecord] = {}
+        self._lock_all()
+        try:
+            end = len(self._order)
+            self._views[id(replaced)] = replaced
+        finally:
+            self._unlock_all()
+        try:
+            shards, mask, order = self._shards, self._mask, self._order
+            for position in range(end):
+                key = order[position]
+                # Read the live record first: if an update lands in between,
+                # it has already saved the old record here.
+                user = shards[hash(key) & mask][key]
+                user = replaced.get(key, user)
+                if is_verified is None or user.is_verified == is_verified:
+                    yield user
+        finally:
+            self._lock_all()
+            try:
+                del self._views[id(replaced)]
+            finally:
+                self._unlock_all()
+
+    def page(
+        self, cursor: Optional[str] = None, limit: int = 100, is_verified: Optional[bool] = None
+    ) -> Tuple[List[UserRecord], Optional[str]]:
+        shards, mask, order = self._shards, self._mask, self._order
+        position = decode_cursor(cursor) if cursor else 0
+        end = len(order)
+        result: List[UserRecord] = []
+        while position < end and len(result) < limit:
+            key = order[position]
+            user = shards[hash(key) & mask][key]
+            position += 1
+            if is_verified is None or user.is_verified == is_verified:
+                result.append(user)
+        return result, encode_cursor(position) if position < end else None
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+# verification_code stays in the schema for old databases but is no longer used.
+_SELECT_COLUMNS = "id, email, password, is_verified, created_at"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL,
+    email_normalized TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    is_verified INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    verification_code TEXT
+);
+"""
+
+# COUNT(*) scans the whole table, so triggers keep the count in a one-row
+# table instead. Triggers run in the inserting transaction, which keeps the
+# count exact whichever process writes. An existing database is counted once,
+# in the same transaction that adds the triggers.
+SQLITE_COUNT_SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS user_count (id INTEGER PRIMARY KEY CHECK (id = 0), n INTEGER NOT NULL);
+INSERT OR IGNORE INTO user_count (id, n) SELECT 0, COUNT(*) FROM users;
+CREATE TRIGGER IF NOT EXISTS users_count_insert AFTER INSERT ON users
+BEGIN UPDATE user_count SET n = n + 1 WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS users_count_delete AFTER DELETE ON users
+BEGIN UPDATE user_count SET n = n - 1 WHERE id = 0; END;
+COMMIT;
+"""
+
+
+def _row_to_user(row) -> UserRecord:
+    return UserRecord(row[0], row[1], row[2].encode(), bool(row[3]), _to_epoch_us(datetime.fromisoformat(row[4])))
+
+
+def _user_params(user: dict) -> tuple:
+    user = UserRecord.from_dict(user)
+    return (
+        user.id,
+        user.email,
+        normalize_email(user.email),
+        user.password,
+        int(user.is_verified),
+        user.created_at.isoformat(),
+        None,
+    )
+
+
+class _WriteJob:
+    __slots__ = ("sql", "params", "many", "done", "result", "error")
+
+    def __init__(self, sql: str, params, many: bool = False):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.done = threading.Event()
+        self.result = 0
+        self.error: Optional[BaseException] = None
+
+
+class _ReaderLease:
+    """Holds one thread's reader connection; the connection closes with it."""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+class SQLiteUserStore(UserStore):
+    """SQLite (WAL) backed store.
+
+    Reads use one connection per thread. Writes are funnelled through a
+    single writer thread that group-commits whatever has queued up, so
+    concurrent signups share one fsync instead of paying one each.
+    """
+
+    shared = True
+
+    _INSERT = (
+        "INSERT OR IGNORE INTO users "
+        "(id, email, email_normalized, password, is_verified, created_at, verification_code) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)"
+    )
+    _SELECT_ONE = f"SELECT {_SELECT_COLUMNS} FROM users WHERE email_normalized = ?"
+
+    def __init__(self, path: str, batch_size: int = 256):
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._jobs: "queue.Queue[Optional[_WriteJob]]" = queue.Queue()
+        writer = self._connect()
+        writer.executescript(SQLITE_SCHEMA)
+        writer.executescript(SQLITE_COUNT_SCHEMA)
+        # Every thread's lease, so close() can close readers of live threads.
+        self._readers: "weakref.WeakSet[_ReaderLease]" = weakref.WeakSet()
+        self._readers_lock = threading.Lock()
+        self._version_conn = self._connect()
+        self._version_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, args=(writer,), name="sqlite-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            lease = _ReaderLease(conn)
+            # The thread-local, and so the lease, goes away when its thread
+            # exits; close the connection then rather than whenever it is collected.
+            weakref.finalize(lease, conn.close)
+            with self._readers_lock:
+                self._readers.add(lease)
+            self._local.lease = lease
+        return lease.conn
+
+    def _write_loop(self, conn: sqlite3.Connection) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                conn.close()
+                return
+            batch: List[_WriteJob] = [job]
+            while len(batch) < self.batch_size:
+                try:
+                    nxt = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._jobs.put(None)
+                    break
+                batch.append(nxt)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for item in batch:
+                    try:
+                        if item.many:
+                            item.result = conn.executemany(item.sql, item.params).rowcount
+                        else:
+                            item.result = conn.execute(item.sql, item.params).rowcount
+                    except sqlite3.Error as e:
+                        item.error = e
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                for item in batch:
+                    item.error = item.error or e
+            for item in batch:
+                item.done.set()
+
+    def _write(self, sql: str, params, many: bool = False) -> int:
+        job = _WriteJob(sql, params, many)
+        self._jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def data_version(self) -> Optional[int]:
+        # Changes whenever a connection other than this one commits, which
+        # includes our own writer thread.
+        with self._version_lock:
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def worker_id_dir(self) -> Optional[str]:
+        return f"{self.path}.workers"
+
+    def get(self, email: str) -> Optional[UserRecord]:
+        row = self._reader().execute(self._SELECT_ONE, (normalize_email(email),)).fetchone()
+        return _row_to_user(row) if row is not None else None
+
+    def add(self, user: dict) -> bool:
+        added = self._write(self._INSERT, _user_params(user)) == 1
+        if added:
+            self._notify(user["email"])
+        return added
+
+    def add_many(self, users: Iterable[dict]) -> int:
+        users = list(users)
+        added = self._write(self._INSERT, [_user_params(u) for u in users], many=True)
+        if self._listeners:
+            for user in users:
+                self._notify(user["email"])
+        return added
+
+    def update(self, email: str, **fields) -> bool:
+        unknown = set(fields) - UPDATABLE_FIELDS
+        if unknown:
+            raise ValueError(f"Cannot update fields: {sorted(unknown)}")
+        values = []
+        for name, value in fields.items():
+            if name == "is_verified":
+                value = int(bool(value))
+            elif name == "created_at":
+                value = value.isoformat()
+            values.append(value)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        sql = f"UPDATE users SET {assignments} WHERE email_normalized = ?"
+        updated = self._write(sql, (*values, normalize_email(email))) == 1
+        if updated:
+            self._notify(email)
+        return updated
+
+    def iter_users(self, is_verified: Optional[bool] = None) -> Iterator[UserRecord]:
+        # A dedicated connection keeps the read transaction (and so the WAL
+        # snapshot) private to this iteration. That already makes it a
+        # point-in-time view, so it doubles as iter_snapshot.
+        conn = self._connect()
+        try:
+            if is_verified is None:
+                cursor = conn.execute(f"SELECT {_SELECT_COLUMNS} FROM users ORDER BY seq")
+            else:
+                cursor = conn.execute(
+                    f"SELECT {_SELECT_COLUMNS} FROM users WHERE is_verified = ? ORDER BY seq",
+                    (int(is_verified),),
+                )
+            while True:
+                rows = cursor.fetchmany(500)
+                if not rows:
+                    return
+                for row in rows:
+                    yield _row_to_user(row)
+        finally:
+            conn.close()
+
+    def page(
+        self, cursor: Optional[str] = None, limit: int = 100, is_verified: Optional[bool] = None
+    ) -> Tuple[List[UserRecord], Optional[str]]:
+        after = decode_cursor(cursor) if cursor else 0
+        sql = f"SELECT seq, {_SELECT_COLUMNS} FROM users WHERE seq > ?"
+        params: list = [after]
+        if is_verified is not None:
+            sql += " AND is_verified = ?"
+            params.append(int(is_verified))
+        sql += " ORDER BY seq LIMIT ?"
+        params.append(limit + 1)
+        rows = self._reader().execute(sql, params).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0]) if more else None
+        return [_row_to_user(row[1:]) for row in rows], next_cursor
+
+    def __len__(self) -> int:
+        return self._reader().execute("SELECT n FROM user_count WHERE id = 0").fetchone()[0]
+
+    def close(self) -> None:
+        self._jobs.put(None)
+        self._writer.join(5)
+        with self._version_lock:
+            self._version_conn.close()
+        with self._readers_lock:
+            leases = list(self._readers)
+        for lease in leases:
+            lease.conn.close()
+
+
+def create_user_store(data_dir: str) -> UserStore:
+    """Build the store selected by ``USER_STORE``: ``memory``, ``sqlite``, ``journal`` or ``shm``.
+
+    ``USER_STORE_PATH`` overrides where the engine keeps its files; by
+    default they live under ``data_dir``.
+    """
+    engine = os.getenv("USER_STORE", "memory").lower()
+    path = os.getenv("USER_STORE_PATH")
+    if engine == "memory":
+        return MemoryUserStore(shards=int(os.getenv("USER_STORE_SHARDS", "16")))
+    if engine == "sqlite":
+        return SQLiteUserStore(path or os.path.join(data_dir, "users.db"))
+    if engine == "shm":
+        from .shm_store import SharedMemoryUserStore
+        return SharedMemoryUserStore.from_env(data_dir)
+    if engine == "journal":
+        from .journal import JournaledUserStore
+        return JournaledUserStore(
+            path or os.path.join(data_dir, "users-journal"),
+            fsync_interval=float(os.getenv("USER_JOURNAL_FSYNC_MS", "50")) / 1000,
+            snapshot_every=int(os.getenv("USER_SNAPSHOT_EVERY", "100000")),
+        )
+    raise ValueError(f"Unknown USER_STORE engine: {engine}")
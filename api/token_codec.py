@@ -0,0 +1,94 @@
+"""HS256-only JWT codec for the request hot path.
+
+Produces the same bytes as ``jose.jwt.encode(claims, key, algorithm="HS256")``
+and accepts tokens issued by it, but skips the generic JWS machinery: the
+header segment is encoded once, the HMAC is keyed once and copied per
+call, and signatures are compared in constant time.
+"""
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+_TIME_CLAIMS = ("exp", "iat", "nbf")
+
+
+class TokenError(Exception):
+    """Raised for malformed, forged or expired tokens."""
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+class HS256Codec:
+    HEADER = _b64encode(b'{"alg":"HS256","typ":"JWT"}')
+
+    def __init__(self, secret: str):
+        self._mac = hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+        self._dumps = json.JSONEncoder(separators=(",", ":")).encode
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        for name in _TIME_CLAIMS:
+            value = claims.get(name)
+            if isinstance(value, datetime):
+                claims = {**claims, name: calendar.timegm(value.utctimetuple())}
+        signing_input = self.HEADER + b"." + _b64encode(self._dumps(claims).encode('utf-8'))
+        return (signing_input + b"." + _b64encode(self._sign(signing_input))).decode('ascii')
+
+    def decode(self, token: str, leeway: int = 0) -> Dict[str, Any]:
+        try:
+            raw = token.encode('ascii')
+        except (UnicodeEncodeError, AttributeError):
+            raise TokenError("Malformed token")
+        signing_input, _, signature = raw.rpartition(b".")
+        header, _, payload = signing_input.partition(b".")
+        if not header or not payload or not signature or b"." in payload:
+            raise TokenError("Malformed token")
+        if header != self.HEADER:
+            # Other encoders may order or space the header differently.
+            try:
+                alg = json.loads(_b64decode(header)).get("alg")
+            except (ValueError, AttributeError):
+                raise TokenError("Malformed token header")
+            if alg != "HS256":
+                raise TokenError("Unsupported algorithm")
+        try:
+            expected = _b64decode(signature)
+        except ValueError:
+            raise TokenError("Malformed token signature")
+        if not hmac.compare_digest(self._sign(signing_input), expected):
+            raise TokenError("Signature verification failed")
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise TokenError("Malformed token payload")
+        if not isinstance(claims, dict):
+            raise TokenError("Malformed token payload")
+        now = time.time()
+        exp = claims.get("exp")
+        if exp is not None:
+            if not isinstance(exp, (int, float)):
+                raise TokenError("Expiration Time claim (exp) must be an integer")
+            if exp < now - leeway:
+                raise TokenError("Signature has expired")
+        nbf = claims.get("nbf")
+        if nbf is not None:
+            if not isinstance(nbf, (int, float)):
+                raise TokenError("Not Before claim (nbf) must be an integer")
+            if nbf > now + leeway:
+                raise TokenError("The token is not yet valid (nbf)")
+        return claims
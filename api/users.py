@@ -1,38 +1,79 @@
 from http.server import BaseHTTPRequestHandler
-from .shared import users_db
+from . import responses
+from urllib.parse import urlsplit, parse_qs
+from .shared import users_db, send_conditional, versions, metrics
 
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+
+def user_summary(user):
+    return {
+        "id": user["id"],
+        "email": user["email"],
+        "is_verified": user["is_verified"],
+        "created_at": user["created_at"].isoformat()
+    }
+
+def parse_bool(value):
+    if value is None:
+        return None
+    if value.lower() in ("true", "1", "yes"):
+        return True
+    if value.lower() in ("false", "0", "no"):
+        return False
+    raise ValueError("is_verified must be true or false")
+
+@metrics.instrument_handler("/api/users")
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
-        import json
-        
         try:
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
-                "users": [
-                    {
-                        "id": user["id"],
-                        "email": user["email"],
-                        "is_verified": user["is_verified"],
-                        "created_at": user["created_at"].isoformat()
-                    }
-                    for user in users_db.values()
-                ],
-                "total": len(users_db)
-            }).encode())
+            query = {k: v[-1] for k, v in parse_qs(urlsplit(self.path).query).items()}
+            try:
+                is_verified = parse_bool(query.get("is_verified"))
+            except ValueError as e:
+                responses.send_error(self, 400, str(e))
+                return
+            # Same order as the FastAPI route: the NDJSON stream ignores limit.
+            if query.get("format") == "ndjson" or "application/x-ndjson" in self.headers.get('Accept', ''):
+                self.stream_ndjson(is_verified)
+                return
+            try:
+                limit = int(query.get("limit", USERS_PAGE_DEFAULT))
+            except ValueError:
+                limit = 0
+            if limit < 1 or limit > USERS_PAGE_MAX:
+                responses.send_error(self, 400, f"limit must be between 1 and {USERS_PAGE_MAX}")
+                return
+            cursor = query.get("cursor")
+            
+            def build():
+                users, next_cursor = users_db.page(cursor, limit, is_verified)
+                return {
+                    "users": [user_summary(user) for user in users],
+                    "total": len(users_db),
+                    "next_cursor": next_cursor
+                }
+            
+            key = ("users", cursor, limit, is_verified)
+            try:
+                send_conditional(self, key, versions.collection(), build)
+            except ValueError:
+                # Only page() raises it, for a cursor it cannot decode.
+                responses.send_error(self, 400, "Invalid cursor")
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": str(e)}).encode())
+            responses.send_error(self, 500, str(e))
+    
+    def stream_ndjson(self, is_verified):
+        responses.start_stream(self, 200, 'application/x-ndjson')
+        batch = []
+        for user in users_db.iter_snapshot(is_verified):
+            batch.append(responses.dumps(user_summary(user)))
+            if len(batch) >= 500:
+                self.wfile.write(b"\n".join(batch) + b"\n")
+                batch = []
+        if batch:
+            self.wfile.write(b"\n".join(batch) + b"\n")
     
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+        responses.send(self, responses.PREFLIGHT_GET)
@@ -1,67 +1,60 @@
 from http.server import BaseHTTPRequestHandler
+from . import responses
 from pydantic import BaseModel, EmailStr
-from .shared import users_db, verification_codes
+from .shared import users_db, verification_codes, client_ip, reject_if_rate_limited, metrics
+from .codes import CODE_OK, CODE_MISSING, CODE_LOCKED
 
 class EmailVerification(BaseModel):
     email: EmailStr
     verification_code: str
 
+USER_NOT_FOUND = responses.static_json(404, {"detail": "User not found"})
+ALREADY_VERIFIED = responses.static_json(400, {"detail": "Email already verified"})
+VERIFIED = responses.static_json(200, {"message": "Email verified successfully! You can now log in."})
+
+@metrics.instrument_handler("/api/verify-email")
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         import json
         
         try:
+            if reject_if_rate_limited(self, "verify_ip", client_ip(self)):
+                return
+            
             content_length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(content_length).decode('utf-8')
             verification_data = EmailVerification(**json.loads(body))
             
-            user = users_db.get(verification_data.email)
+            if reject_if_rate_limited(self, "verify_email", verification_data.email):
+                return
+            
+            with metrics.stage("store_lookup"):
+                user = users_db.get(verification_data.email)
             if not user:
-                self.send_response(404)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "User not found"}).encode())
+                responses.send(self, USER_NOT_FOUND)
                 return
             
             if user["is_verified"]:
-                self.send_response(400)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Email already verified"}).encode())
+                responses.send(self, ALREADY_VERIFIED)
                 return
             
-            stored_code = verification_codes.get(verification_data.email)
-            if not stored_code or stored_code != verification_data.verification_code:
-                self.send_response(400)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Invalid verification code"}).encode())
+            result = verification_codes.verify(verification_data.email, verification_data.verification_code)
+            if result != CODE_OK:
+                if result == CODE_MISSING:
+                    detail = "Verification code expired. Please sign up again to get a new code."
+                elif result == CODE_LOCKED:
+                    detail = "Too many invalid attempts. Please sign up again to get a new code."
+                else:
+                    detail = "Invalid verification code"
+                responses.send_error(self, 400, detail)
                 return
             
-            users_db[verification_data.email]["is_verified"] = True
-            
-            if verification_data.email in verification_codes:
-                del verification_codes[verification_data.email]
+            users_db.update(verification_data.email, is_verified=True)
             
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"message": "Email verified successfully! You can now log in."}).encode())
+            responses.send(self, VERIFIED)
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": str(e)}).encode())
+            responses.send_error(self, 500, str(e))
     
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+        responses.send(self, responses.PREFLIGHT_POST)
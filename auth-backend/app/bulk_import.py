@@ -0,0 +1,316 @@
+"""Bulk user import from CSV or NDJSON.
+
+Input is read and written in fixed-size chunks, so memory stays flat no
+matter how large the file is. Every record needs ``email`` and
+``password``; optional ``id``, ``is_verified`` and ``created_at`` fields are
+kept. A password that is already a bcrypt hash is stored as-is, anything
+else is hashed on a process pool, one chunk ahead of the chunk being
+written. The pool is only started once a plaintext password turns up;
+with ``workers <= 1``, or where processes cannot be pooled (serverless
+hosts without ``/dev/shm``), the ``PasswordHasher`` thread pool is used
+instead. Emails that are already registered are skipped, never
+overwritten.
+
+From ``auth-backend/``, against the store selected by ``USER_STORE``:
+
+    python -m app.bulk_import users.csv --verified
+
+The journal store can only be opened by one process, so stop the server
+first; the sqlite store can be imported into while it runs.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice, repeat
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from email_validator import EmailNotValidError, validate_email
+
+from .hashing import PasswordHasher, _hashpw
+from .ids import IdGenerator
+from .logs import get_logger
+from .storage import UserStore, create_user_store
+
+logger = get_logger("auth.import")
+
+FORMATS = ("csv", "ndjson")
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+MAX_ERRORS = 20
+
+Record = Tuple[int, Optional[dict]]
+
+
+def is_bcrypt_hash(password: str) -> bool:
+    return len(password) == 60 and password.startswith(BCRYPT_PREFIXES)
+
+
+def detect_format(filename: str) -> str:
+    lowered = filename.lower()
+    if lowered.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if lowered.endswith(".csv"):
+        return "csv"
+    raise ValueError(f"Cannot tell the format of {filename}; expected .csv, .ndjson or .jsonl")
+
+
+def read_records(stream: IO[str], fmt: str) -> Iterator[Record]:
+    """Yield ``(line, record)`` pairs; ``record`` is None for lines that do not parse."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "ndjson":
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = None
+            yield line, record if isinstance(record, dict) else None
+    else:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+
+def _truthy(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+class ImportProgress:
+    __slots__ = ("read", "imported", "existing", "invalid", "hashed", "prehashed", "errors", "started", "finished")
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.existing = 0
+        self.invalid = 0
+        self.hashed = 0
+        self.prehashed = 0
+        self.errors: List[Dict[str, object]] = []
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def reject(self, line: int, error: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def as_dict(self) -> Dict[str, object]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "read": self.read,
+            "imported": self.imported,
+            "existing": self.existing,
+            "invalid": self.invalid,
+            "hashed": self.hashed,
+            "prehashed": self.prehashed,
+            "elapsed_s": round(elapsed, 3),
+            "records_per_s": round(self.read / elapsed, 1) if elapsed else 0.0,
+            "errors": list(self.errors),
+            "finished": self.finished,
+        }
+
+
+class BulkImporter:
+    """Streams records into a ``UserStore`` one batched transaction per chunk.
+
+    ``issue_code`` gives unverified users a verification code, and
+    ``on_imported`` is called with the users each chunk actually inserted,
+    which is where verification emails get queued. Records without an
+    ``id`` get one from ``ids``, the same generator signup uses (by default
+    one built for ``store``).
+    """
+
+    def __init__(
+        self,
+        store: UserStore,
+        rounds: int = 12,
+        workers: Optional[int] = None,
+        chunk_size: int = 500,
+        mark_verified: bool = False,
+        issue_code: Optional[Callable[[], str]] = None,
+        on_imported: Optional[Callable[[List[dict]], None]] = None,
+        ids: Optional[IdGenerator] = None,
+        hasher: Optional[PasswordHasher] = None,
+    ):
+        self.store = store
+        self.ids = ids if ids is not None else IdGenerator.from_env(store)
+        self.rounds = rounds
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.mark_verified = mark_verified
+        self.issue_code = issue_code
+        self.on_imported = on_imported
+        self.hasher = hasher if hasher is not None else PasswordHasher(rounds=rounds)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_unavailable = workers is not None and workers <= 1
+
+    def _build_user(self, record: dict, now: datetime) -> Tuple[dict, Optional[str]]:
+        """Validate ``record``; returns the user and the plaintext still to hash."""
+        email = str(record.get("email") or "").strip()
+        try:
+            validate_email(email, check_deliverability=False)
+        except EmailNotValidError as e:
+            raise ValueError(f"invalid email: {e}")
+        password = str(record.get("password") or "")
+        plaintext = None
+        if not is_bcrypt_hash(password):
+            if len(password) < 6:
+                raise ValueError("password must be at least 6 characters long")
+            plaintext, password = password, ""
+        created_at = record.get("created_at")
+        try:
+            created_at = datetime.fromisoformat(str(created_at).replace("Z", "+00:00")) if created_at else now
+        except ValueError:
+            raise ValueError(f"invalid created_at: {created_at}")
+        if created_at.tzinfo is not None:
+            # Stored timestamps are naive UTC.
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        is_verified = self.mark_verified or _truthy(record.get("is_verified"))
+        user = {
+            "id": str(record.get("id") or f"user_{self.ids.next_id()}"),
+            "email": email,
+            "password": password,
+            "is_verified": is_verified,
+            "created_at": created_at,
+            "verification_code": None if is_verified or self.issue_code is None else self.issue_code(),
+        }
+        return user, plaintext
+
+    def _process_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self._pool is None and not self._pool_unavailable:
+            try:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            except (OSError, ImportError, NotImplementedError) as e:
+                # No working sem_open, e.g. no /dev/shm on AWS Lambda.
+                logger.warning("import.process_pool_unavailable", error=str(e))
+                self._pool_unavailable = True
+        return self._pool
+
+    def _hash(self, plaintexts: List[bytes]) -> Iterator[bytes]:
+        if not plaintexts:
+            return iter(())
+        pool = self._process_pool()
+        if pool is not None:
+            # Submitted now, collected when the chunk is written.
+            return pool.map(_hashpw, plaintexts, repeat(self.rounds))
+        return self.hasher.hash_many(plaintexts, self.rounds)
+
+    def _prepare(self, chunk: List[Record], progress: ImportProgress):
+        now = datetime.utcnow()
+        users: List[dict] = []
+        plaintexts: List[bytes] = []
+        for line, record in chunk:
+            progress.read += 1
+            if record is None:
+                progress.reject(line, "malformed record")
+                continue
+            try:
+                user, plaintext = self._build_user(record, now)
+            except ValueError as e:
+                progress.reject(line, str(e))
+                continue
+            if user["email"] in self.store:
+                progress.existing += 1
+                continue
+            users.append(user)
+            if plaintext is not None:
+                plaintexts.append(plaintext.encode("utf-8"))
+        return users, self._hash(plaintexts)
+
+    def _write(self, users: List[dict], hashes: Iterator[bytes], progress: ImportProgress) -> None:
+        for user in users:
+            if user["password"]:
+                progress.prehashed += 1
+            else:
+                user["password"] = next(hashes).decode("utf-8")
+                progress.hashed += 1
+        if not users:
+            return
+        added = self.store.add_many(users)
+        if added != len(users):
+            # Lost a race with a signup, or the input repeats an email.
+            progress.existing += len(users) - added
+            users = [u for u in users if (self.store.get(u["email"]) or {}).get("id") == u["id"]]
+        progress.imported += added
+        if self.on_imported is not None and users:
+            self.on_imported(users)
+
+    def iter_import(self, records: Iterable[Record]) -> Iterator[ImportProgress]:
+        """Import ``records``, yielding the running totals after each chunk."""
+        progress = ImportProgress()
+        records = iter(records)
+        pending = None
+        try:
+            while True:
+                chunk = list(islice(records, self.chunk_size))
+                prepared = self._prepare(chunk, progress) if chunk else None
+                # Hash this chunk while the previous one is written.
+                if pending is not None:
+                    self._write(*pending, progress)
+                    if prepared is not None:
+                        yield progress
+                if prepared is None:
+                    break
+                pending = prepared
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        progress.finished = True
+        yield progress
+
+    def run(self, records: Iterable[Record], report: Optional[Callable[[ImportProgress], None]] = None) -> ImportProgress:
+        progress = None
+        for progress in self.iter_import(records):
+            if report is not None:
+                report(progress)
+        return progress
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import users from CSV or NDJSON into the user store")
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+    parser.add_argument("--verified", action="store_true", help="mark every imported user as verified")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, help="hashing processes (default: CPU count)")
+    parser.add_argument("--rounds", type=int, help="bcrypt cost for plaintext passwords (default: BCRYPT_ROUNDS or 12)")
+    args = parser.parse_args()
+
+    if os.getenv("USER_STORE", "memory").lower() == "memory":
+        parser.error("USER_STORE=memory keeps users inside the server process; "
+                     "use the sqlite or journal store, or POST to /api/admin/import")
+    try:
+        fmt = args.format or ("csv" if args.path == "-" else detect_format(args.path))
+    except ValueError as e:
+        parser.error(str(e))
+    rounds = args.rounds or int(os.getenv("BCRYPT_ROUNDS") or 12)
+    store = create_user_store(".")
+    importer = BulkImporter(store, rounds=rounds, workers=args.workers, chunk_size=args.chunk_size,
+                            mark_verified=args.verified)
+
+    def report(progress: ImportProgress) -> None:
+        print(f"read {progress.read}  imported {progress.imported}  existing {progress.existing}  "
+              f"invalid {progress.invalid}  ({progress.as_dict()['records_per_s']}/s)", file=sys.stderr)
+
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="") if args.path == "-" \
+        else open(args.path, encoding="utf-8", newline="")
+    try:
+        progress = importer.run(read_records(stream, fmt), report)
+    finally:
+        stream.close()
+        store.close()
+    print(json.dumps(progress.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
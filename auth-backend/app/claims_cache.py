@@ -0,0 +1,97 @@
+"""Bounded LRU cache of verified JWT claims.
+
+Keyed by a digest of the raw token, so repeat requests from the same
+session skip signature verification and claims parsing. An entry is only
+served until the token's ``exp``; ``invalidate_subject`` drops every cached
+token for a user whose account changed.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from .storage import normalize_email
+
+
+class ClaimsCache:
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self._by_subject: Dict[str, Set[bytes]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ClaimsCache":
+        return cls(max_size=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def _drop(self, key: bytes) -> None:
+        claims, _ = self._entries.pop(key)
+        subject = claims.get("sub")
+        if not isinstance(subject, str):
+            return
+        subject = normalize_email(subject)
+        keys = self._by_subject.get(subject)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_subject[subject]
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (claims, float(expires_at))
+            subject = claims.get("sub")
+            if isinstance(subject, str):
+                self._by_subject.setdefault(normalize_email(subject), set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_subject(self, subject: str) -> None:
+        with self._lock:
+            for key in list(self._by_subject.get(normalize_email(subject), ())):
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_subject.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,330 @@
+"""Expiring store for pending email verification codes.
+
+Each code lives for ``ttl`` seconds and allows ``max_attempts`` wrong
+guesses. Entries are also filed into expiry buckets (one per
+``resolution`` seconds); every operation advances a cursor over the
+buckets that have fallen due and drops their entries, so expiry costs
+O(1) per entry with no background thread. When ``max_size`` is reached
+the oldest entry is evicted.
+
+``VerificationCodeStore`` keeps codes in process memory. Workers that
+share a user store must also share codes, or a signup on one worker cannot
+be verified on another; ``SQLiteCodeStore`` keeps them in a SQLite file
+instead. ``create_code_store`` picks one from the environment.
+"""
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set, Union
+
+from .storage import normalize_email
+
+CODE_OK = "ok"
+CODE_INVALID = "invalid"
+CODE_MISSING = "missing"
+CODE_LOCKED = "locked"
+
+
+def _same_code(stored: str, supplied: str) -> bool:
+    # Constant time, like every other secret comparison in the app.
+    return hmac.compare_digest(stored.encode("utf-8"), supplied.encode("utf-8"))
+
+
+class _PendingCode:
+    __slots__ = ("code", "expires_at", "attempts")
+
+    def __init__(self, code: str, expires_at: float):
+        self.code = code
+        self.expires_at = expires_at
+        self.attempts = 0
+
+
+class VerificationCodeStore:
+    def __init__(
+        self,
+        ttl: float = 900.0,
+        max_size: int = 100000,
+        max_attempts: int = 5,
+        resolution: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.resolution = resolution
+        self._clock = clock
+        self._entries: "OrderedDict[str, _PendingCode]" = OrderedDict()
+        self._buckets: Dict[int, Set[str]] = {}
+        self._cursor = self._bucket(clock())
+        self._lock = threading.Lock()
+        self._expired = 0
+        self._evicted = 0
+        self._locked_out = 0
+
+    def _bucket(self, timestamp: float) -> int:
+        return int(timestamp // self.resolution)
+
+    def _advance(self, now: float) -> None:
+        due = self._bucket(now)
+        buckets = self._buckets
+        if due - self._cursor > len(buckets):
+            # Long idle gap: visiting the few live buckets beats walking every tick.
+            ticks = sorted(b for b in buckets if b < due)
+        else:
+            ticks = range(self._cursor, due)
+        for tick in ticks:
+            keys = buckets.pop(tick, None)
+            if not keys:
+                continue
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires_at <= now:
+                    del self._entries[key]
+                    self._expired += 1
+        self._cursor = max(self._cursor, due)
+
+    def _unfile(self, key: str, entry: _PendingCode) -> None:
+        keys = self._buckets.get(self._bucket(entry.expires_at))
+        if keys is not None:
+            keys.discard(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unfile(key, entry)
+
+    def issue(self, email: str, code: str) -> None:
+        key = normalize_email(email)
+        now = self._clock()
+        with self._lock:
+            self._advance(now)
+            self._remove(key)
+            entry = _PendingCode(code, now + self.ttl)
+            self._entries[key] = entry
+            # File under the bucket after expiry so the sweep never sees it early.
+            self._buckets.setdefault(self._bucket(entry.expires_at), set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest, evicted = self._entries.popitem(last=False)
+                self._unfile(oldest, evicted)
+                self._evicted += 1
+
+    def get(self, email: str) -> Optional[str]:
+        key = normalize_email(email)
+        now = self._clock()
+        with self._lock:
+            self._advance(now)
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                return None
+            return entry.code
+
+    def verify(self, email: str, code: str) -> str:
+        """Check ``code`` and consume it on success. Returns one of the CODE_* values."""
+        key = normalize_email(email)
+        now = self._clock()
+        with self._lock:
+            self._advance(now)
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                return CODE_MISSING
+            if _same_code(entry.code, code):
+                self._remove(key)
+                return CODE_OK
+            entry.attempts += 1
+            if entry.attempts >= self.max_attempts:
+                self._remove(key)
+                self._locked_out += 1
+                return CODE_LOCKED
+            return CODE_INVALID
+
+    def discard(self, email: str) -> None:
+        with self._lock:
+            self._remove(normalize_email(email))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._advance(self._clock())
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            self._advance(self._clock())
+            return {
+                "backend": "memory",
+                "pending": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "expired": self._expired,
+                "evicted": self._evicted,
+                "locked_out": self._locked_out,
+            }
+
+
+class SQLiteCodeStore:
+    """Codes in a SQLite file shared by every process on the host.
+
+    Expiry uses wall-clock time, since a monotonic clock means nothing to
+    another process. Expired rows are swept, and the oldest evicted past
+    ``max_size``, once every ``sweep_every`` issued codes; reads ignore
+    expired rows until then.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 900.0,
+        max_size: int = 100000,
+        max_attempts: int = 5,
+        sweep_every: int = 1000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self._sweep_every = sweep_every
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._expired = 0
+        self._evicted = 0
+        self._locked_out = 0
+        self._conn().executescript(
+            "CREATE TABLE IF NOT EXISTS verification_codes ("
+            "email TEXT PRIMARY KEY, code TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS verification_codes_expiry ON verification_codes (expires_at);"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute("DELETE FROM verification_codes WHERE expires_at <= ?", (now,)).rowcount
+        # Every code gets the same ttl, so the oldest is the one expiring first.
+        evicted = conn.execute(
+            "DELETE FROM verification_codes WHERE email IN ("
+            "SELECT email FROM verification_codes ORDER BY expires_at "
+            "LIMIT max(0, (SELECT COUNT(*) FROM verification_codes) - ?))",
+            (self.max_size,),
+        ).rowcount
+        with self._lock:
+            self._expired += expired
+            self._evicted += evicted
+
+    def issue(self, email: str, code: str) -> None:
+        now = self._clock()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO verification_codes (email, code, expires_at, attempts) VALUES (?, ?, ?, 0)",
+                (normalize_email(email), code, now + self.ttl),
+            )
+            with self._lock:
+                self._issued += 1
+                sweep = self._issued % self._sweep_every == 0
+            if sweep:
+                self._sweep(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, email: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT code FROM verification_codes WHERE email = ? AND expires_at > ?",
+            (normalize_email(email), self._clock()),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def verify(self, email: str, code: str) -> str:
+        """Check ``code`` and consume it on success. Returns one of the CODE_* values."""
+        key = normalize_email(email)
+        conn = self._conn()
+        # BEGIN IMMEDIATE so two workers cannot both spend the last attempt.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT code, attempts FROM verification_codes WHERE email = ? AND expires_at > ?",
+                (key, self._clock()),
+            ).fetchone()
+            if row is None:
+                result = CODE_MISSING
+            elif _same_code(row[0], code):
+                conn.execute("DELETE FROM verification_codes WHERE email = ?", (key,))
+                result = CODE_OK
+            elif row[1] + 1 >= self.max_attempts:
+                conn.execute("DELETE FROM verification_codes WHERE email = ?", (key,))
+                result = CODE_LOCKED
+            else:
+                conn.execute("UPDATE verification_codes SET attempts = attempts + 1 WHERE email = ?", (key,))
+                result = CODE_INVALID
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if result == CODE_LOCKED:
+            with self._lock:
+                self._locked_out += 1
+        return result
+
+    def discard(self, email: str) -> None:
+        self._conn().execute("DELETE FROM verification_codes WHERE email = ?", (normalize_email(email),))
+
+    def __len__(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM verification_codes WHERE expires_at > ?", (self._clock(),)
+        ).fetchone()[0]
+
+    def stats(self) -> Dict[str, object]:
+        pending = len(self)
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "pending": pending,
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "expired": self._expired,
+                "evicted": self._evicted,
+                "locked_out": self._locked_out,
+            }
+
+
+def create_code_store(data_dir: str, shared: bool = False) -> Union[VerificationCodeStore, SQLiteCodeStore]:
+    """Build the store selected by ``VERIFICATION_CODE_BACKEND``: ``memory`` or ``sqlite``.
+
+    ``shared`` says the user store is shared between worker processes. The
+    backend then defaults to ``sqlite``, and ``memory`` is refused, since
+    codes kept per worker could only be verified on the worker that issued
+    them.
+    """
+    settings = dict(
+        ttl=float(os.getenv("VERIFICATION_CODE_TTL", "900")),
+        max_size=int(os.getenv("VERIFICATION_CODE_MAX", "100000")),
+        max_attempts=int(os.getenv("VERIFICATION_MAX_ATTEMPTS", "5")),
+    )
+    backend = os.getenv("VERIFICATION_CODE_BACKEND", "sqlite" if shared else "memory").lower()
+    if backend == "sqlite":
+        return SQLiteCodeStore(
+            os.getenv("VERIFICATION_CODE_PATH", os.path.join(data_dir, "codes.db")), **settings
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown VERIFICATION_CODE_BACKEND: {backend}")
+    if shared:
+        raise ValueError(
+            "VERIFICATION_CODE_BACKEND=memory keeps codes per worker, but the user store "
+            "is shared between workers; use VERIFICATION_CODE_BACKEND=sqlite"
+        )
+    return VerificationCodeStore(**settings)
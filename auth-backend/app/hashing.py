@@ -0,0 +1,267 @@
+"""Password hashing executor.
+
+bcrypt is deliberately slow, so running it inline stalls whatever thread
+(or event loop) called it. ``PasswordHasher`` pushes the work onto a
+dedicated thread or process pool with a bounded number of in-flight jobs
+and a per-call timeout, and keeps simple queue/latency statistics.
+
+The bcrypt cost can either be pinned (``BCRYPT_ROUNDS``) or calibrated
+against a latency budget on this host. The cost is embedded in every
+hash, so hashes made at a different cost are detected on login and
+rehashed in the background.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import bcrypt
+
+
+class HashingUnavailable(Exception):
+    """Raised when the hashing pool is saturated or a job times out."""
+
+
+def _hashpw(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Read the cost factor out of a ``$2b$12$...`` bcrypt hash."""
+    parts = hashed.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def measure_rounds(rounds: int, samples: int = 3) -> float:
+    """Best-of-``samples`` time in seconds for one bcrypt hash at ``rounds``."""
+    salt = bcrypt.gensalt(rounds)
+    best = float("inf")
+    for _ in range(samples):
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", salt)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def calibrate_rounds(budget_ms: float, min_rounds: int = 10, max_rounds: int = 16) -> Tuple[int, float]:
+    """Pick the highest cost whose hash time fits in ``budget_ms``.
+
+    Each extra round doubles the work, so one cheap measurement is enough to
+    extrapolate; the chosen cost is then measured for real and stepped down
+    if it overshoots. Never goes below ``min_rounds``.
+    """
+    probe = 8
+    per_hash = measure_rounds(probe) * 1000
+    rounds = probe
+    while rounds < max_rounds and per_hash * 2 ** (rounds + 1 - probe) <= budget_ms:
+        rounds += 1
+    rounds = max(min_rounds, rounds)
+    measured = measure_rounds(rounds, samples=1) * 1000
+    while rounds > min_rounds and measured > budget_ms:
+        rounds -= 1
+        measured = measure_rounds(rounds, samples=1) * 1000
+    return rounds, measured
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        mode: str = "thread",
+        workers: Optional[int] = None,
+        max_queue: int = 64,
+        timeout: float = 5.0,
+        rounds: int = 12,
+        budget_ms: Optional[float] = None,
+        min_rounds: int = 10,
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown hashing executor mode: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rounds = rounds
+        self.budget_ms = budget_ms
+        self.min_rounds = min_rounds
+        self.calibrated_ms: Optional[float] = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + max_queue)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._rehashed = 0
+
+    @classmethod
+    def from_env(cls) -> "PasswordHasher":
+        workers = os.getenv("PASSWORD_HASH_WORKERS")
+        rounds = os.getenv("BCRYPT_ROUNDS")
+        budget = os.getenv("PASSWORD_HASH_BUDGET_MS")
+        return cls(
+            mode=os.getenv("PASSWORD_HASH_EXECUTOR", "thread"),
+            workers=int(workers) if workers else None,
+            max_queue=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64")),
+            timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", "5")),
+            rounds=int(rounds) if rounds else 12,
+            # A pinned cost wins over calibration.
+            budget_ms=float(budget) if budget and not rounds else None,
+            min_rounds=int(os.getenv("BCRYPT_MIN_ROUNDS", "10")),
+        )
+
+    def calibrate(self) -> None:
+        """Fit the cost to ``budget_ms`` on this host, or just time the pinned cost."""
+        if self.budget_ms:
+            self.rounds, self.calibrated_ms = calibrate_rounds(self.budget_ms, self.min_rounds)
+        else:
+            self.calibrated_ms = measure_rounds(self.rounds, samples=1) * 1000
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    def rehash_later(self, password: str, on_done: Callable[[str], None]) -> bool:
+        """Hash ``password`` at the current cost in the background and pass the
+        result to ``on_done``. Skipped (returns False) when the pool is busy."""
+        try:
+            future = self._submit(_hashpw, password.encode('utf-8'), self.rounds)
+        except HashingUnavailable:
+            return False
+
+        def finished(done: Future) -> None:
+            if done.exception() is not None:
+                return
+            on_done(done.result().decode('utf-8'))
+            with self._stats_lock:
+                self._rehashed += 1
+
+        future.add_done_callback(finished)
+        return True
+
+    def _get_executor(self):
+        # Created lazily so importing the module never forks or spawns threads.
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self.mode == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix="bcrypt"
+                        )
+        return self._executor
+
+    def _submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            raise HashingUnavailable("Password hashing queue is full")
+        started = time.perf_counter()
+        with self._stats_lock:
+            self._in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._finish(started)
+            raise
+        future.add_done_callback(lambda _: self._finish(started))
+        return future
+
+    def _finish(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._in_flight -= 1
+            self._completed += 1
+            self._latency_total += elapsed
+            if elapsed > self._latency_max:
+                self._latency_max = elapsed
+        self._slots.release()
+
+    def _wait(self, future: Future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._stats_lock:
+                self._timed_out += 1
+            raise HashingUnavailable("Password hashing timed out")
+
+    async def _await(self, future: Future):
+        # Imported here: the serverless handlers only use the sync API and
+        # should not pay for asyncio at cold start.
+        import asyncio
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self._timed_out += 1
+            raise HashingUnavailable("Password hashing timed out")
+
+    def hash(self, password: str) -> str:
+        future = self._submit(_hashpw, password.encode('utf-8'), self.rounds)
+        return self._wait(future).decode('utf-8')
+
+    def verify(self, password: str, hashed: str) -> bool:
+        future = self._submit(_checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+        return self._wait(future)
+
+    def hash_many(self, passwords: Iterable[bytes], rounds: Optional[int] = None) -> Iterator[bytes]:
+        """Yield the hashes of ``passwords`` in order, for bulk jobs.
+
+        Bypasses the in-flight limit but keeps at most ``workers`` of them
+        in the pool at a time, so a request hashing alongside waits behind
+        one round of them rather than the whole job.
+        """
+        rounds = rounds or self.rounds
+        executor = self._get_executor()
+        window: "deque[Future]" = deque()
+        for password in passwords:
+            if len(window) >= self.workers:
+                yield window.popleft().result()
+            window.append(executor.submit(_hashpw, password, rounds))
+        while window:
+            yield window.popleft().result()
+
+    async def hash_async(self, password: str) -> str:
+        future = self._submit(_hashpw, password.encode('utf-8'), self.rounds)
+        return (await self._await(future)).decode('utf-8')
+
+    async def verify_async(self, password: str, hashed: str) -> bool:
+        future = self._submit(_checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+        return await self._await(future)
+
+    def stats(self) -> Dict[str, object]:
+        with self._stats_lock:
+            completed = self._completed
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "budget_ms": self.budget_ms,
+                "calibrated_latency_ms": round(self.calibrated_ms, 3) if self.calibrated_ms is not None else None,
+                "rehashed": self._rehashed,
+                "in_flight": self._in_flight,
+                "queue_depth": max(0, self._in_flight - self.workers),
+                "max_queue": self.max_queue,
+                "completed": completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "latency_avg_ms": round(self._latency_total / completed * 1000, 3) if completed else 0.0,
+                "latency_max_ms": round(self._latency_max * 1000, 3),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
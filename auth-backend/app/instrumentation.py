@@ -0,0 +1,165 @@
+"""Request and stage latency metrics in Prometheus text format.
+
+``Metrics`` keeps per-route request counters and latency histograms, plus
+histograms for internal stages (bcrypt, token codec, email dispatch,
+store lookups) timed with ``with metrics.stage("bcrypt"):``. When
+disabled, ``stage`` hands back a shared no-op context manager and the
+recording calls return immediately, so instrumented code pays almost
+nothing.
+
+Metrics are per process; on serverless platforms each instance reports
+only what it has served itself.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, List, Tuple
+
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_NOOP = nullcontext()
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class _StageTimer:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class Metrics:
+    def __init__(self, enabled: bool = True, prefix: str = "auth"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        self._request_latency: Dict[Tuple[str, str], Histogram] = {}
+        self._stage_latency: Dict[str, Histogram] = {}
+
+    @classmethod
+    def from_env(cls) -> "Metrics":
+        return cls(enabled=os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes"))
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._request_latency.get((route, method))
+            if histogram is None:
+                histogram = self._request_latency[(route, method)] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_stage(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stage_latency.get(name)
+            if histogram is None:
+                histogram = self._stage_latency[name] = Histogram()
+            histogram.observe(seconds)
+
+    def stage(self, name: str):
+        """Context manager timing one internal stage."""
+        if not self.enabled:
+            return _NOOP
+        return _StageTimer(self, name)
+
+    def instrument_handler(self, route: str):
+        """Class decorator recording every ``do_*`` call of a
+        ``BaseHTTPRequestHandler`` under ``route``."""
+        def decorate(cls):
+            if not self.enabled:
+                return cls
+            # Every response path logs its status, including writers that
+            # bypass send_response.
+            log_request = cls.log_request
+
+            def recording_log_request(handler, code="-", size="-"):
+                if isinstance(code, int):
+                    handler._metrics_status = int(code)
+                log_request(handler, code, size)
+
+            cls.log_request = recording_log_request
+            for name in [n for n in dir(cls) if n.startswith("do_")]:
+                setattr(cls, name, self._timed_method(route, getattr(cls, name)))
+            return cls
+        return decorate
+
+    def _timed_method(self, route: str, method):
+        def timed(handler):
+            started = time.perf_counter()
+            handler._metrics_status = 500
+            try:
+                method(handler)
+            finally:
+                self.observe_request(
+                    route, handler.command, handler._metrics_status, time.perf_counter() - started
+                )
+        return timed
+
+    def _render_histogram(self, lines: List[str], name: str, labels: str, histogram: Histogram) -> None:
+        sep = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+    def render(self) -> str:
+        prefix = self.prefix
+        lines = [
+            f"# HELP {prefix}_requests_total Requests served, by route, method and status.",
+            f"# TYPE {prefix}_requests_total counter",
+        ]
+        with self._lock:
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f"{prefix}_requests_total{{{_labels(route=route, method=method, status=str(status))}}} {count}")
+            lines.append(f"# HELP {prefix}_request_duration_seconds Request latency, by route and method.")
+            lines.append(f"# TYPE {prefix}_request_duration_seconds histogram")
+            for (route, method), histogram in sorted(self._request_latency.items()):
+                self._render_histogram(
+                    lines, f"{prefix}_request_duration_seconds", _labels(route=route, method=method), histogram
+                )
+            lines.append(f"# HELP {prefix}_stage_duration_seconds Latency of internal stages.")
+            lines.append(f"# TYPE {prefix}_stage_duration_seconds histogram")
+            for stage, histogram in sorted(self._stage_latency.items()):
+                self._render_histogram(lines, f"{prefix}_stage_duration_seconds", _labels(stage=stage), histogram)
+        return "\n".join(lines) + "\n"
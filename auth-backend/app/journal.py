@@ -0,0 +1,274 @@
+"""Journaled in-memory user store.
+
+Keeps users in memory like ``MemoryUserStore`` but appends every
+mutation to a journal file, so the store survives restarts. The journal
+is flushed and fsynced in batches by a background thread, keeping the
+per-request cost to a buffered write. Every ``snapshot_every`` mutations
+a compact snapshot is written and older journal generations are dropped.
+
+On disk, ``directory`` holds:
+
+* ``snapshot.ndjson`` - a header line ``{"generation": g}`` followed by one
+  JSON array per user. It covers every journal generation below ``g``.
+* ``journal.<g>.log`` - one JSON object per mutation, oldest first.
+
+Startup mmaps the snapshot and replays only the journals written after it.
+"""
+import json
+import mmap
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from .logs import get_logger
+from .storage import MemoryUserStore, UserRecord, normalize_email
+
+logger = get_logger("auth.journal")
+
+SNAPSHOT_NAME = "snapshot.ndjson"
+SNAPSHOT_CHUNK = 4 * 1024 * 1024
+
+
+def _pack(user: UserRecord) -> list:
+    # The trailing null is the old verification_code column, kept so the
+    # on-disk format is unchanged.
+    return [
+        user.id,
+        user.email,
+        user.password,
+        user.is_verified,
+        user.created_at.isoformat(),
+        None,
+    ]
+
+
+def _unpack(row: list, email: Optional[str] = None) -> UserRecord:
+    return UserRecord.from_dict({
+        "id": row[0],
+        "email": row[1],
+        "password": row[2],
+        "is_verified": row[3],
+        "created_at": datetime.fromisoformat(row[4]),
+    }, email)
+
+
+def _encode_fields(fields: dict) -> dict:
+    if "created_at" in fields:
+        fields = {**fields, "created_at": fields["created_at"].isoformat()}
+    return fields
+
+
+def _decode_fields(fields: dict) -> dict:
+    if "created_at" in fields:
+        fields = {**fields, "created_at": datetime.fromisoformat(fields["created_at"])}
+    return fields
+
+
+class JournaledUserStore(MemoryUserStore):
+    def __init__(self, directory: str, fsync_interval: float = 0.05, snapshot_every: int = 100000):
+        super().__init__()
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+        self._generation = self._load()
+        self._journal = open(self._journal_path(self._generation), "a", encoding="utf-8")
+        self._dirty = False
+        self._since_snapshot = 0
+        self._snapshotting = False
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="journal-flusher", daemon=True)
+        self._flusher.start()
+
+    def _journal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"journal.{generation}.log")
+
+    def _journal_generations(self) -> List[int]:
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith("journal.") and name.endswith(".log"):
+                try:
+                    generations.append(int(name[len("journal."):-len(".log")]))
+                except ValueError:
+                    continue
+        return sorted(generations)
+
+    # Recovery
+
+    def _load(self) -> int:
+        generation = 0
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_NAME)
+        if os.path.exists(snapshot_path) and os.path.getsize(snapshot_path) > 0:
+            generation = self._load_snapshot(snapshot_path)
+        replayed = [g for g in self._journal_generations() if g >= generation]
+        for g in replayed:
+            self._replay(self._journal_path(g))
+        return max([generation] + replayed)
+
+    def _load_snapshot(self, path: str) -> int:
+        shards, mask = self._shards, self._mask
+        order = self._order
+        loads = json.loads
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            generation = loads(mm.readline())["generation"]
+            # Parse the rows a few MB at a time as one JSON array, which is far
+            # cheaper than calling json.loads once per line.
+            start = mm.tell()
+            size = len(mm)
+            while start < size:
+                end = mm.find(b"\n", min(size - 1, start + SNAPSHOT_CHUNK))
+                end = size if end == -1 else end + 1
+                chunk = mm[start:end].rstrip(b"\n")
+                start = end
+                if not chunk:
+                    continue
+                for row in loads(b"[" + chunk.replace(b"\n", b",") + b"]"):
+                    key = normalize_email(row[1])
+                    users = shards[hash(key) & mask]
+                    if key not in users:
+                        order.append(key)
+                    users[key] = _unpack(row, key)
+        return generation
+
+    def _replay(self, path: str) -> None:
+        good_offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn write from a crash; everything after it is unusable.
+                    break
+                self._apply(entry)
+                good_offset += len(line)
+        if good_offset < os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(good_offset)
+
+    def _apply(self, entry: dict) -> None:
+        if entry["op"] == "add":
+            key = normalize_email(entry["user"][1])
+            if self._lookup(key) is None:
+                self._insert(key, _unpack(entry["user"], key))
+        elif entry["op"] == "update":
+            key = normalize_email(entry["email"])
+            current = self._lookup(key)
+            if current is not None:
+                # Journals written before records dropped verification_code may carry it.
+                fields = _decode_fields(entry["fields"])
+                fields.pop("verification_code", None)
+                self._shards[hash(key) & self._mask][key] = current.replace(**fields)
+
+    # Mutations
+
+    def _append(self, entry: dict) -> None:
+        self._journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._dirty = True
+        self._since_snapshot += 1
+
+    def add(self, user: dict) -> bool:
+        key = normalize_email(user["email"])
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+            record = UserRecord.from_dict(user, email=key)
+            self._insert(key, record)
+            self._append({"op": "add", "user": _pack(record)})
+        self._notify(user["email"])
+        return True
+
+    def add_many(self, users: Iterable[dict]) -> int:
+        added = []
+        with self._lock:
+            for user in users:
+                key = normalize_email(user["email"])
+                if self._lookup(key) is not None:
+                    continue
+                record = UserRecord.from_dict(user, email=key)
+                self._insert(key, record)
+                self._append({"op": "add", "user": _pack(record)})
+                added.append(user["email"])
+        for email in added if self._listeners else ():
+            self._notify(email)
+        return len(added)
+
+    def update(self, email: str, **fields) -> bool:
+        key = normalize_email(email)
+        with self._lock:
+            current = self._lookup(key)
+            if current is None:
+                return False
+            self._replace(key, current.replace(**fields))
+            self._append({"op": "update", "email": email, "fields": _encode_fields(fields)})
+        self._notify(email)
+        return True
+
+    # Background work
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            self._journal.flush()
+            self._dirty = False
+            # fsync a duplicate so a concurrent snapshot can rotate the journal.
+            fd = os.dup(self._journal.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _flush_loop(self) -> None:
+        while not self._closed.wait(self.fsync_interval):
+            try:
+                self.flush()
+                if self._since_snapshot >= self.snapshot_every:
+                    self.snapshot()
+            except Exception:
+                logger.exception("journal.flush_error", directory=self.directory)
+
+    def snapshot(self) -> None:
+        with self._lock:
+            if self._snapshotting:
+                return
+            self._snapshotting = True
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            self._generation += 1
+            generation = self._generation
+            self._journal = open(self._journal_path(generation), "a", encoding="utf-8")
+            self._dirty = False
+            self._since_snapshot = 0
+            # Records are replaced rather than mutated, so this list is a stable
+            # view. Listing in signup order keeps cursors valid across restarts.
+            users = [self._lookup(key) for key in self._order]
+        try:
+            self._write_snapshot(generation, users)
+            for g in self._journal_generations():
+                if g < generation:
+                    os.remove(self._journal_path(g))
+        finally:
+            with self._lock:
+                self._snapshotting = False
+
+    def _write_snapshot(self, generation: int, users: list) -> None:
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        tmp_path = path + ".tmp"
+        dumps = json.dumps
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(dumps({"generation": generation, "count": len(users), "written_at": time.time()}) + "\n")
+            for start in range(0, len(users), 10000):
+                f.write("".join(dumps(_pack(u), separators=(",", ":")) + "\n" for u in users[start:start + 10000]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._flusher.join(5)
+        self.flush()
+        with self._lock:
+            self._journal.close()
@@ -1,36 +1,146 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, EmailStr
-from typing import Optional, Dict, List
-import bcrypt
-from jose import JWTError, jwt
+from typing import Optional, List, Tuple
 from datetime import datetime, timedelta
+import json
 import secrets
-import re
 import os
-import urllib.request
-import urllib.parse
+import io
+import hmac
+import tempfile
+import math
+import time
+from .hashing import PasswordHasher, HashingUnavailable
+from .outbox import EmailOutbox
+from .mail_client import BrevoClient, MailApiError, MAX_MESSAGE_VERSIONS
+from .storage import create_user_store, normalize_email
+from .ids import IdGenerator
+from .codes import create_code_store, CODE_OK, CODE_MISSING, CODE_LOCKED
+from .claims_cache import ClaimsCache
+from .revocation import RevocationList
+from .validators import VersionCounters, ResponseCache, etag_matches
+from .token_codec import HS256Codec, TokenError
+from .ratelimit import RateLimiter
+from .bulk_import import BulkImporter, FORMATS as IMPORT_FORMATS, read_records
+from .export import CONTENT_TYPES as EXPORT_CONTENT_TYPES, export_filename, export_users
+from .instrumentation import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from . import logs
 
 app = FastAPI(title="Email Authentication API", version="1.0.0")
 
+RATE_LIMITED_ROUTES = {
+    "/api/signup": "signup_ip",
+    "/api/login": "login_ip",
+    "/api/verify-email": "verify_ip",
+}
+
+def rate_limit_response(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, please try again later"},
+        headers={"Retry-After": RateLimiter.retry_after_header(retry_after)},
+    )
+
+# Registered before CORS so that 429 responses still carry CORS headers.
+@app.middleware("http")
+async def rate_limit_by_ip(request: Request, call_next):
+    scope = RATE_LIMITED_ROUTES.get(request.url.path)
+    if scope is not None and request.method == "POST":
+        client_ip = request.client.host if request.client else "unknown"
+        retry_after = rate_limiter.check(scope, client_ip)
+        if retry_after:
+            return rate_limit_response(retry_after)
+    return await call_next(request)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["ETag"],
 )
 
+metrics = Metrics.from_env()
+_route_paths = None
+
+# Registered last so it is outermost and also sees rate-limited requests.
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if not metrics.enabled:
+        return await call_next(request)
+    global _route_paths
+    if _route_paths is None:
+        _route_paths = {route.path for route in app.routes}
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Unknown paths share one label so scanners cannot blow up cardinality.
+    route = request.url.path if request.url.path in _route_paths else "other"
+    metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
 SECRET_KEY = os.getenv("SECRET_KEY", "fallback-secret-key-for-development-only")
+BREVO_API_KEY = os.getenv("BREVO_API_KEY") or os.getenv("brevo_api_key")
+
+logs.configure_from_env(secrets=[SECRET_KEY, BREVO_API_KEY or ""])
+logger = logs.get_logger("auth.app")
+email_logger = logs.get_logger("auth.email")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
-users_db: Dict[str, dict] = {}
-verification_codes: Dict[str, str] = {}
+token_codec = HS256Codec(SECRET_KEY)
+
+users_db = create_user_store(".")
+user_ids = IdGenerator.from_env(users_db)
+# With a store shared between workers, codes, rate limits and revocations
+# default to their shared backends too.
+verification_codes = create_code_store(".", shared=users_db.shared)
+claims_cache = ClaimsCache.from_env()
+revoked_tokens = RevocationList.from_env(".", max_ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60, shared=users_db.shared)
+rate_limiter = RateLimiter.from_env(".", shared=users_db.shared)
+
+versions = VersionCounters(users_db)
+response_cache = ResponseCache.from_env()
+
+# Cached claims must not outlive a change to the account they belong to.
+users_db.add_listener(claims_cache.invalidate_subject)
+users_db.add_listener(versions.bump)
 
 security = HTTPBearer()
 
+password_hasher = PasswordHasher.from_env()
+
+@app.exception_handler(HashingUnavailable)
+async def hashing_unavailable_handler(request: Request, exc: HashingUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.on_event("startup")
+def start_background_workers():
+    password_hasher.calibrate()
+    logger.info(
+        "hashing.calibrated",
+        rounds=password_hasher.rounds,
+        latency_ms=round(password_hasher.calibrated_ms, 1),
+    )
+    email_outbox.start()
+
+@app.on_event("shutdown")
+def shutdown_background_workers():
+    email_outbox.stop()
+    mail_client.close()
+    password_hasher.shutdown(wait=False)
+    users_db.close()
+    revoked_tokens.close()
+    logs.stop_logging()
+
 class UserSignup(BaseModel):
     email: EmailStr
     password: str
@@ -54,12 +164,20 @@ class Token(BaseModel):
     token_type: str
     user: User
 
+def enforce_email_rate_limit(scope: str, email: str) -> None:
+    retry_after = rate_limiter.check(scope, email)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests for this account, please try again later",
+            headers={"Retry-After": RateLimiter.retry_after_header(retry_after)},
+        )
+
 def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    return password_hasher.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    return password_hasher.verify(password, hashed)
 
 def generate_verification_code() -> str:
     return str(secrets.randbelow(90000) + 10000)
@@ -70,122 +188,256 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # ``jti`` lets a single token be revoked. ``iat`` keeps millisecond
+    # precision so a logout-everywhere rarely catches a token issued right
+    # after it, and is truncated, never rounded up past a cutoff, so it
+    # always catches one issued before it.
+    to_encode.update({"exp": expire, "iat": math.floor(time.time() * 1000) / 1000, "jti": secrets.token_urlsafe(12)})
+    with metrics.stage("token_encode"):
+        encoded_jwt = token_codec.encode(to_encode)
     return encoded_jwt
 
+mail_client = BrevoClient.from_env(api_key=BREVO_API_KEY)
+
 def send_verification_email(email: str, verification_code: str) -> bool:
     """Send verification email via Brevo (formerly SendInBlue)"""
+    if not BREVO_API_KEY:
+        # Tutorial mode: without an email service the code only shows up in the log.
+        email_logger.warning("email.not_configured", email=email, tutorial_code=verification_code)
+        return True
+    
+    email_payload = {
+        "sender": {
+            "email": "noreply@email-auth-tutorial.com",
+            "name": "Email Auth Tutorial"
+        },
+        "to": [
+            {
+                "email": email,
+                "name": "User"
+            }
+        ],
+        "subject": "Email Verification Code",
+        "htmlContent": f"<html><body><p>Your verification code is: <strong>{verification_code}</strong></p><p>Please enter this code to verify your email address.</p></body></html>"
+    }
+    
     try:
-        brevo_api_key = None
-        
-        brevo_api_key = (
-            os.getenv('BREVO_API_KEY') or 
-            os.environ.get('BREVO_API_KEY') or
-            os.getenv('brevo_api_key') or
-            os.environ.get('brevo_api_key')
-        )
-        print(f"DEBUG: Method 1 - BREVO_API_KEY = {brevo_api_key}")
-        
-        if not brevo_api_key:
-            for key_name in ['BREVO_API_KEY', 'brevo_api_key', 'Brevo_Api_Key']:
-                brevo_api_key = os.environ.get(key_name)
-                if brevo_api_key:
-                    print(f"DEBUG: Method 2 - Found {key_name} = {brevo_api_key}")
-                    break
-        
-        if not brevo_api_key:
-            try:
-                import subprocess
-                result = subprocess.run(['printenv', 'BREVO_API_KEY'], capture_output=True, text=True)
-                if result.returncode == 0 and result.stdout.strip():
-                    brevo_api_key = result.stdout.strip()
-                    print(f"DEBUG: Method 3 - Found BREVO_API_KEY via printenv: {brevo_api_key}")
-            except Exception as e:
-                print(f"DEBUG: Method 3 - printenv attempt failed: {e}")
-        
-        if not brevo_api_key:
-            print("ERROR: BREVO_API_KEY not found in environment variables")
-            print(f"DEBUG: Available env vars: {list(os.environ.keys())}")
-            print(f"TUTORIAL MODE: Since email service is not configured, here's your verification code: {verification_code}")
-            print(f"TUTORIAL MODE: Use this code to verify email: {email}")
-            return True  # Return True for tutorial mode
-        
-        brevo_endpoint = 'https://api.brevo.com/v3/smtp/email'
-        
-        email_payload = {
-            "sender": {
-                "email": "noreply@email-auth-tutorial.com",
-                "name": "Email Auth Tutorial"
-            },
-            "to": [
-                {
-                    "email": email,
-                    "name": "User"
-                }
-            ],
-            "subject": "Email Verification Code",
-            "htmlContent": f"<html><body><p>Your verification code is: <strong>{verification_code}</strong></p><p>Please enter this code to verify your email address.</p></body></html>"
-        }
-        
-        print(f"DEBUG: Brevo endpoint = {brevo_endpoint}")
-        print(f"DEBUG: Email payload = {email_payload}")
-        
-        import json
-        data = json.dumps(email_payload).encode('utf-8')
-        req = urllib.request.Request(brevo_endpoint, data=data, method='POST')
-        req.add_header('Content-Type', 'application/json')
-        req.add_header('api-key', brevo_api_key)
-        req.add_header('accept', 'application/json')
-        req.add_header('User-Agent', 'Mozilla/5.0 (compatible; EmailAuthTutorial/1.0)')
-        
-        print(f"DEBUG: Request headers = {dict(req.headers)}")
-        
-        with urllib.request.urlopen(req) as response:
-            response_data = response.read().decode('utf-8')
-            print(f"DEBUG: Response status = {response.status}")
-            print(f"DEBUG: Response data = {response_data}")
-            if response.status == 201:  # Brevo returns 201 for successful email sending
-                print(f"Verification email sent successfully to {email}")
-                return True
-            else:
-                print(f"Failed to send email. Status: {response.status}, Response: {response_data}")
-                return False
-                
-    except Exception as e:
-        print(f"Error sending verification email: {str(e)}")
-        print(f"DEBUG: Exception type = {type(e)}")
-        import traceback
-        print(f"DEBUG: Traceback = {traceback.format_exc()}")
+        with metrics.stage("email_dispatch"):
+            response_data = mail_client.send_email(email_payload)
+    except Exception:
+        email_logger.exception("email.send_failed", email=email)
         return False
+    email_logger.info("email.sent", email=email, message_id=response_data.get("messageId"))
+    return True
+
+def send_verification_emails(messages: List[Tuple[str, str]]) -> List[Optional[str]]:
+    """Send several verification emails in one Brevo request, one ``messageVersions`` entry each.
+
+    Returns an error string, or None once Brevo accepted it, per message.
+    """
+    if not BREVO_API_KEY:
+        return [None if send_verification_email(email, code) else "delivery rejected" for email, code in messages]
+    
+    email_payload = {
+        "sender": {
+            "email": "noreply@email-auth-tutorial.com",
+            "name": "Email Auth Tutorial"
+        },
+        "subject": "Email Verification Code",
+        "htmlContent": "<html><body><p>Your verification code is: <strong>{{ params.code }}</strong></p><p>Please enter this code to verify your email address.</p></body></html>",
+        "messageVersions": [
+            {"to": [{"email": email, "name": "User"}], "params": {"code": code}}
+            for email, code in messages
+        ]
+    }
+    
+    rejected = None
+    try:
+        with metrics.stage("email_dispatch"):
+            response_data = mail_client.send_email(email_payload)
+    except MailApiError as e:
+        if e.status != 400:
+            email_logger.exception("email.batch_failed", count=len(messages))
+            return [str(e)] * len(messages)
+        rejected = e
+    except Exception as e:
+        email_logger.exception("email.batch_failed", count=len(messages))
+        return [str(e) or type(e).__name__] * len(messages)
+    if rejected is not None:
+        if len(messages) == 1:
+            email_logger.error("email.send_failed", email=messages[0][0], status=rejected.status, error=rejected.body)
+            return [str(rejected)]
+        # Brevo refuses the whole batch over one bad recipient; halve it until
+        # the bad ones are isolated and the rest go through.
+        half = len(messages) // 2
+        return send_verification_emails(messages[:half]) + send_verification_emails(messages[half:])
+    message_ids = response_data.get("messageIds") or []
+    results: List[Optional[str]] = []
+    for (email, _), message_id in zip(messages, message_ids):
+        email_logger.info("email.sent", email=email, message_id=message_id)
+        results.append(None)
+    # The outbox retries any message Brevo returned no id for.
+    return results
+
+email_outbox = EmailOutbox(
+    os.getenv("OUTBOX_PATH", "outbox.db"),
+    send_verification_email,
+    workers=int(os.getenv("OUTBOX_WORKERS", "2")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6")),
+    lease_seconds=float(os.getenv("OUTBOX_LEASE_SECONDS", "120")),
+    deliver_batch=send_verification_emails,
+    batch_size=min(int(os.getenv("OUTBOX_BATCH_SIZE", "50")), MAX_MESSAGE_VERSIONS),
+    batch_window=int(os.getenv("OUTBOX_BATCH_WINDOW_MS", "200")) / 1000,
+)
+
+def queue_verification_emails(users: List[dict]) -> None:
+    pending = [user for user in users if user["verification_code"]]
+    for user in pending:
+        verification_codes.issue(user["email"], user["verification_code"])
+    email_outbox.enqueue_many((user["email"], user["verification_code"]) for user in pending)
+
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+def require_admin(request: Request) -> None:
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("x-admin-key", "")
+    if not hmac.compare_digest(supplied.encode(), ADMIN_API_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def get_token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    payload = claims_cache.get(credentials.credentials)
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        if payload is None:
+            with metrics.stage("token_decode"):
+                payload = token_codec.decode(credentials.credentials)
+            claims_cache.put(credentials.credentials, payload)
         email = payload.get("sub")
         if not isinstance(email, str) or email is None:
             raise credentials_exception
-    except JWTError:
+    except TokenError:
         raise credentials_exception
-    
-    user = users_db.get(email)
-    if user is None:
+    if revoked_tokens.is_revoked(payload):
         raise credentials_exception
+    return payload
+
+def get_current_user(payload: dict = Depends(get_token_claims)):
+    with metrics.stage("store_lookup"):
+        user = users_db.get(payload["sub"])
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 @app.get("/healthz")
 async def healthz():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/status")
+async def service_status(request: Request):
+    require_admin(request)
+    return {
+        "hashing": password_hasher.stats(),
+        "outbox": email_outbox.stats(),
+        "mail_api": mail_client.stats(),
+        "verification_codes": verification_codes.stats(),
+        "token_cache": claims_cache.stats(),
+        "revocations": revoked_tokens.stats(),
+        "user_ids": user_ids.stats(),
+        "versions": versions.stats(),
+        "response_cache": response_cache.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "logging": logs.stats(),
+    }
+
+@app.get("/api/status/dead-letters")
+async def outbox_dead_letters(request: Request, limit: int = 50):
+    # Dead letters carry users' addresses and Brevo's error text.
+    require_admin(request)
+    return {"dead_letters": email_outbox.dead_letters(limit)}
+
+@app.post("/api/admin/import")
+async def admin_import(request: Request, format: Optional[str] = None, verified: bool = False, send_emails: bool = False):
+    """Bulk-import users from a CSV or NDJSON body, streaming progress as NDJSON."""
+    require_admin(request)
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IMPORT_FORMATS)}")
+    # Large uploads spill to disk instead of being held in memory.
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    workers = os.getenv("IMPORT_HASH_WORKERS")
+    importer = BulkImporter(
+        users_db,
+        rounds=password_hasher.rounds,
+        workers=int(workers) if workers else None,
+        chunk_size=int(os.getenv("IMPORT_CHUNK_SIZE", "500")),
+        mark_verified=verified,
+        issue_code=generate_verification_code if send_emails else None,
+        on_imported=queue_verification_emails if send_emails else None,
+        ids=user_ids,
+        hasher=password_hasher,
+    )
+    records = read_records(io.TextIOWrapper(spool, encoding="utf-8", newline=""), fmt)
+
+    def progress_lines():
+        progress = None
+        try:
+            for progress in importer.iter_import(records):
+                yield json.dumps(progress.as_dict()) + "\n"
+        except Exception as e:
+            # Headers are already out; report the failure in-band.
+            logger.exception("import.failed")
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            spool.close()
+            if progress is not None:
+                logger.info("import.finished", **{k: v for k, v in progress.as_dict().items() if k != "errors"})
+
+    return StreamingResponse(progress_lines(), media_type="application/x-ndjson")
+
+@app.get("/api/admin/export")
+async def admin_export(
+    request: Request,
+    format: str = "ndjson",
+    gzip: bool = False,
+    hashes: bool = False,
+    is_verified: Optional[bool] = None,
+):
+    """Stream a point-in-time export of every user as NDJSON or CSV."""
+    require_admin(request)
+    if format not in EXPORT_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_CONTENT_TYPES)}")
+    logger.info("export.started", format=format, gzip=gzip, hashes=hashes)
+    return StreamingResponse(
+        export_users(users_db, format, hashes, gzip, is_verified),
+        media_type="application/gzip" if gzip else EXPORT_CONTENT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format, gzip)}"'},
+    )
+
 @app.post("/api/signup", response_model=dict)
 async def signup(user_data: UserSignup):
-    if user_data.email in users_db:
-        existing_user = users_db[user_data.email]
+    enforce_email_rate_limit("signup_email", user_data.email)
+    with metrics.stage("store_lookup"):
+        existing_user = users_db.get(user_data.email)
+    if existing_user is not None:
         if existing_user["is_verified"]:
             raise HTTPException(
                 status_code=400,
@@ -193,21 +445,14 @@ async def signup(user_data: UserSignup):
             )
         else:
             verification_code = generate_verification_code()
-            users_db[user_data.email]["verification_code"] = verification_code
-            verification_codes[user_data.email] = verification_code
+            verification_codes.issue(user_data.email, verification_code)
             
-            email_sent = send_verification_email(user_data.email, verification_code)
+            email_outbox.enqueue(user_data.email, verification_code)
             
-            if email_sent:
-                return {
-                    "message": "Verification email resent! Please check your email for the new verification code.",
-                    "user_id": existing_user["id"]
-                }
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to resend verification email. Please contact support."
-                )
+            return {
+                "message": "Verification email resent! Please check your email for the new verification code.",
+                "user_id": existing_user["id"]
+            }
     
     if len(user_data.password) < 6:
         raise HTTPException(
@@ -215,37 +460,38 @@ async def signup(user_data: UserSignup):
             detail="Password must be at least 6 characters long"
         )
     
-    hashed_password = hash_password(user_data.password)
+    with metrics.stage("bcrypt_hash"):
+        hashed_password = await password_hasher.hash_async(user_data.password)
     verification_code = generate_verification_code()
     
-    user_id = f"user_{len(users_db) + 1}"
-    users_db[user_data.email] = {
+    user_id = f"user_{user_ids.next_id()}"
+    created = users_db.add({
         "id": user_id,
         "email": user_data.email,
         "password": hashed_password,
         "is_verified": False,
-        "created_at": datetime.utcnow(),
-        "verification_code": verification_code
-    }
+        "created_at": datetime.utcnow()
+    })
+    if not created:
+        raise HTTPException(
+            status_code=400,
+            detail="User with this email already exists"
+        )
     
-    verification_codes[user_data.email] = verification_code
+    verification_codes.issue(user_data.email, verification_code)
     
-    email_sent = send_verification_email(user_data.email, verification_code)
+    email_outbox.enqueue(user_data.email, verification_code)
     
-    if email_sent:
-        return {
-            "message": "Account created successfully! Please check your email for the verification code.",
-            "user_id": user_id
-        }
-    else:
-        raise HTTPException(
-            status_code=500,
-            detail="Account created but failed to send verification email. Please contact support."
-        )
+    return {
+        "message": "Account created successfully! Please check your email for the verification code.",
+        "user_id": user_id
+    }
 
 @app.post("/api/verify-email", response_model=dict)
 async def verify_email(verification_data: EmailVerification):
-    user = users_db.get(verification_data.email)
+    enforce_email_rate_limit("verify_email", verification_data.email)
+    with metrics.stage("store_lookup"):
+        user = users_db.get(verification_data.email)
     if not user:
         raise HTTPException(
             status_code=404,
@@ -258,23 +504,32 @@ async def verify_email(verification_data: EmailVerification):
             detail="Email already verified"
         )
     
-    stored_code = verification_codes.get(verification_data.email)
-    if not stored_code or stored_code != verification_data.verification_code:
+    result = verification_codes.verify(verification_data.email, verification_data.verification_code)
+    if result == CODE_MISSING:
+        raise HTTPException(
+            status_code=400,
+            detail="Verification code expired. Please sign up again to get a new code."
+        )
+    if result == CODE_LOCKED:
+        raise HTTPException(
+            status_code=400,
+            detail="Too many invalid attempts. Please sign up again to get a new code."
+        )
+    if result != CODE_OK:
         raise HTTPException(
             status_code=400,
             detail="Invalid verification code"
         )
     
-    users_db[verification_data.email]["is_verified"] = True
-    
-    if verification_data.email in verification_codes:
-        del verification_codes[verification_data.email]
+    users_db.update(verification_data.email, is_verified=True)
     
     return {"message": "Email verified successfully! You can now log in."}
 
 @app.post("/api/login", response_model=Token)
 async def login(user_data: UserLogin):
-    user = users_db.get(user_data.email)
+    enforce_email_rate_limit("login_email", user_data.email)
+    with metrics.stage("store_lookup"):
+        user = users_db.get(user_data.email)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -287,12 +542,20 @@ async def login(user_data: UserLogin):
             detail="Please verify your email before logging in"
         )
     
-    if not verify_password(user_data.password, user["password"]):
+    with metrics.stage("bcrypt_verify"):
+        password_ok = await password_hasher.verify_async(user_data.password, user["password"])
+    if not password_ok:
         raise HTTPException(
             status_code=401,
             detail="Invalid email or password"
         )
     
+    if password_hasher.needs_rehash(user["password"]):
+        email = user["email"]
+        password_hasher.rehash_later(
+            user_data.password, lambda new_hash: users_db.update(email, password=new_hash)
+        )
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["email"]}, expires_delta=access_token_expires
@@ -311,29 +574,107 @@ async def login(user_data: UserLogin):
         "user": user_response
     }
 
+@app.post("/api/logout")
+async def logout(payload: dict = Depends(get_token_claims)):
+    jti = payload.get("jti")
+    if isinstance(jti, str):
+        revoked_tokens.revoke(jti, payload.get("exp"))
+    else:
+        # Tokens issued before ``jti`` existed can only be revoked together.
+        revoked_tokens.revoke_subject(payload["sub"])
+    logger.info("session.logout", email=payload["sub"])
+    return {"message": "Logged out"}
+
+@app.post("/api/logout-all")
+async def logout_all(payload: dict = Depends(get_token_claims)):
+    revoked_tokens.revoke_subject(payload["sub"])
+    logger.info("session.logout_all", email=payload["sub"])
+    return {"message": "Logged out of all sessions"}
+
+def conditional_json(request: Request, key: tuple, version: int, build) -> Response:
+    """Answer with a 304 if the client holds ``version``, else with cached or freshly built JSON."""
+    etag = versions.etag(key, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    body = response_cache.get(key, version)
+    if body is None:
+        body = JSONResponse(jsonable_encoder(build())).body
+        response_cache.put(key, version, body)
+    return Response(body, media_type="application/json", headers=headers)
+
 @app.get("/api/dashboard")
-async def get_dashboard(current_user: dict = Depends(get_current_user)):
-    return {
-        "message": f"Welcome to your dashboard, {current_user['email']}!",
-        "user": {
-            "id": current_user["id"],
-            "email": current_user["email"],
-            "is_verified": current_user["is_verified"],
-            "created_at": current_user["created_at"]
+async def get_dashboard(request: Request, payload: dict = Depends(get_token_claims)):
+    email = normalize_email(payload["sub"])
+
+    def build():
+        current_user = get_current_user(payload)
+        return {
+            "message": f"Welcome to your dashboard, {current_user['email']}!",
+            "user": {
+                "id": current_user["id"],
+                "email": current_user["email"],
+                "is_verified": current_user["is_verified"],
+                "created_at": current_user["created_at"]
+            }
         }
-    }
 
-@app.get("/api/users")
-async def list_users():
+    # Read the version before the record, so a body never outlives its tag.
+    return conditional_json(request, ("dashboard", email), versions.user(email), build)
+
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+
+def user_summary(user: dict) -> dict:
     return {
-        "users": [
-            {
-                "id": user["id"],
-                "email": user["email"],
-                "is_verified": user["is_verified"],
-                "created_at": user["created_at"]
-            }
-            for user in users_db.values()
-        ],
-        "total": len(users_db)
+        "id": user["id"],
+        "email": user["email"],
+        "is_verified": user["is_verified"],
+        "created_at": user["created_at"]
     }
+
+def stream_users_ndjson(is_verified: Optional[bool]):
+    batch = []
+    for user in users_db.iter_snapshot(is_verified):
+        summary = user_summary(user)
+        summary["created_at"] = summary["created_at"].isoformat()
+        batch.append(json.dumps(summary))
+        if len(batch) >= 500:
+            yield "\n".join(batch) + "\n"
+            batch = []
+    if batch:
+        yield "\n".join(batch) + "\n"
+
+@app.get("/api/users")
+async def list_users(
+    request: Request,
+    limit: int = USERS_PAGE_DEFAULT,
+    cursor: Optional[str] = None,
+    is_verified: Optional[bool] = None,
+    format: Optional[str] = None,
+):
+    if format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(stream_users_ndjson(is_verified), media_type="application/x-ndjson")
+    
+    if limit < 1 or limit > USERS_PAGE_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {USERS_PAGE_MAX}"
+        )
+
+    def build():
+        try:
+            users, next_cursor = users_db.page(cursor, limit, is_verified)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid cursor"
+            )
+        return {
+            "users": [user_summary(user) for user in users],
+            "total": len(users_db),
+            "next_cursor": next_cursor
+        }
+
+    key = ("users", cursor, limit, is_verified)
+    return conditional_json(request, key, versions.collection(), build)
@@ -0,0 +1,347 @@
+"""Durable outbox for verification emails.
+
+Signup records the email in a SQLite journal and returns immediately;
+background workers deliver it with retries and exponential backoff.
+Messages that keep failing are parked in a dead-letter list instead of
+being retried forever.
+
+With a ``deliver_batch`` callback, a worker that finds fewer than
+``batch_size`` messages due waits up to ``batch_window`` seconds for more
+to arrive, then hands them all over in one call. Success, retry and
+dead-lettering are still tracked per message.
+
+With ``inline=True`` no threads are started: ``enqueue`` delivers every
+message due before it returns. That is for serverless functions, which
+are frozen once the response is sent and would strand queued mail. A
+message that fails is retried by a later request on the same instance
+only, so the outbox is durable only on a long-running server.
+
+Several worker processes can share one outbox file. A claimed message is
+leased to its process for ``lease_seconds``; only messages whose lease
+ran out, because the process holding them died or hung, are claimed
+again, so a worker starting up never resends mail another is sending.
+"""
+import os
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .logs import get_logger
+
+logger = get_logger("auth.outbox")
+
+# (email, verification_code) pairs in; one error string, or None, per message out.
+BatchDeliver = Callable[[List[Tuple[str, str]]], List[Optional[str]]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    verification_code TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+# Columns added after the first release, for outbox files created before them.
+_ADDED_COLUMNS = (("owner", "TEXT"), ("lease_until", "REAL"))
+
+# Due messages, and messages whose sender's lease has run out. A "sending"
+# row without a lease was left by a version that had none.
+_CLAIMABLE = (
+    "(status = 'pending' AND next_attempt_at <= :now) "
+    "OR (status = 'sending' AND (lease_until IS NULL OR lease_until <= :now))"
+)
+
+
+class EmailOutbox:
+    def __init__(
+        self,
+        path: str,
+        deliver: Callable[[str, str], bool],
+        workers: int = 1,
+        max_attempts: int = 6,
+        base_delay: float = 2.0,
+        max_delay: float = 300.0,
+        poll_interval: float = 1.0,
+        deliver_batch: Optional[BatchDeliver] = None,
+        batch_size: int = 1,
+        batch_window: float = 0.0,
+        inline: bool = False,
+        lease_seconds: float = 120.0,
+    ):
+        self.path = path
+        self.deliver = deliver
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.deliver_batch = deliver_batch if batch_size > 1 else None
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.inline = inline
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        for name, kind in _ADDED_COLUMNS:
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE outbox ADD COLUMN {name} {kind}")
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._delivered = 0
+        self._failed_attempts = 0
+        self._batches = 0
+        self._batched_messages = 0
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, email: str, verification_code: str) -> int:
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (email, verification_code, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (email, verification_code, now, now),
+            )
+        self._dispatch()
+        return cursor.lastrowid
+
+    def enqueue_many(self, messages: Iterable[Tuple[str, str]]) -> int:
+        """Queue ``(email, verification_code)`` pairs in a single transaction."""
+        now = time.time()
+        rows = [(email, code, now, now) for email, code in messages]
+        if not rows:
+            return 0
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO outbox (email, verification_code, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._dispatch()
+        return len(rows)
+
+    def _dispatch(self) -> None:
+        if self.inline:
+            try:
+                self.flush()
+            except Exception:
+                # The message stays queued for the next flush.
+                logger.exception("outbox.flush_error")
+            return
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _claim(self, limit: int = 1) -> List[tuple]:
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                rows = self._conn.execute(
+                    "SELECT id, email, verification_code, attempts FROM outbox "
+                    f"WHERE {_CLAIMABLE} ORDER BY next_attempt_at LIMIT :limit",
+                    {"now": now, "limit": limit},
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE outbox SET status = 'sending', owner = ?, lease_until = ? WHERE id = ?",
+                        [(self.owner, now + self.lease_seconds, r[0]) for r in rows],
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _due(self, now: float) -> Tuple[int, Optional[float]]:
+        with self._db_lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*), MIN(next_attempt_at) FROM outbox WHERE {_CLAIMABLE}", {"now": now}
+            ).fetchone()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _record_result(self, row_id: int, attempts: int, error: Optional[str]) -> None:
+        self._record_results([(row_id, attempts, error)])
+
+    def _record_results(self, results: List[Tuple[int, int, Optional[str]]]) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                for row_id, attempts, error in results:
+                    if error is None:
+                        self._conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                    elif attempts >= self.max_attempts:
+                        # A failure only counts while we still hold the lease;
+                        # after it ran out the message belongs to whoever took it.
+                        self._conn.execute(
+                            "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ?, owner = NULL "
+                            "WHERE id = ? AND owner = ?",
+                            (attempts, error, row_id, self.owner),
+                        )
+                    else:
+                        self._conn.execute(
+                            "UPDATE outbox SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ?, "
+                            "owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?",
+                            (attempts, error, now + self._backoff(attempts), row_id, self.owner),
+                        )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            failed = sum(1 for _, _, error in results if error is not None)
+            self._delivered += len(results) - failed
+            self._failed_attempts += failed
+
+    def process_one(self) -> bool:
+        """Deliver one due message. Returns False when nothing was due."""
+        rows = self._claim()
+        if not rows:
+            return False
+        self._deliver_one(rows[0])
+        return True
+
+    def _deliver_one(self, row: tuple) -> None:
+        row_id, email, verification_code, attempts = row
+        try:
+            error = None if self.deliver(email, verification_code) else "delivery rejected"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        self._record_result(row_id, attempts + 1, error)
+
+    def process_batch(self) -> bool:
+        """Deliver up to ``batch_size`` due messages in one ``deliver_batch`` call.
+
+        Returns False when nothing was due. While fewer than ``batch_size``
+        are due and the oldest has waited less than ``batch_window``, it
+        waits for more instead (and returns True).
+        """
+        now = time.time()
+        due, oldest = self._due(now)
+        if not due:
+            return False
+        wait = oldest + self.batch_window - now
+        if due < self.batch_size and wait > 0 and not self._stopping.is_set():
+            with self._wakeup:
+                self._wakeup.wait(wait)
+            return True
+        rows = self._claim(self.batch_size)
+        if rows:
+            self._deliver_batch(rows)
+        return True
+
+    def _deliver_batch(self, rows: List[tuple]) -> None:
+        messages = [(email, code) for _, email, code, _ in rows]
+        try:
+            errors = list(self.deliver_batch(messages))
+        except Exception as e:
+            errors = [str(e) or type(e).__name__] * len(rows)
+        # A short result list means the missing messages were not confirmed.
+        errors += ["no delivery result"] * (len(rows) - len(errors))
+        with self._db_lock:
+            self._batches += 1
+            self._batched_messages += len(rows)
+        self._record_results([(row[0], row[3] + 1, error) for row, error in zip(rows, errors)])
+
+    def flush(self) -> int:
+        """Deliver every message due now on the calling thread.
+
+        Unlike ``process_batch`` it never waits for a batch to fill.
+        Returns how many messages were attempted.
+        """
+        attempted = 0
+        while True:
+            rows = self._claim(self.batch_size if self.deliver_batch is not None else 1)
+            if not rows:
+                return attempted
+            if self.deliver_batch is not None:
+                self._deliver_batch(rows)
+            else:
+                self._deliver_one(rows[0])
+            attempted += len(rows)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if self.process_batch() if self.deliver_batch is not None else self.process_one():
+                    continue
+            except Exception:
+                logger.exception("outbox.worker_error")
+            with self._wakeup:
+                self._wakeup.wait(self.poll_interval)
+
+    def dead_letters(self, limit: int = 50) -> List[Dict[str, object]]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT id, email, attempts, created_at, last_error FROM outbox "
+                "WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"id": r[0], "email": r[1], "attempts": r[2], "created_at": r[3], "last_error": r[4]}
+            for r in rows
+        ]
+
+    def stats(self) -> Dict[str, object]:
+        with self._db_lock:
+            pending, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()
+            dead = self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'dead'").fetchone()[0]
+            delivered = self._delivered
+            failed_attempts = self._failed_attempts
+            batches, batched = self._batches, self._batched_messages
+        return {
+            "pending": pending,
+            "dead_letters": dead,
+            "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+            "delivered": delivered,
+            "failed_attempts": failed_attempts,
+            "workers": len(self._threads),
+            "inline": self.inline,
+            "owner": self.owner,
+            "batch_size": self.batch_size if self.deliver_batch is not None else 1,
+            "batches": batches,
+            "avg_batch": round(batched / batches, 1) if batches else 0.0,
+        }
@@ -0,0 +1,187 @@
+"""Token-bucket rate limiting for the auth endpoints.
+
+Login, signup and verification are limited per client IP and per email
+before any password hashing happens, so one abusive client cannot keep
+the bcrypt pool busy. Buckets live in a counter backend: in process
+memory by default, or in a SQLite file that every worker process on the
+host shares.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+class Rule(NamedTuple):
+    capacity: int
+    period: float  # seconds to refill the whole bucket
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    @classmethod
+    def parse(cls, spec: str) -> "Rule":
+        """Parse ``"<requests>/<seconds>"``, e.g. ``"10/60"``."""
+        count, _, seconds = spec.partition("/")
+        return cls(int(count), float(seconds or 60))
+
+
+DEFAULT_RULES: Dict[str, Rule] = {
+    "login_ip": Rule(20, 60),
+    "login_email": Rule(5, 60),
+    "signup_ip": Rule(10, 60),
+    "signup_email": Rule(3, 60),
+    "verify_ip": Rule(20, 60),
+    "verify_email": Rule(10, 60),
+}
+
+
+class CounterBackend:
+    def take(self, key: str, rule: Rule, now: float) -> float:
+        """Spend one token from ``key``'s bucket.
+
+        Returns 0 when the request is allowed, otherwise the number of
+        seconds until a token is available.
+        """
+        raise NotImplementedError
+
+
+class MemoryCounterBackend(CounterBackend):
+    def __init__(self, sweep_every: int = 10000):
+        # key -> (tokens, updated, period)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+        self._sweep_every = sweep_every
+
+    def take(self, key: str, rule: Rule, now: float) -> float:
+        with self._lock:
+            self._ops += 1
+            if self._ops % self._sweep_every == 0:
+                self._sweep(now)
+            tokens, updated, _ = self._buckets.get(key, (rule.capacity, now, rule.period))
+            tokens = min(rule.capacity, tokens + (now - updated) * rule.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, rule.period)
+                return (1 - tokens) / rule.rate
+            self._buckets[key] = (tokens - 1, now, rule.period)
+            return 0.0
+
+    def _sweep(self, now: float) -> None:
+        # A bucket idle for a full period has refilled, which is the same as
+        # having no entry at all.
+        self._buckets = {k: v for k, v in self._buckets.items() if v[1] + v[2] > now}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteCounterBackend(CounterBackend):
+    """Buckets in a SQLite file shared by every process on the host."""
+
+    def __init__(self, path: str, sweep_every: int = 10000):
+        self.path = path
+        self._local = threading.local()
+        self._ops = 0
+        self._sweep_every = sweep_every
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, rule: Rule, now: float) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row is not None else (rule.capacity, now)
+            tokens = min(rule.capacity, tokens + (now - updated) * rule.rate)
+            retry_after = (1 - tokens) / rule.rate if tokens < 1 else 0.0
+            if not retry_after:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, "
+                "updated = excluded.updated, full_at = excluded.full_at",
+                (key, tokens, now, now + rule.period),
+            )
+            self._ops += 1
+            if self._ops % self._sweep_every == 0:
+                conn.execute("DELETE FROM rate_buckets WHERE full_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return retry_after
+
+
+class RateLimiter:
+    def __init__(self, backend: CounterBackend, rules: Optional[Dict[str, Rule]] = None, enabled: bool = True):
+        self.backend = backend
+        self.rules = dict(DEFAULT_RULES if rules is None else rules)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._rejected = 0
+
+    @classmethod
+    def from_env(cls, data_dir: str, shared: bool = False) -> "RateLimiter":
+        """Build from ``RATE_LIMIT_*`` variables.
+
+        ``RATE_LIMIT_BACKEND`` is ``memory`` or ``sqlite``, by default
+        ``sqlite`` when ``shared`` (the user store is shared between worker
+        processes); each rule can be overridden with e.g.
+        ``RATE_LIMIT_LOGIN_IP=20/60``.
+        """
+        rules = {}
+        for scope, rule in DEFAULT_RULES.items():
+            spec = os.getenv(f"RATE_LIMIT_{scope.upper()}")
+            rules[scope] = Rule.parse(spec) if spec else rule
+        if os.getenv("RATE_LIMIT_BACKEND", "sqlite" if shared else "memory").lower() == "sqlite":
+            backend: CounterBackend = SQLiteCounterBackend(
+                os.getenv("RATE_LIMIT_PATH", os.path.join(data_dir, "ratelimit.db"))
+            )
+        else:
+            backend = MemoryCounterBackend()
+        enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+        return cls(backend, rules, enabled)
+
+    def check(self, scope: str, key: str) -> float:
+        """Count a request against ``scope`` for ``key``. Returns the Retry-After
+        delay in seconds, or 0 if the request may proceed."""
+        if not self.enabled:
+            return 0.0
+        rule = self.rules[scope]
+        retry_after = self.backend.take(f"{scope}:{key.lower()}", rule, time.time())
+        with self._lock:
+            if retry_after:
+                self._rejected += 1
+            else:
+                self._allowed += 1
+        return retry_after
+
+    @staticmethod
+    def retry_after_header(retry_after: float) -> str:
+        return str(max(1, math.ceil(retry_after)))
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": type(self.backend).__name__,
+                "allowed": self._allowed,
+                "rejected": self._rejected,
+            }
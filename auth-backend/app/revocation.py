@@ -0,0 +1,245 @@
+"""Denylist of revoked access tokens.
+
+Every access token carries a random ``jti``. Logging out files that id
+under the hour its token expires; a Bloom filter in front of those hourly
+sets answers "not revoked" for almost every request without touching the
+sets, and an hour's set is dropped whole once every token in it has
+expired (the filter is then rebuilt from what is left). Revoking every
+session of a user records a cutoff instead: that subject's tokens issued
+before it are refused until the longest token lifetime has passed. None
+of this looks at the user store.
+
+With ``REVOCATION_BACKEND=sqlite`` revocations are also written to a
+SQLite file shared by every worker process on the host, and each process
+pulls rows it has not seen into its own filter at most every
+``sync_interval`` seconds.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Set
+
+from .storage import normalize_email
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest(), "little")
+        first, step = digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+        return ((first + i * step) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        bits = self._bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class RevocationList:
+    def __init__(
+        self,
+        max_ttl: float = 86400.0,
+        bucket_seconds: float = 3600.0,
+        capacity: int = 100000,
+        error_rate: float = 0.001,
+        path: Optional[str] = None,
+        sync_interval: float = 1.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_ttl = max_ttl
+        self.bucket_seconds = bucket_seconds
+        self.error_rate = error_rate
+        self.path = path
+        self.sync_interval = sync_interval
+        self._clock = clock
+        self._buckets: Dict[int, Set[str]] = {}
+        self._filter = BloomFilter(capacity, error_rate)
+        # normalized subject -> (cutoff, forget_at)
+        self._cutoffs: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        now = clock()
+        self._next_drop = self._bucket_end(now)
+        self._next_sync = 0.0
+        self._synced_id = 0
+        self.checks = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+        self.rejected = 0
+        if path is not None:
+            self._conn().execute(
+                "CREATE TABLE IF NOT EXISTS revocations ("
+                "id INTEGER PRIMARY KEY, jti TEXT, subject TEXT, cutoff REAL, expires_at REAL NOT NULL)"
+            )
+            self._sync(now)
+
+    @classmethod
+    def from_env(cls, data_dir: str, max_ttl: float = 86400.0, shared: bool = False) -> "RevocationList":
+        """Build from ``REVOCATION_*`` variables; the backend defaults to
+        ``sqlite`` when ``shared`` (the user store is shared between workers)."""
+        path = None
+        if os.getenv("REVOCATION_BACKEND", "sqlite" if shared else "memory").lower() == "sqlite":
+            path = os.getenv("REVOCATION_PATH", os.path.join(data_dir, "revocations.db"))
+        return cls(
+            max_ttl=max_ttl,
+            capacity=int(os.getenv("REVOCATION_FILTER_CAPACITY", "100000")),
+            path=path,
+            sync_interval=float(os.getenv("REVOCATION_SYNC_INTERVAL", "1")),
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _bucket_end(self, timestamp: float) -> float:
+        return (int(timestamp // self.bucket_seconds) + 1) * self.bucket_seconds
+
+    def _file(self, jti: str, expires_at: float) -> None:
+        keys = self._buckets.setdefault(int(expires_at // self.bucket_seconds), set())
+        if jti in keys:
+            return
+        keys.add(jti)
+        if len(self._filter) >= self._filter.capacity:
+            self._rebuild(self._filter.capacity * 2)
+        else:
+            self._filter.add(jti)
+
+    def _rebuild(self, capacity: int) -> None:
+        rebuilt = BloomFilter(capacity, self.error_rate)
+        for keys in self._buckets.values():
+            for jti in keys:
+                rebuilt.add(jti)
+        self._filter = rebuilt
+
+    def _drop_expired(self, now: float) -> None:
+        # A bucket is only dropped once the hour it covers is over, so every
+        # token filed in it has expired.
+        live = int(now // self.bucket_seconds)
+        expired = [bucket for bucket in self._buckets if bucket < live]
+        for bucket in expired:
+            del self._buckets[bucket]
+        self._cutoffs = {s: c for s, c in self._cutoffs.items() if c[1] > now}
+        if expired:
+            self._rebuild(self._filter.capacity)
+        self._next_drop = self._bucket_end(now)
+
+    def _apply(self, jti: Optional[str], subject: Optional[str], cutoff: Optional[float], expires_at: float) -> None:
+        if jti is not None:
+            self._file(jti, expires_at)
+        if subject is not None and cutoff is not None:
+            current = self._cutoffs.get(subject)
+            if current is None or current[0] < cutoff:
+                self._cutoffs[subject] = (cutoff, expires_at)
+
+    def _sync(self, now: float) -> None:
+        rows = self._conn().execute(
+            "SELECT id, jti, subject, cutoff, expires_at FROM revocations WHERE id > ? AND expires_at > ? ORDER BY id",
+            (self._synced_id, now),
+        ).fetchall()
+        with self._lock:
+            for row_id, jti, subject, cutoff, expires_at in rows:
+                self._apply(jti, subject, cutoff, expires_at)
+                self._synced_id = max(self._synced_id, row_id)
+            self._next_sync = now + self.sync_interval
+
+    def _record(self, jti: Optional[str], subject: Optional[str], cutoff: Optional[float], expires_at: float) -> None:
+        now = self._clock()
+        with self._lock:
+            if now >= self._next_drop:
+                self._drop_expired(now)
+            self._apply(jti, subject, cutoff, expires_at)
+        if self.path is not None:
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO revocations (jti, subject, cutoff, expires_at) VALUES (?, ?, ?, ?)",
+                (jti, subject, cutoff, expires_at),
+            )
+            conn.execute("DELETE FROM revocations WHERE expires_at <= ?", (now,))
+
+    def revoke(self, jti: str, expires_at: Optional[float] = None) -> None:
+        """Refuse the token with ``jti`` until ``expires_at`` (its ``exp``)."""
+        if expires_at is None:
+            expires_at = self._clock() + self.max_ttl
+        self._record(jti, None, None, float(expires_at))
+
+    def revoke_subject(self, subject: str, issued_before: Optional[float] = None) -> float:
+        """Refuse every token for ``subject`` issued before ``issued_before`` (default now)."""
+        cutoff = self._clock() if issued_before is None else issued_before
+        self._record(None, normalize_email(subject), cutoff, cutoff + self.max_ttl)
+        return cutoff
+
+    def is_revoked(self, claims: dict) -> bool:
+        now = self._clock()
+        if self.path is not None and now >= self._next_sync:
+            self._sync(now)
+        if now >= self._next_drop:
+            with self._lock:
+                self._drop_expired(now)
+        self.checks += 1
+        if self._cutoffs:
+            subject = claims.get("sub")
+            cutoff = self._cutoffs.get(normalize_email(subject)) if isinstance(subject, str) else None
+            issued_at = claims.get("iat")
+            if cutoff is not None and (issued_at if isinstance(issued_at, (int, float)) else 0) < cutoff[0]:
+                self.rejected += 1
+                return True
+        jti = claims.get("jti")
+        if not isinstance(jti, str) or jti not in self._filter:
+            return False
+        self.filter_hits += 1
+        expires_at = claims.get("exp")
+        bucket = int(float(expires_at) // self.bucket_seconds) if isinstance(expires_at, (int, float)) else None
+        with self._lock:
+            if bucket is not None:
+                revoked = jti in self._buckets.get(bucket, ())
+            else:
+                revoked = any(jti in keys for keys in self._buckets.values())
+        if revoked:
+            self.rejected += 1
+        else:
+            self.false_positives += 1
+        return revoked
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "backend": "sqlite" if self.path is not None else "memory",
+                "revoked_tokens": sum(len(keys) for keys in self._buckets.values()),
+                "revoked_subjects": len(self._cutoffs),
+                "buckets": len(self._buckets),
+                "filter_bytes": len(self._filter._bits),
+                "filter_capacity": self._filter.capacity,
+                "checks": self.checks,
+                "filter_hits": self.filter_hits,
+                "false_positives": self.false_positives,
+                "rejected": self.rejected,
+            }
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
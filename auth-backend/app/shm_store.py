@@ -0,0 +1,378 @@
+"""User store in POSIX shared memory, shared by every worker on the host.
+
+``uvicorn app.main:app --workers N`` starts N processes, and with the
+memory store each would have its own users. ``SharedMemoryUserStore``
+keeps them in one named ``multiprocessing.shared_memory`` segment that
+every worker maps; the first worker to start creates it.
+
+Layout of the segment:
+
+* a 64-byte header: magic, capacity, index size, user count and a write
+  counter (``data_version``);
+* an open-addressing hash index with linear probing. Each 8-byte entry
+  holds a record number and 32 bits of the key's hash, so most probes
+  never touch a record;
+* fixed-size record slots, filled in signup order. A slot position is
+  also the pagination cursor.
+
+Reads take no lock and make no system call. Each slot starts with a
+sequence number that a writer makes odd while it changes the slot and
+even again when done (a seqlock); a reader copies the slot and retries if
+the number moved. Writers are serialized across processes by
+``fcntl.lockf`` on a lock file. A record is written before the index entry
+that points to it, and the count is raised last, so readers never see a
+half-added user. Users are never removed.
+
+Records are updated in place, so ``iter_snapshot`` copies the record
+slots up front. The copy is taken without the lock and kept only if the
+write counter did not move and no slot was mid-write; after a few failed
+tries it is taken under the write lock, which holds up writers for one
+memory copy rather than for the whole scan.
+
+The segment lives in RAM until it is unlinked (``python -m app.shm_store
+--unlink``) or the host reboots; it survives worker restarts but is not
+persisted to disk.
+"""
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .storage import UserRecord, UserStore, decode_cursor, encode_cursor, normalize_email
+
+MAGIC = b"AUTHSHM1"
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<8sIII")  # magic, capacity, index_slots, record_size
+_COUNT_OFFSET = 32
+_VERSION_OFFSET = 40
+_U64 = struct.Struct("<Q")
+_INDEX_ENTRY = struct.Struct("<II")  # record number + 1 (0 = empty), hash tag
+
+# seq, used, is_verified, id_len, password_len, email_len, key hash, created_us
+_RECORD_HEAD = struct.Struct("<IBBBBHQq")
+_SEQ = struct.Struct("<I")
+MAX_ID = 64
+MAX_PASSWORD = 64
+MAX_EMAIL = 254
+_ID_OFFSET = 32
+_PASSWORD_OFFSET = _ID_OFFSET + MAX_ID
+_EMAIL_OFFSET = _PASSWORD_OFFSET + MAX_PASSWORD
+RECORD_SIZE = _EMAIL_OFFSET + 256
+
+# A reader busy-waits this many times on a slot being written, then yields;
+# after _REPAIR_AFTER seconds it suspects the writer died mid-update.
+_SPIN_LIMIT = 64
+_REPAIR_AFTER = 0.05
+# Lock-free copies iter_snapshot tries before taking the write lock.
+_SNAPSHOT_ATTEMPTS = 3
+
+
+class StoreFullError(RuntimeError):
+    """The segment has no free record slot left."""
+
+
+def key_hash(key: str) -> int:
+    # Not the builtin hash(): that is salted differently in every process.
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _index_slots(capacity: int) -> int:
+    # Keep the load factor at or under one half.
+    slots = 1
+    while slots < capacity * 2:
+        slots <<= 1
+    return slots
+
+
+def _unpack_record(raw: bytes) -> Tuple[int, UserRecord]:
+    _, _, is_verified, id_len, password_len, email_len, hashed, created_us = _RECORD_HEAD.unpack_from(raw)
+    return hashed, UserRecord(
+        raw[_ID_OFFSET:_ID_OFFSET + id_len].decode("utf-8"),
+        raw[_EMAIL_OFFSET:_EMAIL_OFFSET + email_len].decode("utf-8"),
+        raw[_PASSWORD_OFFSET:_PASSWORD_OFFSET + password_len],
+        bool(is_verified),
+        created_us,
+    )
+
+
+def _open_segment(name: str, create: bool, size: int = 0) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:
+        # Before Python 3.13 every attached process registers the segment with
+        # its resource tracker, which unlinks it when that process exits.
+        segment = shared_memory.SharedMemory(name, create=create, size=size)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class SharedMemoryUserStore(UserStore):
+    shared = True
+
+    def __init__(self, name: str = "auth-users", capacity: int = 100000, lock_path: Optional[str] = None):
+        self.name = name
+        self.lock_path = lock_path or os.path.join("/tmp", f"{name}.lock")
+        self._lock_file = open(self.lock_path, "a+b")
+        self._thread_lock = threading.Lock()
+        self._owner: Optional[int] = None
+        with self._locked():
+            try:
+                self._segment = _open_segment(name, create=False)
+            except FileNotFoundError:
+                index_slots = _index_slots(capacity)
+                size = HEADER_SIZE + index_slots * _INDEX_ENTRY.size + capacity * RECORD_SIZE
+                self._segment = _open_segment(name, create=True, size=size)
+                _HEADER.pack_into(self._segment.buf, 0, MAGIC, capacity, index_slots, RECORD_SIZE)
+        self._buf = self._segment.buf
+        magic, self.capacity, self._slots, record_size = _HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            raise RuntimeError(f"Shared memory segment {name!r} holds an incompatible layout")
+        self._index = HEADER_SIZE
+        self._records = HEADER_SIZE + self._slots * _INDEX_ENTRY.size
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls, data_dir: str) -> "SharedMemoryUserStore":
+        name = os.getenv("USER_STORE_SHM_NAME", "auth-users")
+        return cls(
+            name,
+            capacity=int(os.getenv("USER_STORE_SHM_CAPACITY", "100000")),
+            lock_path=os.getenv("USER_STORE_PATH") or os.path.join(data_dir, f"{name}.lock"),
+        )
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # lockf locks belong to the process, so threads also need their own lock.
+        with self._thread_lock:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX)
+            self._owner = threading.get_ident()
+            try:
+                yield
+            finally:
+                self._owner = None
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+
+    def _count(self) -> int:
+        return _U64.unpack_from(self._buf, _COUNT_OFFSET)[0]
+
+    def _read(self, number: int) -> Tuple[int, UserRecord]:
+        """Return ``(key_hash, record)`` for record slot ``number``."""
+        buf = self._buf
+        start = self._records + number * RECORD_SIZE
+        spins = 0
+        deadline = None
+        while True:
+            seq = _SEQ.unpack_from(buf, start)[0]
+            if not seq & 1:
+                raw = bytes(buf[start:start + RECORD_SIZE])
+                if _SEQ.unpack_from(buf, start)[0] == seq:
+                    break
+            spins += 1
+            self.retries += 1
+            if spins < _SPIN_LIMIT:
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + _REPAIR_AFTER
+            elif time.monotonic() >= deadline:
+                self._repair(start)
+                deadline = None
+            time.sleep(0)
+        return _unpack_record(raw)
+
+    def _repair(self, start: int) -> None:
+        # Holding the write lock means no writer is active, so an odd
+        # sequence was left by a process that died mid-write.
+        if self._owner == threading.get_ident():
+            lock = contextlib.nullcontext()
+        else:
+            lock = self._locked()
+        with lock:
+            seq = _SEQ.unpack_from(self._buf, start)[0]
+            if seq & 1:
+                _SEQ.pack_into(self._buf, start, seq + 1)
+
+    def _find(self, key: str, hashed: int) -> Tuple[int, int, Optional[UserRecord]]:
+        """Probe for ``key``: ``(index_slot, record_number, record)``, or the free slot and -1."""
+        buf, mask, tag = self._buf, self._slots - 1, hashed >> 32
+        slot = hashed & mask
+        while True:
+            number, entry_tag = _INDEX_ENTRY.unpack_from(buf, self._index + slot * _INDEX_ENTRY.size)
+            if number == 0:
+                return slot, -1, None
+            if entry_tag == tag:
+                stored_hash, user = self._read(number - 1)
+                if stored_hash == hashed and normalize_email(user.email) == key:
+                    return slot, number - 1, user
+            slot = (slot + 1) & mask
+
+    def _write_record(self, number: int, user: UserRecord, hashed: int) -> None:
+        user_id, email = user.id.encode("utf-8"), user.email.encode("utf-8")
+        password = user.password_hash
+        if len(user_id) > MAX_ID or len(password) > MAX_PASSWORD or len(email) > MAX_EMAIL:
+            raise ValueError("User id, password hash or email too long for a shared memory record")
+        buf = self._buf
+        start = self._records + number * RECORD_SIZE
+        seq = _SEQ.unpack_from(buf, start)[0]
+        _SEQ.pack_into(buf, start, seq + 1)
+        _RECORD_HEAD.pack_into(
+            buf, start, seq + 1, 1, int(user.is_verified), len(user_id), len(password), len(email),
+            hashed, user.created_us,
+        )
+        buf[start + _ID_OFFSET:start + _ID_OFFSET + len(user_id)] = user_id
+        buf[start + _PASSWORD_OFFSET:start + _PASSWORD_OFFSET + len(password)] = password
+        buf[start + _EMAIL_OFFSET:start + _EMAIL_OFFSET + len(email)] = email
+        _SEQ.pack_into(buf, start, seq + 2)
+
+    def _bump_version(self) -> None:
+        _U64.pack_into(self._buf, _VERSION_OFFSET, _U64.unpack_from(self._buf, _VERSION_OFFSET)[0] + 1)
+
+    def _insert(self, user: dict) -> bool:
+        key = normalize_email(user["email"])
+        hashed = key_hash(key)
+        slot, number, _ = self._find(key, hashed)
+        if number >= 0:
+            return False
+        count = self._count()
+        if count >= self.capacity:
+            raise StoreFullError(f"Shared memory user store is full ({self.capacity} users)")
+        self._write_record(count, UserRecord.from_dict(user), hashed)
+        _INDEX_ENTRY.pack_into(self._buf, self._index + slot * _INDEX_ENTRY.size, count + 1, hashed >> 32)
+        _U64.pack_into(self._buf, _COUNT_OFFSET, count + 1)
+        return True
+
+    def data_version(self) -> Optional[int]:
+        return _U64.unpack_from(self._buf, _VERSION_OFFSET)[0]
+
+    def worker_id_dir(self) -> Optional[str]:
+        return f"{os.path.splitext(self.lock_path)[0]}.workers"
+
+    def get(self, email: str) -> Optional[UserRecord]:
+        key = normalize_email(email)
+        return self._find(key, key_hash(key))[2]
+
+    def add(self, user: dict) -> bool:
+        with self._locked():
+            added = self._insert(user)
+            if added:
+                self._bump_version()
+        if added:
+            self._notify(user["email"])
+        return added
+
+    def add_many(self, users: Iterable[dict]) -> int:
+        users = list(users)
+        with self._locked():
+            inserted = [user for user in users if self._insert(user)]
+            if inserted:
+                self._bump_version()
+        for user in inserted:
+            self._notify(user["email"])
+        return len(inserted)
+
+    def update(self, email: str, **fields) -> bool:
+        key = normalize_email(email)
+        hashed = key_hash(key)
+        with self._locked():
+            _, number, current = self._find(key, hashed)
+            if current is None:
+                return False
+            self._write_record(number, current.replace(**fields), hashed)
+            self._bump_version()
+        self._notify(email)
+        return True
+
+    def iter_users(self, is_verified: Optional[bool] = None) -> Iterator[UserRecord]:
+        # Each record is read consistently, but updates made during the scan
+        # may or may not show up.
+        for number in range(self._count()):
+            user = self._read(number)[1]
+            if is_verified is None or user.is_verified == is_verified:
+                yield user
+
+    def _copy_records(self) -> bytes:
+        """The filled record slots as of one moment."""
+        buf, start = self._buf, self._records
+        for _ in range(_SNAPSHOT_ATTEMPTS):
+            # Writers bump the version after the records they change, and
+            # raise the count last, so reading it first brackets the copy.
+            version = self.data_version()
+            raw = bytes(buf[start:start + self._count() * RECORD_SIZE])
+            if self.data_version() == version and not any(
+                _SEQ.unpack_from(raw, offset)[0] & 1 for offset in range(0, len(raw), RECORD_SIZE)
+            ):
+                return raw
+        with self._locked():
+            return bytes(buf[start:start + self._count() * RECORD_SIZE])
+
+    def iter_snapshot(self, is_verified: Optional[bool] = None) -> Iterator[UserRecord]:
+        raw = self._copy_records()
+        for offset in range(0, len(raw), RECORD_SIZE):
+            user = _unpack_record(raw[offset:offset + RECORD_SIZE])[1]
+            if is_verified is None or user.is_verified == is_verified:
+                yield user
+
+    def page(
+        self, cursor: Optional[str] = None, limit: int = 100, is_verified: Optional[bool] = None
+    ) -> Tuple[List[UserRecord], Optional[str]]:
+        position = decode_cursor(cursor) if cursor else 0
+        end = self._count()
+        result: List[UserRecord] = []
+        while position < end and len(result) < limit:
+            user = self._read(position)[1]
+            position += 1
+            if is_verified is None or user.is_verified == is_verified:
+                result.append(user)
+        return result, encode_cursor(position) if position < end else None
+
+    def __len__(self) -> int:
+        return self._count()
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "users": self._count(),
+            "capacity": self.capacity,
+            "segment_bytes": self._segment.size,
+            "version": self.data_version(),
+            "read_retries": self.retries,
+        }
+
+    def close(self) -> None:
+        self._buf = None
+        self._segment.close()
+        self._lock_file.close()
+
+    def unlink(self) -> None:
+        """Remove the segment; processes that still map it keep their view."""
+        # SharedMemory.unlink() would also unregister the segment from the
+        # resource tracker, which _open_segment has already done.
+        from _posixshmem import shm_unlink
+        shm_unlink(self._segment._name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or remove the shared memory user store")
+    parser.add_argument("--unlink", action="store_true", help="delete the segment and every user in it")
+    args = parser.parse_args()
+    try:
+        segment = _open_segment(os.getenv("USER_STORE_SHM_NAME", "auth-users"), create=False)
+    except FileNotFoundError:
+        parser.exit(1, "no shared memory user store\n")
+    segment.close()
+    store = SharedMemoryUserStore.from_env(".")
+    print(json.dumps(store.stats(), indent=2))
+    if args.unlink:
+        store.unlink()
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Version counters and ETags for conditional GETs.
+
+``VersionCounters`` listens to the user store: every signup, verification
+or import bumps a per-user counter and the collection counter. A response
+built from one user's record (the dashboard) is tagged with that user's
+version, a listing with the collection version, so a client that polls
+with ``If-None-Match`` gets a 304 without the record being read or any
+JSON being encoded. ``ResponseCache`` keeps the encoded body of recent
+responses next to the version they were built at.
+
+Counters live in the process. The ETag includes a random per-process
+prefix, so tags from a previous run or another worker never match by
+accident. For a store other processes write to (sqlite), any outside
+write is noticed through ``UserStore.data_version`` and invalidates every
+tag at once.
+"""
+import hashlib
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from .storage import UserStore, normalize_email
+
+
+class VersionCounters:
+    def __init__(self, store: Optional[UserStore] = None, max_users: int = 100000):
+        self.store = store
+        self.max_users = max_users
+        self.prefix = secrets.token_hex(4)
+        self._clock = 0
+        # Users not in ``_users`` are at version ``_floor``.
+        self._floor = 0
+        self._users: Dict[str, int] = {}
+        self._seen_data_version = store.data_version() if store is not None else None
+        self._lock = threading.Lock()
+        self.bumps = 0
+        self.resets = 0
+
+    def _reset(self) -> None:
+        self._clock += 1
+        self._floor = self._clock
+        self._users.clear()
+        self.resets += 1
+
+    def bump(self, email: str) -> None:
+        """Store listener: ``email`` was added or changed."""
+        key = normalize_email(email)
+        with self._lock:
+            self._clock += 1
+            self.bumps += 1
+            if key not in self._users and len(self._users) >= self.max_users:
+                self._reset()
+            self._users[key] = self._clock
+
+    def _check_store(self) -> None:
+        if self.store is None:
+            return
+        version = self.store.data_version()
+        if version is not None and version != self._seen_data_version:
+            with self._lock:
+                self._seen_data_version = version
+                self._reset()
+
+    def user(self, email: str) -> int:
+        self._check_store()
+        return self._users.get(normalize_email(email), self._floor)
+
+    def collection(self) -> int:
+        self._check_store()
+        return self._clock
+
+    def etag(self, key: Hashable, version: int) -> str:
+        digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).hexdigest()
+        return f'"{self.prefix}-{digest}-{version}"'
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "version": self._clock,
+            "tracked_users": len(self._users),
+            "bumps": self.bumps,
+            "resets": self.resets,
+        }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as ``If-None-Match`` calls for."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """Bounded LRU of encoded responses, each valid for one version."""
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[int, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")))
+
+    def get(self, key: Hashable, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, version: int, value) -> None:
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
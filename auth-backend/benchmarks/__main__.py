@@ -0,0 +1,118 @@
+"""Run the hot-path benchmarks and track regressions.
+
+    python -m benchmarks run --output results.json
+    python -m benchmarks run --quick --baseline baseline.json
+    python -m benchmarks compare baseline.json results.json --threshold 0.1
+
+``run`` writes a JSON results file; with ``--baseline`` it also compares.
+``compare`` exits with status 1 when any case is slower than the baseline
+by more than ``--threshold`` (a fraction), so it can gate a deploy.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from . import hot_paths
+
+QUICK_SIZES = "10000,100000"
+
+
+def environment() -> Dict[str, object]:
+    import bcrypt
+    import pydantic
+
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "bcrypt": getattr(bcrypt, "__version__", "unknown"),
+        "pydantic": pydantic.VERSION,
+    }
+
+
+def compare(baseline: Dict[str, dict], current: Dict[str, dict]) -> List[Tuple[str, float, float, float]]:
+    """Return ``(name, baseline_ops, current_ops, change)`` for every case in both runs."""
+    rows = []
+    for name, stats in current.items():
+        before = baseline.get(name)
+        if not before or before.get("skipped") or stats.get("skipped"):
+            continue
+        change = stats["ops_per_s"] / before["ops_per_s"] - 1
+        rows.append((name, before["ops_per_s"], stats["ops_per_s"], change))
+    return rows
+
+
+def report(rows: List[Tuple[str, float, float, float]], threshold: float) -> int:
+    regressions = 0
+    print(f"{'case':>40}  {'baseline':>14}  {'current':>14}  change")
+    for name, before, after, change in rows:
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:>40}  {before:14,.1f}  {after:14,.1f}  {change:+7.1%}{flag}")
+    if regressions:
+        print(f"{regressions} regression(s) beyond {threshold:.0%}")
+    return regressions
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Auth hot-path benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the suite and write a results file")
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    run_parser.add_argument("--seconds", type=float, default=1.0, help="time per case")
+    run_parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost to measure")
+    run_parser.add_argument("--sizes", default="10000,1000000,10000000")
+    run_parser.add_argument("--engines", default="memory")
+    run_parser.add_argument("--lookups", type=int, default=20000)
+    run_parser.add_argument("--only", help="comma-separated groups: hashing,tokens,parsing,encoding,store")
+    run_parser.add_argument("--quick", action="store_true", help=f"short runs, sizes {QUICK_SIZES}")
+    run_parser.add_argument("--baseline", help="compare against this results file")
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        baseline, current = load(args.baseline), load(args.current)
+        if baseline.get("environment") != current.get("environment"):
+            print("warning: results were recorded in different environments")
+        rows = compare(baseline["results"], current["results"])
+        sys.exit(1 if report(rows, args.threshold) else 0)
+
+    sizes = QUICK_SIZES if args.quick else args.sizes
+    results = hot_paths.run(
+        seconds=0.3 if args.quick else args.seconds,
+        rounds=args.rounds,
+        sizes=[int(s) for s in sizes.split(",")],
+        engines=args.engines.split(","),
+        lookups=args.lookups,
+        only=args.only.split(",") if args.only else None,
+    )
+    document = {"created_at": time.time(), "environment": environment(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    print(f"wrote {args.output}")
+
+    if args.baseline:
+        rows = compare(load(args.baseline)["results"], results)
+        sys.exit(1 if report(rows, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
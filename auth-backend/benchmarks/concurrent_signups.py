@@ -0,0 +1,185 @@
+"""Concurrency stress test for signup: duplicate ids and double inserts.
+
+Many threads sign up an overlapping set of emails at once, each taking a
+user id the way signup does, and the run checks that every email was
+inserted exactly once and no two users share an id:
+
+    python -m benchmarks.concurrent_signups --threads 256 --emails 50000 --attempts 4
+
+``--processes`` races that many worker processes, each with its own
+threads and ``IdGenerator``, against one shared store (``sqlite`` or
+``shm``), the way ``uvicorn --workers`` would:
+
+    python -m benchmarks.concurrent_signups --engines shm,sqlite --processes 8 --threads 16
+
+``--id-scheme len`` uses the old ``user_{len(users_db) + 1}`` ids for
+comparison. The interpreter's switch interval is lowered so threads are
+preempted between the steps of a signup as often as possible. Exits with
+status 1 if any check fails.
+"""
+import argparse
+import multiprocessing
+import queue
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from app.ids import IdGenerator
+
+from .store_lookup import FAKE_HASH, build_store, discard_store
+
+
+def id_source(scheme: str, store) -> Callable[[], str]:
+    if scheme == "len":
+        return lambda: f"user_{len(store) + 1}"
+    # Claims a worker id through the store when it is shared, like the app.
+    generator = IdGenerator(claim_dir=store.worker_id_dir())
+    return lambda: f"user_{generator.next_id()}"
+
+
+def sign_up(
+    store, next_id: Callable[[], str], first: int, stride: int, threads: int, emails: int, total: int
+) -> Tuple[List[tuple], float]:
+    """Run ``threads`` threads over attempts ``first``, ``first + 1``, ... taking
+    every ``stride``th one. Returns the ``(user_id, email)`` rows inserted and
+    the seconds taken."""
+    created_at = datetime.utcnow()
+    won: List[List[tuple]] = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads)
+
+    def signup(worker: int) -> None:
+        results = won[worker]
+        barrier.wait()
+        # Every email is tried ``attempts`` times, by different threads.
+        for n in range(first + worker, total, stride):
+            email = f"user{n % emails}@example.com"
+            user_id = next_id()
+            if store.add({
+                "id": user_id,
+                "email": email,
+                "password": FAKE_HASH,
+                "is_verified": False,
+                "created_at": created_at,
+            }):
+                results.append((user_id, email))
+
+    workers = [threading.Thread(target=signup, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return [row for rows in won for row in rows], elapsed
+
+
+def sign_up_process(
+    engine: str, directory: str, scheme: str, index: int, processes: int, threads: int,
+    emails: int, total: int, switch_interval: float, start, results,
+) -> None:
+    sys.setswitchinterval(switch_interval)
+    store = build_store(engine, directory, emails)
+    next_id = id_source(scheme, store)
+    start.wait()
+    results.put(sign_up(store, next_id, index * threads, processes * threads, threads, emails, total))
+    store.close()
+
+
+def race_processes(
+    engine: str, directory: str, scheme: str, processes: int, threads: int, emails: int, total: int
+) -> Tuple[List[tuple], float]:
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(processes)
+    results = context.Queue()
+    children = [
+        context.Process(
+            target=sign_up_process,
+            args=(engine, directory, scheme, index, processes, threads, emails, total,
+                  sys.getswitchinterval(), start, results),
+        )
+        for index in range(processes)
+    ]
+    for child in children:
+        child.start()
+    runs = []
+    # Drain the queue before joining, or a child blocks flushing its result.
+    while len(runs) < processes:
+        try:
+            runs.append(results.get(timeout=1))
+        except queue.Empty:
+            if any(child.exitcode not in (None, 0) for child in children):
+                for child in children:
+                    child.terminate()
+                raise RuntimeError("a signup process failed")
+    for child in children:
+        child.join()
+    return [row for rows, _ in runs for row in rows], max(elapsed for _, elapsed in runs)
+
+
+def run_case(
+    engine: str, scheme: str, processes: int, threads: int, emails: int, attempts: int
+) -> Dict[str, object]:
+    if processes > 1 and engine == "memory":
+        raise ValueError("the memory store cannot be shared between processes")
+    with tempfile.TemporaryDirectory() as directory:
+        store = build_store(engine, directory, emails)
+        total = emails * attempts
+        if processes > 1:
+            winners, elapsed = race_processes(engine, directory, scheme, processes, threads, emails, total)
+        else:
+            winners, elapsed = sign_up(store, id_source(scheme, store), 0, threads, threads, emails, total)
+
+        ids = Counter(user_id for user_id, _ in winners)
+        listed = [user["email"] for user in store.iter_users()]
+        result = {
+            "engine": engine,
+            "id_scheme": scheme,
+            "processes": processes,
+            "threads": threads,
+            "attempts": total,
+            "inserted": len(winners),
+            "double_inserts": len(winners) - len({email for _, email in winners}),
+            "duplicate_ids": sum(count - 1 for count in ids.values() if count > 1),
+            "missing": emails - len(set(listed)),
+            "stored": len(store),
+            "listed_twice": len(listed) - len(set(listed)),
+            "signups_per_s": round(total / elapsed),
+        }
+        discard_store(store)
+    result["ok"] = not (
+        result["double_inserts"] or result["duplicate_ids"] or result["missing"]
+        or result["listed_twice"] or result["stored"] != emails
+    )
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent signups: duplicate ids and double inserts")
+    parser.add_argument("--threads", default="16,64,256", help="comma-separated thread counts (per process)")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes sharing an sqlite or shm store")
+    parser.add_argument("--emails", type=int, default=20000)
+    parser.add_argument("--attempts", type=int, default=4, help="signups per email")
+    parser.add_argument("--engines", default="memory")
+    parser.add_argument("--id-scheme", choices=("snowflake", "len"), default="snowflake")
+    parser.add_argument("--switch-interval", type=float, default=1e-6, help="seconds, see sys.setswitchinterval")
+    args = parser.parse_args()
+
+    sys.setswitchinterval(args.switch_interval)
+    failed = 0
+    for engine in args.engines.split(","):
+        for threads in (int(count) for count in args.threads.split(",")):
+            row = run_case(engine, args.id_scheme, args.processes, threads, args.emails, args.attempts)
+            failed += not row["ok"]
+            print(f"{engine:>7} {args.id_scheme:>9} {args.processes:>2}x{threads:>4} threads: {row['inserted']:>7,} of "
+                  f"{row['attempts']:,} inserted  double inserts {row['double_inserts']}  "
+                  f"duplicate ids {row['duplicate_ids']}  missing {row['missing']}  "
+                  f"{row['signups_per_s']:>8,}/s  {'ok' if row['ok'] else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
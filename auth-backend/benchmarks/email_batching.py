@@ -0,0 +1,92 @@
+"""Brevo requests per verification email during a signup burst.
+
+Starts ``tools/brevo_stub.py`` in-process, queues a burst of verification
+emails on the outbox and counts the API requests it takes to deliver
+them, one message per request versus batched ``messageVersions``:
+
+    python -m benchmarks.email_batching --emails 2000 --rate 500 --batch-sizes 1,50,200
+
+``--bad`` addresses the stub rejects are mixed in, to check that a batch
+Brevo refuses still delivers every good message and dead-letters only the
+bad ones.
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from tools import brevo_stub
+
+
+def run_case(main, batch_size: int, window_ms: int, emails: int, rate: float, bad: int) -> Dict[str, object]:
+    from app.outbox import EmailOutbox
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = EmailOutbox(
+            os.path.join(tmp, "outbox.db"),
+            main.send_verification_email,
+            workers=2,
+            max_attempts=1,
+            deliver_batch=main.send_verification_emails,
+            batch_size=batch_size,
+            batch_window=window_ms / 1000,
+        )
+        requests_before = main.mail_client.stats()["requests"]
+        bad_every = emails // bad if bad else 0
+        started = time.perf_counter()
+        for i in range(emails):
+            domain = "invalid.test" if bad_every and i % bad_every == 0 else "example.com"
+            outbox.enqueue(f"burst{i}@{domain}", "12345")
+            if rate:
+                # Hold the arrival rate, not the per-call sleep.
+                delay = started + (i + 1) / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        while outbox.stats()["pending"]:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        stats = outbox.stats()
+        outbox.stop()
+    return {
+        "batch_size": batch_size,
+        "emails": emails,
+        "delivered": stats["delivered"],
+        "dead_letters": stats["dead_letters"],
+        "api_requests": main.mail_client.stats()["requests"] - requests_before,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Brevo requests per email, batched vs unbatched")
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500, help="signups per second, 0 for all at once")
+    parser.add_argument("--batch-sizes", default="1,50,200")
+    parser.add_argument("--window-ms", type=int, default=200)
+    parser.add_argument("--bad", type=int, default=0, help="how many recipients the stub should reject")
+    args = parser.parse_args()
+
+    server = brevo_stub.serve(0, reject_suffix="@invalid.test")
+    os.environ["BREVO_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["BREVO_API_KEY"] = "stub"
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ.setdefault("BREVO_BREAKER_THRESHOLD", "1000000")
+    from app import main as app_main
+
+    rows: List[Dict[str, object]] = []
+    # The stub prints every message it accepts.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+            rows.append(run_case(app_main, batch_size, args.window_ms, args.emails, args.rate, args.bad))
+    server.shutdown()
+    for row in rows:
+        print(f"batch {row['batch_size']:>4}: {row['api_requests']:>6,} requests for {row['emails']:,} emails "
+              f"({row['emails'] / max(1, row['api_requests']):6.1f}/request)  delivered {row['delivered']:,}  "
+              f"dead {row['dead_letters']}  {row['elapsed_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
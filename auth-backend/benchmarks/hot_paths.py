@@ -0,0 +1,192 @@
+"""Microbenchmarks of the request hot paths.
+
+Each case runs in timed batches, repeated a few times, and reports the
+median throughput so one noisy batch does not skew the result. Results
+are plain dicts so the runner in ``__main__`` can write them out and
+compare them against a baseline.
+"""
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel, EmailStr
+
+from app.hashing import PasswordHasher
+from app.token_codec import HS256Codec
+
+from .store_lookup import build_store, discard_store, make_user, percentile, populate
+
+SECRET = "benchmark-secret-key"
+PASSWORD = "correct horse battery staple"
+
+
+# Same shapes as the request models in app.main; importing app.main would
+# open the outbox and user store as a side effect.
+class UserSignup(BaseModel):
+    email: EmailStr
+    password: str
+
+
+class UserLogin(BaseModel):
+    email: EmailStr
+    password: str
+
+
+def measure(fn: Callable[[], object], seconds: float, repeats: int = 3, min_calls: int = 1) -> Dict[str, float]:
+    """Median and best ops/s of ``fn`` over ``repeats`` timed runs."""
+    fn()
+    # Size batches so timer overhead stays small for sub-microsecond calls.
+    started = time.perf_counter()
+    fn()
+    once = max(time.perf_counter() - started, 1e-7)
+    batch = max(1, min(1000, int(0.01 / once)))
+    rates = []
+    for _ in range(repeats):
+        calls = 0
+        started = time.perf_counter()
+        deadline = started + seconds / repeats
+        while calls < min_calls or time.perf_counter() < deadline:
+            for _ in range(batch):
+                fn()
+            calls += batch
+        rates.append(calls / (time.perf_counter() - started))
+    return {"ops_per_s": statistics.median(rates), "best_ops_per_s": max(rates)}
+
+
+def bench_hashing(seconds: float, rounds: int) -> Dict[str, dict]:
+    hasher = PasswordHasher(rounds=rounds, workers=1)
+    hashed = hasher.hash(PASSWORD)
+    try:
+        return {
+            f"hash_password[rounds={rounds}]": measure(lambda: hasher.hash(PASSWORD), seconds, min_calls=3),
+            f"verify_password[rounds={rounds}]": measure(lambda: hasher.verify(PASSWORD, hashed), seconds, min_calls=3),
+        }
+    finally:
+        hasher.shutdown()
+
+
+def bench_tokens(seconds: float) -> Dict[str, dict]:
+    codec = HS256Codec(SECRET)
+
+    def create_access_token():
+        return codec.encode({"sub": "someone@example.com", "exp": datetime.utcnow() + timedelta(minutes=1440)})
+
+    token = create_access_token()
+    return {
+        "create_access_token": measure(create_access_token, seconds),
+        "decode_access_token": measure(lambda: codec.decode(token), seconds),
+    }
+
+
+def bench_parsing(seconds: float) -> Dict[str, dict]:
+    body = json.dumps({"email": "Someone@Example.com", "password": PASSWORD})
+    return {
+        "parse_user_signup": measure(lambda: UserSignup(**json.loads(body)), seconds),
+        "parse_user_login": measure(lambda: UserLogin(**json.loads(body)), seconds),
+    }
+
+
+def bench_encoding(seconds: float) -> Dict[str, dict]:
+    user = {
+        "id": "user_1",
+        "email": "someone@example.com",
+        "is_verified": True,
+        "created_at": datetime.utcnow(),
+    }
+    response = {
+        "access_token": HS256Codec(SECRET).encode({"sub": user["email"], "exp": 2000000000}),
+        "token_type": "bearer",
+        "user": {**user, "created_at": user["created_at"].isoformat()},
+    }
+    results = {"encode_login_response[json]": measure(lambda: json.dumps(response).encode(), seconds)}
+    try:
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import JSONResponse
+    except ImportError:
+        return results
+    fastapi_response = {**response, "user": user}
+    results["encode_login_response[fastapi]"] = measure(
+        lambda: JSONResponse(jsonable_encoder(fastapi_response)).body, seconds
+    )
+    return results
+
+
+def estimated_user_bytes(sample: int = 10000) -> float:
+    created_at = datetime.utcnow()
+    tracemalloc.start()
+    store = build_store("memory", "")
+    store.add_many(make_user(i, created_at) for i in range(sample))
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return used / sample
+
+
+def available_memory() -> Optional[int]:
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def bench_store(sizes: List[int], engines: List[str], lookups: int) -> Dict[str, dict]:
+    results: Dict[str, dict] = {}
+    per_user = estimated_user_bytes()
+    for engine in engines:
+        for size in sizes:
+            name = f"users_db_get[{engine},{size}]"
+            free = available_memory()
+            if engine == "memory" and free is not None and size * per_user > free * 0.8:
+                print(f"skipping {name}: needs ~{size * per_user / 2**30:.1f} GiB")
+                results[name] = {"skipped": True}
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                store = build_store(engine, directory, size)
+                populate(store, size)
+                emails = [f"user{random.randrange(size)}@EXAMPLE.com" for _ in range(lookups)]
+                samples = []
+                started = time.perf_counter()
+                for email in emails:
+                    call_started = time.perf_counter()
+                    store.get(email)
+                    samples.append(time.perf_counter() - call_started)
+                elapsed = time.perf_counter() - started
+                discard_store(store)
+            results[name] = {
+                "ops_per_s": lookups / elapsed,
+                "p50_us": percentile(samples, 50) * 1e6,
+                "p99_us": percentile(samples, 99) * 1e6,
+            }
+    return results
+
+
+def run(
+    seconds: float = 1.0,
+    rounds: int = 12,
+    sizes: List[int] = (10000, 1000000, 10000000),
+    engines: List[str] = ("memory",),
+    lookups: int = 20000,
+    only: Optional[List[str]] = None,
+) -> Dict[str, dict]:
+    groups = {
+        "hashing": lambda: bench_hashing(seconds, rounds),
+        "tokens": lambda: bench_tokens(seconds),
+        "parsing": lambda: bench_parsing(seconds),
+        "encoding": lambda: bench_encoding(seconds),
+        "store": lambda: bench_store(list(sizes), list(engines), lookups),
+    }
+    results: Dict[str, dict] = {}
+    for group, bench in groups.items():
+        if only and group not in only:
+            continue
+        for name, stats in bench().items():
+            results[name] = stats
+            if stats.get("skipped"):
+                continue
+            print(f"{name:>40}: {stats['ops_per_s']:14,.1f} ops/s")
+    return results
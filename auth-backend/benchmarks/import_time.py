@@ -0,0 +1,132 @@
+"""Cold-start import time of the serverless routes, with a budget check.
+
+Each route is loaded through ``api/index.py`` in a fresh interpreter, the
+way a new function instance would load it. Runs from ``auth-backend/``:
+
+    python -m benchmarks.import_time              # report and enforce budgets
+    python -m benchmarks.import_time --profile 10 # plus the slowest imports
+    python -m benchmarks.import_time --budget healthz=30
+
+Exits with status 1 when a route goes over its budget or imports a
+module it should not.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Milliseconds, measured in-process after interpreter startup.
+BUDGETS_MS = {
+    "healthz": 60,
+    "metrics": 150,
+    "status": 150,
+    "admin-import": 150,
+    "admin-export": 150,
+    "dashboard": 150,
+    "logout": 150,
+    "logout-all": 150,
+    "users": 150,
+    "signup": 400,
+    "login": 400,
+    "verify-email": 400,
+}
+
+FORBIDDEN = {
+    "*": ("fastapi", "starlette", "jose"),
+    "healthz": ("api.shared", "pydantic", "bcrypt", "sqlite3", "orjson"),
+    "admin-import": ("api.bulk_import", "email_validator"),
+}
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import api.index
+api.index.load_route(sys.argv[1])
+elapsed = time.perf_counter() - started
+print(json.dumps({"ms": elapsed * 1000, "modules": sorted(sys.modules)}))
+"""
+
+
+def probe(route: str, env: Dict[str, str], importtime: bool = False) -> Tuple[dict, str]:
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE, route]
+    result = subprocess.run(command, cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def top_level_imports(importtime_output: str) -> List[Tuple[int, str]]:
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    # Only top-level entries of the tree; nested ones are already included.
+    return [(us, name.strip()) for us, name in rows if not name.startswith("  ")]
+
+
+def startup_imports(env: Dict[str, str]) -> set:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "pass"], env=env, capture_output=True, text=True, check=True
+    )
+    return {name for _, name in top_level_imports(result.stderr)}
+
+
+def run(routes: List[str], budgets: Dict[str, float], runs: int, profile: int) -> int:
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, OUTBOX_PATH=os.path.join(directory, "outbox.db"))
+        env.pop("USER_STORE", None)
+        startup = startup_imports(env) if profile else set()
+        for route in routes:
+            samples = []
+            for _ in range(runs):
+                result, _ = probe(route, env)
+                samples.append(result["ms"])
+            median = statistics.median(samples)
+            budget = budgets.get(route)
+            status = "ok"
+            if budget is not None and median > budget:
+                status = "OVER BUDGET"
+                failures += 1
+            forbidden = [
+                module for module in FORBIDDEN["*"] + FORBIDDEN.get(route, ())
+                if module in result["modules"]
+            ]
+            if forbidden:
+                status = f"imports {', '.join(forbidden)}"
+                failures += 1
+            budget_text = f"{budget:6.0f}ms" if budget is not None else "     -  "
+            print(f"{route:>13}: {median:7.1f}ms  budget {budget_text}  {len(result['modules']):4d} modules  {status}")
+            if profile:
+                _, trace = probe(route, env, importtime=True)
+                imports = [row for row in top_level_imports(trace) if row[1] not in startup]
+                for us, name in sorted(imports, reverse=True)[:profile]:
+                    print(f"{'':>15}{us / 1000:7.1f}ms  {name}")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serverless cold-start import budget")
+    parser.add_argument("--routes", default=",".join(BUDGETS_MS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--profile", type=int, default=0, help="show the N slowest top-level imports")
+    parser.add_argument("--budget", action="append", default=[], help="override, e.g. healthz=30")
+    args = parser.parse_args()
+    budgets = dict(BUDGETS_MS)
+    for override in args.budget:
+        route, _, ms = override.partition("=")
+        budgets[route] = float(ms)
+    failures = run(args.routes.split(","), budgets, args.runs, args.profile)
+    if failures:
+        print(f"{failures} route(s) failed the import budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
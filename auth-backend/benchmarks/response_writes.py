@@ -0,0 +1,145 @@
+"""Syscalls and bytes per syscall for the api/ response writers.
+
+Serves the same responses through the old send_response/send_header/
+end_headers/wfile.write sequence and through ``api/responses.py``, over a
+real socket pair whose send calls are counted:
+
+    python -m benchmarks.response_writes --requests 2000
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+from api import responses  # noqa: E402
+
+
+class CountingSocket:
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self.calls = 0
+        self.bytes = 0
+
+    def sendall(self, data) -> None:
+        self.calls += 1
+        self.bytes += len(data)
+        self._sock.sendall(data)
+
+    def send(self, data) -> int:
+        self.calls += 1
+        sent = self._sock.send(data)
+        self.bytes += sent
+        return sent
+
+    def sendmsg(self, buffers, *args) -> int:
+        self.calls += 1
+        sent = self._sock.sendmsg(buffers, *args)
+        self.bytes += sent
+        return sent
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+def login_payload() -> dict:
+    return {
+        "access_token": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." + "x" * 120 + "." + "y" * 43,
+        "token_type": "bearer",
+        "user": {"id": "user_1", "email": "someone@example.com", "is_verified": True,
+                 "created_at": datetime.utcnow().isoformat()},
+    }
+
+
+def users_payload() -> dict:
+    created_at = datetime.utcnow().isoformat()
+    return {
+        "users": [{"id": f"user_{i}", "email": f"user{i}@example.com", "is_verified": True,
+                   "created_at": created_at} for i in range(100)],
+        "total": 100,
+        "next_cursor": None,
+    }
+
+
+CASES = {
+    "invalid_credentials": (401, {"detail": "Invalid email or password"}, responses.INVALID_CREDENTIALS),
+    "login_success": (200, login_payload(), None),
+    "users_page_100": (200, users_payload(), None),
+}
+
+
+def make_handlers(status: int, payload: dict, static) -> Dict[str, type]:
+    class Legacy(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(status)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(payload).encode())
+
+        def log_message(self, *args):
+            pass
+
+    class Shared(Legacy):
+        def do_GET(self):
+            if static is not None:
+                responses.send(self, static)
+            else:
+                responses.send_json(self, status, payload)
+
+    return {"legacy": Legacy, "responses": Shared}
+
+
+def serve(handler_class: type, requests: int) -> Dict[str, float]:
+    calls = written = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        client, server = socket.socketpair()
+        client.sendall(b"GET / HTTP/1.0\r\n\r\n")
+        counted = CountingSocket(server)
+        handler_class(counted, ("127.0.0.1", 0), None)
+        server.close()
+        while client.recv(65536):
+            pass
+        client.close()
+        calls += counted.calls
+        written += counted.bytes
+    elapsed = time.perf_counter() - started
+    return {
+        "syscalls_per_response": calls / requests,
+        "bytes_per_syscall": written / calls,
+        "us_per_response": elapsed / requests * 1e6,
+    }
+
+
+def run(requests: int) -> List[dict]:
+    rows = []
+    for case, (status, payload, static) in CASES.items():
+        for writer, handler_class in make_handlers(status, payload, static).items():
+            stats = serve(handler_class, requests)
+            rows.append({"case": case, "writer": writer, **stats})
+            print(
+                f"{case:>20} {writer:>9}: {stats['syscalls_per_response']:4.1f} syscalls  "
+                f"{stats['bytes_per_syscall']:8.1f} bytes/syscall  {stats['us_per_response']:7.1f}us/response"
+            )
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bytes per syscall of the api/ response writers")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    responses.dumps({})
+    print(f"json encoder: {responses.encoder_name}")
+    run(args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Lookup latency of the user store engines at large user counts.
+
+    python -m benchmarks.store_lookup --sizes 10000,1000000 --engines memory,sqlite,shm
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from app.storage import MemoryUserStore, SQLiteUserStore, UserStore
+
+FAKE_HASH = "$2b$12$" + "a" * 53
+
+
+def make_user(i: int, created_at: datetime) -> dict:
+    return {
+        "id": f"user_{i}",
+        "email": f"User{i}@example.com",
+        "password": FAKE_HASH,
+        "is_verified": i % 2 == 0,
+        "created_at": created_at,
+        "verification_code": None,
+    }
+
+
+def populate(store: UserStore, size: int, chunk: int = 50000) -> None:
+    created_at = datetime.utcnow()
+    for start in range(0, size, chunk):
+        store.add_many(make_user(i, created_at) for i in range(start, min(size, start + chunk)))
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(store: UserStore, size: int, lookups: int) -> Dict[str, float]:
+    emails = [f"user{random.randrange(size)}@EXAMPLE.com" for _ in range(lookups)]
+    samples = []
+    for email in emails:
+        started = time.perf_counter()
+        store.get(email)
+        samples.append(time.perf_counter() - started)
+    return {
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+        "max_us": max(samples) * 1e6,
+    }
+
+
+def build_store(engine: str, directory: str, size: int = 0) -> UserStore:
+    if engine == "memory":
+        return MemoryUserStore()
+    if engine == "sqlite":
+        return SQLiteUserStore(os.path.join(directory, "bench-users.db"))
+    if engine == "shm":
+        from app.shm_store import SharedMemoryUserStore
+        # Named after the directory, so other processes given it open the same segment.
+        return SharedMemoryUserStore(
+            f"bench-users-{os.path.basename(directory)}",
+            capacity=max(size, 1),
+            lock_path=os.path.join(directory, "bench-users.lock"),
+        )
+    raise ValueError(f"Unknown engine: {engine}")
+
+
+def discard_store(store: UserStore) -> None:
+    # A shared memory segment outlives the process unless it is unlinked.
+    unlink = getattr(store, "unlink", None)
+    if unlink is not None:
+        unlink()
+    store.close()
+
+
+def run(sizes: List[int], engines: List[str], lookups: int) -> List[dict]:
+    results = []
+    for engine in engines:
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                store = build_store(engine, directory, size)
+                started = time.perf_counter()
+                populate(store, size)
+                load_seconds = time.perf_counter() - started
+                stats = measure(store, size, lookups)
+                discard_store(store)
+            results.append({"engine": engine, "size": size, "load_s": load_seconds, **stats})
+            print(
+                f"{engine:>7} {size:>10,} users  load {load_seconds:7.2f}s  "
+                f"p50 {stats['p50_us']:7.1f}us  p99 {stats['p99_us']:7.1f}us  max {stats['max_us']:8.1f}us"
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="User store lookup latency")
+    parser.add_argument("--sizes", default="10000,1000000")
+    parser.add_argument("--engines", default="memory,sqlite,shm")
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(",")], args.engines.split(","), args.lookups)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Bytes per user held by the in-memory user store.
+
+Compares the per-user dicts the store used to keep (string keys, a
+``datetime``, the hash as ``str`` and a copy of the verification code)
+with the ``UserRecord`` objects it keeps now. Every case is populated in
+a fresh interpreter and measured by its growth in resident memory:
+
+    python -m benchmarks.user_memory --sizes 1000000,10000000
+
+Sizes that would not fit in the available memory are skipped.
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.storage import MemoryUserStore, normalize_email
+
+from .hot_paths import available_memory
+
+FAKE_HASH = "$2b$12$" + "a" * 53
+LAYOUTS = ("dict", "record")
+
+
+def make_user(i: int, created_at: datetime) -> dict:
+    return {
+        "id": f"user_{1700000000000000 + i}",
+        "email": f"user{i}@example.com",
+        "password": FAKE_HASH[:-10] + f"{i:010d}",
+        "is_verified": i % 2 == 0,
+        "created_at": created_at,
+        "verification_code": str(10000 + i % 90000),
+    }
+
+
+class DictLayout:
+    """The store as it was: one dict per user, keyed by normalized email."""
+
+    def __init__(self):
+        self._users: Dict[str, dict] = {}
+        self._order: List[str] = []
+
+    def add(self, user: dict) -> None:
+        key = normalize_email(user["email"])
+        self._users[key] = dict(user)
+        self._order.append(key)
+
+
+def populate(layout: str, size: int):
+    store = DictLayout() if layout == "dict" else MemoryUserStore()
+    created_at = datetime.utcnow()
+    for i in range(size):
+        # A fresh datetime per user, as signups have.
+        store.add(make_user(i, created_at.replace(microsecond=i % 1000000)))
+    return store
+
+
+def resident_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def measure_child(layout: str, size: int) -> Dict[str, float]:
+    gc.collect()
+    before = resident_bytes()
+    store = populate(layout, size)
+    gc.collect()
+    grown = resident_bytes() - before
+    return {"layout": layout, "users": size, "bytes_per_user": grown / size}
+
+
+def estimate_bytes(layout: str, sample: int = 20000) -> float:
+    tracemalloc.start()
+    store = populate(layout, sample)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    return used / sample
+
+
+def run(sizes: List[int]) -> List[Dict[str, object]]:
+    rows = []
+    estimates = {layout: estimate_bytes(layout) for layout in LAYOUTS}
+    for size in sizes:
+        measured: Dict[str, Optional[float]] = {}
+        for layout in LAYOUTS:
+            free = available_memory()
+            # Resident growth runs above the traced estimate (allocator slack).
+            needed = size * estimates[layout] * 1.2
+            if free is not None and needed > free * 0.8:
+                print(f"{layout:>7} {size:>11,} users: skipped, needs ~{needed / 2**30:.1f} GiB")
+                measured[layout] = None
+                rows.append({"layout": layout, "users": size, "skipped": True})
+                continue
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.user_memory", "--child", layout, str(size)],
+                capture_output=True, text=True, check=True,
+            )
+            row = json.loads(result.stdout)
+            rows.append(row)
+            measured[layout] = row["bytes_per_user"]
+            print(f"{layout:>7} {size:>11,} users: {row['bytes_per_user']:7.1f} bytes/user  "
+                  f"({row['bytes_per_user'] * size / 2**30:.2f} GiB)")
+        if measured.get("dict") and measured.get("record"):
+            print(f"{'':>7} {size:>11,} users: records use {measured['record'] / measured['dict']:.0%} of the dict layout")
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory per user of the in-memory user store")
+    parser.add_argument("--sizes", default="1000000,10000000", help="comma-separated user counts")
+    parser.add_argument("--child", nargs=2, metavar=("LAYOUT", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure_child(args.child[0], int(args.child[1]))))
+        return
+    print("traced estimate: " + ", ".join(f"{layout} {estimate_bytes(layout):.0f} bytes/user" for layout in LAYOUTS))
+    run([int(size) for size in args.sizes.split(",")])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Minimal stand-in for the Brevo transactional email API.
+
+Run it and point the backend at it to exercise email delivery locally:
+
+    python tools/brevo_stub.py --port 8025
+    BREVO_API_URL=http://127.0.0.1:8025 BREVO_API_KEY=stub uvicorn app.main:app
+
+Every accepted message is printed, and the stub reports how many TCP
+connections it has seen so connection reuse is easy to check. Batched
+sends (``messageVersions``) get one message id per version back; with
+``--reject-suffix @invalid.test`` any request addressed to a matching
+recipient fails with a 400, as Brevo fails a whole batch for one bad
+address.
+"""
+import argparse
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_message_ids = itertools.count(1)
+_connections = itertools.count(1)
+
+
+class BrevoStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fail_status = 0
+    reject_suffix = ""
+
+    def setup(self):
+        super().setup()
+        print(f"stub: connection #{next(_connections)} from {self.client_address[0]}")
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.headers.get("api-key"):
+            self._reply(401, {"code": "unauthorized", "message": "Key not found"})
+            return
+        if self.fail_status:
+            self._reply(self.fail_status, {"code": "stub_failure", "message": "Configured to fail"})
+            return
+        if self.path != "/v3/smtp/email":
+            self._reply(404, {"code": "not_found", "message": self.path})
+            return
+        payload = json.loads(body or b"{}")
+        versions = payload.get("messageVersions")
+        recipients = [to["email"] for v in (versions or [payload]) for to in v.get("to", [])]
+        rejected = [email for email in recipients if self.reject_suffix and email.endswith(self.reject_suffix)]
+        if rejected:
+            self._reply(400, {"code": "invalid_parameter", "message": f"Invalid recipient: {rejected[0]}"})
+            return
+        if versions:
+            ids = [f"<stub-{next(_message_ids)}@brevo.local>" for _ in versions]
+            print(f"stub: batch of {len(ids)} to {[v['to'][0]['email'] for v in versions]}")
+            self._reply(201, {"messageIds": ids})
+        else:
+            message_id = f"<stub-{next(_message_ids)}@brevo.local>"
+            print(f"stub: message to {[to['email'] for to in payload.get('to', [])]}")
+            self._reply(201, {"messageId": message_id})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = 8025, fail_status: int = 0, reject_suffix: str = "") -> ThreadingHTTPServer:
+    BrevoStubHandler.fail_status = fail_status
+    BrevoStubHandler.reject_suffix = reject_suffix
+    server = ThreadingHTTPServer(("127.0.0.1", port), BrevoStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--fail-status", type=int, default=0, help="answer every send with this status")
+    parser.add_argument("--reject-suffix", default="", help="fail requests to recipients ending with this")
+    args = parser.parse_args()
+    server = serve(args.port, args.fail_status, args.reject_suffix)
+    print(f"Brevo stub listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,62 @@
+"""Keep the Vercel handlers' copies of the backend modules in step.
+
+The handlers in ``api/`` are deployed on their own, so every module under
+``app/`` except ``main.py`` is copied next to them. ``app/`` is the one to
+edit; after changing a module, copy it over:
+
+    python tools/sync_api.py
+
+and check before committing (exits with status 1 if a copy has drifted
+or is missing):
+
+    python tools/sync_api.py --check
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+from typing import List
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(BACKEND, "app")
+API_DIR = os.path.join(os.path.dirname(BACKEND), "api")
+
+# Modules that only the FastAPI app uses.
+APP_ONLY = {"main.py", "__init__.py"}
+
+
+def shared_modules() -> List[str]:
+    return sorted(
+        name for name in os.listdir(APP_DIR)
+        if name.endswith(".py") and name not in APP_ONLY
+    )
+
+
+def drifted() -> List[str]:
+    stale = []
+    for name in shared_modules():
+        copy = os.path.join(API_DIR, name)
+        if not os.path.exists(copy) or not filecmp.cmp(os.path.join(APP_DIR, name), copy, shallow=False):
+            stale.append(name)
+    return stale
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Copy shared backend modules into api/")
+    parser.add_argument("--check", action="store_true", help="only report copies that differ from app/")
+    args = parser.parse_args()
+    stale = drifted()
+    if args.check:
+        for name in stale:
+            print(f"api/{name} differs from auth-backend/app/{name}")
+        if stale:
+            print("run: python tools/sync_api.py")
+        sys.exit(1 if stale else 0)
+    for name in stale:
+        shutil.copyfile(os.path.join(APP_DIR, name), os.path.join(API_DIR, name))
+        print(f"copied app/{name} -> api/{name}")
+
+
+if __name__ == "__main__":
+    main()